@@ -0,0 +1,60 @@
+"""Startup benchmark of the application that background jobs run in
+
+Compares running a batch of jobs that each build their own CKAN application, which
+is what `provide_request_context` used to do, with running them on the application
+that is built once per worker.
+
+Run it from an environment where the extension is installed, passing the CKAN
+config file:
+
+    python benchmarks/job_app_benchmark.py --config /home/appuser/ckan.ini --jobs 10
+
+"""
+
+import argparse
+import statistics
+import time
+
+from ckan.cli import load_config
+from ckan.config.middleware import make_app
+from ckan.plugins import toolkit
+
+import ckanext.dalrrd_emc_dcpr as dalrrd_emc_dcpr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--jobs", type=int, default=10)
+    args = parser.parse_args()
+    config = load_config(args.config)
+    start = time.perf_counter()
+    make_app(config)
+    print(f"building the CKAN application took {time.perf_counter() - start:.2f}s")
+
+    per_job_timings = []
+    for _ in range(args.jobs):
+        start = time.perf_counter()
+        app = make_app(config)
+        with app._wsgi_app.test_request_context():
+            toolkit.url_for("home.index", _external=True)
+        per_job_timings.append(time.perf_counter() - start)
+
+    worker_timings = []
+    for _ in range(args.jobs):
+        start = time.perf_counter()
+        app = dalrrd_emc_dcpr.get_job_app()
+        with app._wsgi_app.test_request_context():
+            toolkit.url_for("home.index", _external=True)
+        worker_timings.append(time.perf_counter() - start)
+
+    per_job_median = statistics.median(per_job_timings)
+    worker_median = statistics.median(worker_timings)
+    print(f"median overhead of {args.jobs} jobs")
+    print(f"app built per job:    {per_job_median * 1000:.1f} ms")
+    print(f"app built per worker: {worker_median * 1000:.1f} ms")
+    print(f"speedup: {per_job_median / worker_median:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
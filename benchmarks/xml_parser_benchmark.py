@@ -0,0 +1,255 @@
+"""Micro-benchmark of the extraction of dataset fields from uploaded XML files
+
+Compares the single-pass extraction used by the `xml_parser` blueprint with the
+previous approach, which parsed the whole tree and then walked it once per field.
+The corpus mixes SANS 1878 documents, as produced by the EMC metadata template,
+with Esri/QGIS metadata exports.
+
+Run it from an environment where the extension is installed:
+
+    python benchmarks/xml_parser_benchmark.py --documents 200 --repeat 5
+
+"""
+
+import argparse
+import re
+import statistics
+import tempfile
+import time
+import typing
+from pathlib import Path
+from xml.etree import ElementTree as ET
+
+from ckanext.dalrrd_emc_dcpr.blueprints import xml_parser
+from ckanext.dalrrd_emc_dcpr.constants import (
+    CHARSET,
+    ISO_TOPIC_CATEGORIES,
+    MISSING_FIELDS,
+    ROLES,
+    XML_DATASET_NAMING_MAPPING,
+    XML_SANS_DATASET_NAMING_MAPPING,
+)
+
+_NUM_KEYWORDS = 40
+_NUM_ATTRIBUTES = 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = build_corpus(Path(tmp_dir), args.documents)
+        for current, legacy in zip(
+            extract_with_current(corpus), extract_with_legacy(corpus)
+        ):
+            if current != legacy:
+                raise RuntimeError(
+                    f"Extractions differ:\n  current: {current}\n  legacy: {legacy}"
+                )
+        legacy_timings = _time(extract_with_legacy, corpus, args.repeat)
+        current_timings = _time(extract_with_current, corpus, args.repeat)
+    legacy_median = statistics.median(legacy_timings)
+    current_median = statistics.median(current_timings)
+    print(f"{len(corpus)} documents, median of {args.repeat} runs")
+    print(f"legacy (parse + multi-pass): {legacy_median * 1000:.1f} ms")
+    print(f"current (single pass):       {current_median * 1000:.1f} ms")
+    print(f"speedup: {legacy_median / current_median:.2f}x")
+
+
+def build_corpus(target_dir: Path, num_documents: int) -> typing.List[Path]:
+    corpus = []
+    for index in range(num_documents):
+        if index % 2 == 0:
+            path = target_dir / f"sans_{index}.xml"
+            path.write_text(_build_sans_document(index), encoding="utf-8")
+        else:
+            path = target_dir / f"esri_{index}.xml"
+            path.write_text(_build_esri_document(index), encoding="utf-8")
+        corpus.append(path)
+    return corpus
+
+
+def extract_with_current(corpus: typing.List[Path]) -> typing.List[typing.Dict]:
+    result = []
+    for path in corpus:
+        extracted = xml_parser.extract_xml_fields(str(path), path.name)
+        result.append(xml_parser.map_xml_fields(extracted["fields"]))
+    return result
+
+
+def extract_with_legacy(corpus: typing.List[Path]) -> typing.List[typing.Dict]:
+    result = []
+    for path in corpus:
+        root = ET.parse(str(path)).getroot()
+        result.append(_legacy_map_xml_fields(_legacy_return_object_root(root)))
+    return result
+
+
+def _time(extract: typing.Callable, corpus: typing.List[Path], repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract(corpus)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _build_sans_document(index: int) -> str:
+    values = {
+        "title": f"SANS dataset {index}",
+        "notes": "Cadastral boundaries of the Western Cape",
+        "OwnerOrg": "sasdi-emc",
+        "ResponsiblePartyIndividualName": "Jane Doe",
+        "ResponsiblePartyRole": "Point of Contact",
+        "ResponsiblePartyPositionName": "GIS analyst",
+        "ReferenceDate": "2022-03-01",
+        "ReferenceDateType": "Publication",
+        "IsoTopicCategory": "boundaries",
+        "LineageStatement": "Digitized from 1:50 000 maps",
+        "DatasetLanguage": "English",
+        "MetadataLanguage": "English",
+        "DatasetCharacterset": "UTF-8",
+        "MetadataCharacterset": "UTF-8",
+        "DistributionFormatName": "Shapefile",
+        "DistributionFormatVersion": "1.0",
+        "spatial": "-22.1,16.4,-34.8,32.9",
+        "EquivalentScale": "50000",
+        "SpatialRepresentationType": "Vector",
+        "SpatialReferenceSystem": "EPSG:4326",
+        "StampDate": "2022-03-01",
+        "StampDateType": "Creation",
+    }
+    assert set(values).issubset(XML_DATASET_NAMING_MAPPING)
+    fields = "".join(f"<{tag}>{value}</{tag}>" for tag, value in values.items())
+    return f'<?xml version="1.0" encoding="UTF-8"?><dataset>{fields}</dataset>'
+
+
+def _build_esri_document(index: int) -> str:
+    keywords = "".join(
+        f"<keyword>keyword {number}</keyword>" for number in range(_NUM_KEYWORDS)
+    )
+    attributes = "".join(
+        f"<attr><attrlabl>FIELD_{number}</attrlabl><attrtype>String</attrtype>"
+        f"<attwidth>50</attwidth></attr>"
+        for number in range(_NUM_ATTRIBUTES)
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<metadata xml:lang="en">
+  <Esri>
+    <CreaDate>20220301</CreaDate><CreaTime>10454300</CreaTime>
+    <ArcGISFormat>1.0</ArcGISFormat><SyncOnce>TRUE</SyncOnce>
+  </Esri>
+  <dataIdInfo>
+    <idCitation>
+      <resTitle>Esri dataset {index}</resTitle>
+      <date><createDate>2022-03-01T00:00:00</createDate></date>
+      <citId><identCode>Esri dataset {index}</identCode></citId>
+    </idCitation>
+    <idAbs>Land cover of the Eastern Cape</idAbs>
+    <idPoC>
+      <rpIndName>Jane Doe</rpIndName>
+      <rpOrgName>sasdi-emc</rpOrgName>
+      <rpPosName>GIS analyst</rpPosName>
+      <role><RoleCd value="004"/></role>
+    </idPoC>
+    <dataChar><CharSetCd value="003"/></dataChar>
+    <tpCat><TopicCatCd value="009"/></tpCat>
+    <spatRpType><SpatRepTypCd value="001"/></spatRpType>
+    <dataScale><equScale><rfDenom>50000</rfDenom></equScale></dataScale>
+    <dataExt><geoEle><GeoBndBox>
+      <westBL>16.4</westBL><eastBL>32.9</eastBL>
+      <northBL>-22.1</northBL><southBL>-34.8</southBL>
+    </GeoBndBox></geoEle></dataExt>
+    <searchKeys>{keywords}</searchKeys>
+  </dataIdInfo>
+  <dqInfo><dataLineage>
+    <statement>Classified from imagery</statement>
+  </dataLineage></dqInfo>
+  <distInfo><distFormat>
+    <formatName>Shapefile</formatName><formatVer>1.0</formatVer>
+  </distFormat></distInfo>
+  <refSysInfo><RefSystem><refSysID>
+    <identCode code="4326"/><idCodeSpace>EPSG</idCodeSpace>
+    <idVersion>8.6.2 (10.8.1)</idVersion>
+  </refSysID></RefSystem></refSysInfo>
+  <mdDateSt>20220301</mdDateSt>
+  <eainfo><detailed>{attributes}</detailed></eainfo>
+</metadata>
+"""
+
+
+def _legacy_return_object_root(root):
+    """The extraction that `xml_parser` used before the single-pass rewrite"""
+    ob_root = {}
+    is_esri = False
+    for elem in root.iter():
+        if elem.tag == "Esri":
+            is_esri = True
+            break
+    if not is_esri:
+        num = 0
+        for field in root.iter():
+            if num > 0:
+                ob_root[field.tag] = field.text
+            num = num + 1
+    else:
+        for elem in XML_SANS_DATASET_NAMING_MAPPING:
+            tag = XML_SANS_DATASET_NAMING_MAPPING[elem]
+            for x in root.iter(tag):
+                value = x.text
+                if value is None:
+                    try:
+                        code_val = dict(x.attrib)["value"]
+                        if tag == "RoleCd":
+                            value = ROLES[int(code_val)]
+                        elif tag == "TopicCatCd":
+                            # the category name, which is what the current
+                            # extraction returns
+                            value = ISO_TOPIC_CATEGORIES[int(code_val)][0]
+                        elif tag == "CharSetCd":
+                            value = CHARSET[int(code_val)]
+                            if value == "eucKR":
+                                value = "UTF-8"
+                        else:
+                            value = code_val
+                    except Exception:
+                        pass
+                if tag == "idVersion":
+                    res = re.split(r"(\s)", value)
+                    res = [x for x in res if x != " "]
+                    value = f"{res[0]}{res[1]}"
+                ob_root[elem] = value
+        for x in root.iter("citId"):
+            ob_root["title"] = x[0].text
+        spatial_bbox = ""
+        for x in root.iter("northBL"):
+            spatial_bbox = spatial_bbox + x.text
+        for x in root.iter("westBL"):
+            spatial_bbox = spatial_bbox + "," + x.text
+        for x in root.iter("southBL"):
+            spatial_bbox = spatial_bbox + "," + x.text
+        for x in root.iter("eastBL"):
+            spatial_bbox = spatial_bbox + "," + x.text
+        ob_root["spatial"] = spatial_bbox
+        for field in MISSING_FIELDS:
+            ob_root[field] = MISSING_FIELDS[field]
+    return ob_root
+
+
+def _legacy_map_xml_fields(root: dict) -> dict:
+    import copy
+
+    root_cp = copy.deepcopy(root)
+    for k in root_cp.keys():
+        try:
+            db_field_name = XML_DATASET_NAMING_MAPPING[k]
+            root[db_field_name] = root.pop(k)
+        except KeyError:
+            pass
+    return root
+
+
+if __name__ == "__main__":
+    main()
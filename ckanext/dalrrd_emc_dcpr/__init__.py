@@ -1,15 +1,98 @@
+"""Shared utilities for running code outside of a web request
+
+Background jobs and some CLI commands need a Flask request context, e.g. to render
+templates or to build URLs. Building the CKAN application is expensive, as it loads
+all plugins and registers all blueprints, so it is built at most once per process:
+
+- when running under the `ckan` CLI (which is how `ckan jobs worker` is started),
+  the application that the CLI has already built is reused. RQ workers fork a new
+  process for each job, which inherits this application from the worker process;
+- otherwise, the application is built on first use and kept for the lifetime of the
+  process.
+
+Each job still gets its own, fresh, request context. The time each job waited in its
+queue and the time it took to run are recorded in `job_metrics`.
+
+"""
+
+import datetime as dt
 import functools
+import logging
+import threading
+import time
+import typing
 
 from ckan.config.middleware import make_app
 from ckan.plugins import toolkit
 
+from . import job_metrics
+
+logger = logging.getLogger(__name__)
+
+_job_app = None
+_job_app_lock = threading.Lock()
+
+
+def get_job_app():
+    """Return the CKAN application that background jobs run in"""
+    global _job_app
+    if _job_app is None:
+        with _job_app_lock:
+            if _job_app is None:
+                _job_app = _get_cli_app()
+                if _job_app is None:
+                    start = time.perf_counter()
+                    _job_app = make_app(toolkit.config)
+                    logger.info(
+                        f"Built CKAN application for background jobs in "
+                        f"{time.perf_counter() - start:.2f}s"
+                    )
+    return _job_app
+
 
 def provide_request_context(func):
     @functools.wraps(func)
     def wrapped(*args, **kwargs):
-        app = make_app(toolkit.config)
-        with app._wsgi_app.test_request_context() as context:
-            result = func(context, *args, **kwargs)
+        queued_seconds = _get_current_job_queued_seconds()
+        app = get_job_app()
+        start = time.perf_counter()
+        try:
+            with app._wsgi_app.test_request_context() as context:
+                result = func(context, *args, **kwargs)
+        finally:
+            run_seconds = time.perf_counter() - start
+            job_metrics.record_job(func.__name__, queued_seconds, run_seconds)
+            queued_msg = (
+                f"waited {queued_seconds:.2f}s in queue, "
+                if queued_seconds is not None
+                else ""
+            )
+            logger.info(f"Job {func.__name__!r} {queued_msg}ran in {run_seconds:.2f}s")
         return result
 
     return wrapped
+
+
+def _get_cli_app():
+    """Return the application built by the `ckan` CLI command that is running, if any"""
+    import click
+
+    click_context = click.get_current_context(silent=True)
+    command = getattr(click_context, "obj", None)
+    return getattr(command, "app", None)
+
+
+def _get_current_job_queued_seconds() -> typing.Optional[float]:
+    """Return how long the RQ job that is currently running has waited in its queue"""
+    try:
+        import rq
+
+        job = rq.get_current_job()
+    except Exception:
+        job = None
+    enqueued_at = getattr(job, "enqueued_at", None)
+    if enqueued_at is not None:
+        result = (dt.datetime.utcnow() - enqueued_at).total_seconds()
+    else:
+        result = None
+    return result
@@ -49,6 +49,24 @@ ckan.module("xml_parser",function($){
                 flash_box.append(info_or_err)
             }
 
+            let poll_status = function(status_url){
+                // files are processed in the background, report them once done
+                fetch(status_url).then(res=>res.json()).then((upload)=>{
+                    if(!upload.finished){
+                        setTimeout(()=>poll_status(status_url), 5000)
+                        return
+                    }
+                    for(let file of upload.files){
+                        if(file.state == "created"){
+                            msg_box_creation(["alert","fade-in","alert-info"], file.message)
+                        }
+                        else if(file.state != "rejected"){
+                            msg_box_creation(["warning-explanation","alert","alert-danger"], file.message)
+                        }
+                    }
+                }).catch(err=>console.log(err))
+            }
+
             fetch('/dataset/xml_parser/',{method:"POST", body:formData}).
             then(res => this._handleError(res)).
             then(res=>res.json()).then(
@@ -84,6 +102,9 @@ ckan.module("xml_parser",function($){
                     }
 
                     flash_box.style.display = "block"
+                    if(data.status_url != undefined){
+                        poll_status(data.status_url)
+                    }
                     // window.location.reload()
                 }
                 ).catch(err=>{
@@ -67,13 +67,18 @@ def _request_url_(params_nopage, requests_type, q=None, page=None):
 
 
 def _get_dcpr_request_list(ckan_action: str, should_show_create_action: bool = False):
+    page = h.get_page_number(request.args)
+    items_per_page = 20
     try:
-        dcpr_requests = toolkit.get_action(ckan_action)(
+        paginated_requests = toolkit.get_action(ckan_action)(
             context={
                 "user": toolkit.g.user,
                 "dictize_for_ui": True,
             },
-            data_dict={},
+            data_dict={
+                "limit": items_per_page,
+                "offset": (page - 1) * items_per_page,
+            },
         )
     except toolkit.NotAuthorized:
         result = toolkit.abort(
@@ -87,17 +92,18 @@ def _get_dcpr_request_list(ckan_action: str, should_show_create_action: bool = F
         ]
         params_nosort = [(k, v) for k, v in params_nopage]
         pager_url = partial(_request_url_, params_nosort, None)
-        page = h.get_page_number(request.args)
+        dcpr_requests = paginated_requests["results"]
         extra_vars = {
             "dcpr_requests": dcpr_requests,
             "statuses": get_status_labels(),
             "show_create_button": should_show_create_action,
             "page": h.Page(
                 collection=dcpr_requests,
-                items_per_page=20,
+                items_per_page=items_per_page,
                 url=pager_url,
                 page=page,
-                item_count=len(dcpr_requests),
+                item_count=paginated_requests["count"],
+                presliced_list=True,
             ),
         }
         result = toolkit.render("dcpr/list.html", extra_vars=extra_vars)
@@ -1,7 +1,9 @@
 import logging
 
 from ckan.plugins import toolkit
-from flask import Blueprint
+from flask import Blueprint, send_file
+
+from .. import thumbnails
 
 logger = logging.getLogger(__name__)
 
@@ -40,3 +42,17 @@ def request_dataset_management(dataset_id, management_command):
         )
     )
     return toolkit.redirect_to("dataset.read", id=dataset_id)
+
+
+@emc_blueprint.route("/thumbnails/<string:dataset_id>.png")
+def dataset_thumbnail(dataset_id):
+    try:
+        toolkit.check_access(
+            "package_show", {"user": toolkit.g.user}, {"id": dataset_id}
+        )
+    except (toolkit.ObjectNotFound, toolkit.NotAuthorized):
+        return toolkit.abort(404, toolkit._("Thumbnail not found"))
+    path = thumbnails.get_stored_thumbnail_path(dataset_id)
+    if path is None:
+        return toolkit.abort(404, toolkit._("Thumbnail not found"))
+    return send_file(str(path), mimetype="image/png", max_age=24 * 60 * 60)
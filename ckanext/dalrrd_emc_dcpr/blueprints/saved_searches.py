@@ -1,9 +1,9 @@
-import uuid
 from flask import Blueprint, request, jsonify
 from ckan.plugins import toolkit
-from ckan import model
 from ckan.common import c
-from datetime import date, datetime
+from datetime import date
+
+from .. import helpers, saved_searches
 
 saved_searches_blueprint = Blueprint(
     "saved_searches",
@@ -15,7 +15,11 @@ saved_searches_blueprint = Blueprint(
 
 @saved_searches_blueprint.route("/")
 def index():
-    return toolkit.render("saved_searches.html")
+    try:
+        page = helpers.get_saved_searches(cursor=request.args.get("cursor"))
+    except ValueError:
+        return toolkit.abort(400, toolkit._("Invalid page"))
+    return toolkit.render("saved_searches.html", extra_vars={"page": page})
 
 
 @saved_searches_blueprint.route(
@@ -26,12 +30,9 @@ def save_current_search():
     save the current search query with user_id
     """
     query = request.json
-    user_id = c.userobj.id
-    saved_search_id = uuid.uuid4()
-    saved_search_title = _get_saved_search_title(query)
-    q = f""" insert into saved_searches values('{saved_search_id}', '{user_id}', '{query}', '{saved_search_title}','{datetime.now()}') """
-    result = model.Session.execute(q)
-    model.Session.commit()
+    saved_searches.create_saved_search(
+        c.userobj.id, query, _get_saved_search_title(query)
+    )
     return jsonify({"status": 200})
 
 
@@ -59,7 +60,8 @@ def delete_saved_search():
     """
     if request.method == "POST":
         saved_search_id = request.json["saved_search_id"]
-        q = f""" delete from saved_searches where saved_search_id ='{saved_search_id}' """
-        model.Session.execute(q)
-        model.Session.commit()
-        return jsonify({"status": 200})
+        if saved_searches.delete_saved_search(saved_search_id, c.userobj):
+            result = jsonify({"status": 200})
+        else:
+            result = jsonify({"status": 404}), 404
+        return result
@@ -1,9 +1,9 @@
 from flask import request, Response, jsonify, Blueprint
 from ckan.plugins import toolkit
-from ckan import model
+from ckan import authz
 from ckan.common import c
 from ckan.logic import ValidationError
-from ckan.lib.mailer import mail_user, MailerException
+from ckan.lib.mailer import MailerException
 import xml.dom.minidom as dom
 from xml.etree import ElementTree as ET
 import logging
@@ -19,9 +19,11 @@ from ..constants import (
     CHARSET
 )
 from xml.parsers.expat import ExpatError
+from .. import email_notifications, xml_upload
 import json
 import re
 import os
+import typing
 
 
 # About this Blueprint:
@@ -40,64 +42,66 @@ xml_parser_blueprint = Blueprint(
     template_folder="templates",
 )
 
-creator = ""
 
-
-@xml_parser_blueprint.route("/", methods=["GET", "POST"], strict_slashes=False)
+@xml_parser_blueprint.route("/", methods=["POST"], strict_slashes=False)
 def extract_files():
     """
     the blueprint allows for multiple
-    files to be sent at once, extract
-    each and call parse_xml_dataset.
-    return success after all files
-    parsed.
-    """
-
-    # if request.method == "POST":
-    #     logger.debug("is POST")
-    #     return jsonify({"response": "all packages were created", "status": 200})
-    
-    # files = request.files.to_dict()
-    global creator
-    creator = c.userobj
+    files to be sent at once, they are
+    spooled to storage and processed by
+    background jobs. the uploader is
+    emailed once all files are processed.
+    """
+
+    if c.userobj is None:
+        return toolkit.abort(403, toolkit._("Not authorized to upload datasets"))
     xml_files = request.files.getlist("xml_dataset_files")
-    # loggin the request files.
-    logger.debug("from xml parser blueprint, the xmlfiles object should be:", xml_files)
-    err_msgs = []
-    info_msgs = []
-    for xml_file in xml_files:
-        if xml_file.content_type == 'text/xml':
-            check_result = check_file_fields(xml_file)
-            if check_result is None:
-                err_msgs.append(
-                    f'something went wrong during "{xml_file.filename}" dataset creation!'
-                )
-            if check_result["state"] == False:
-                err_msgs.append(check_result["msg"])
-            else:
-                info_msgs.append(check_result["msg"])
-        else:
-            err_msgs.append("Only xml files are allowed")
-    # aggregate messages
-    if len(err_msgs) > 0:
-        res = {"info_msgs": info_msgs, "err_msgs": err_msgs}
-        try:
-            send_email_to_creator(res)
-        except:
-            pass
-        return jsonify({"response": res})
+    logger.debug(f"from xml parser blueprint, the xml files are: {xml_files}")
+    if len(xml_files) == 0:
+        return toolkit.abort(400, toolkit._("No files were uploaded"))
+    upload_id = xml_upload.accept_upload(c.userobj, xml_files)
+    upload_status = xml_upload.get_upload_status(upload_id)
+    err_msgs = [
+        f["message"]
+        for f in upload_status["files"]
+        if f["state"] == xml_upload.XmlUploadFileState.REJECTED.value
+    ]
+    num_accepted = len(upload_status["files"]) - len(err_msgs)
+    info_msgs = [
+        toolkit._(
+            "{num} file(s) are being processed, you will be notified by email "
+            "when they are done"
+        ).format(num=num_accepted)
+    ]
+    return jsonify(
+        {
+            "response": {"info_msgs": info_msgs, "err_msgs": err_msgs},
+            "upload_id": upload_id,
+            "status_url": toolkit.url_for(
+                "xml_parser.upload_status", upload_id=upload_id
+            ),
+        }
+    )
 
-    else:
-        # only when all packages are created
-        res = {"info_msgs": info_msgs, "err_msgs": err_msgs}
-        try:
-            send_email_to_creator(res)
-        except:
-            pass
-        return jsonify({"response": "all packages were created", "status": 200})
+
+@xml_parser_blueprint.route("/uploads/<string:upload_id>")
+def upload_status(upload_id):
+    """
+    reports the progress of each file
+    of an upload
+    """
+    try:
+        upload_status = xml_upload.get_upload_status(upload_id)
+    except toolkit.ObjectNotFound:
+        return toolkit.abort(404, toolkit._("Upload not found"))
+    user_obj = c.userobj
+    is_uploader = user_obj is not None and user_obj.id == upload_status["user_id"]
+    if not (is_uploader or authz.is_sysadmin(c.user)):
+        return toolkit.abort(403, toolkit._("Not authorized to see this upload"))
+    return jsonify(upload_status)
 
 
-def check_file_fields(xml_file) -> dict:
+def check_file_fields(xml_file, file_name_reference: str) -> dict:
     """
     performs different checks over
     the xml files.
@@ -105,143 +109,160 @@ def check_file_fields(xml_file) -> dict:
     returns:
     -----
     object with status: False and a message
-    or status:True.
-    """
-    root = None
-    # has data check
-    dataset = file_has_xml_dataset(xml_file)
-    file_name_reference = xml_file.filename
-    if dataset["state"]:
-        root = dataset["root"]
-    else:
+    or status:True and the extracted
+    dataset.
+    """
+    # has data check, extracts the fields in the same pass
+    dataset = extract_xml_fields(xml_file, file_name_reference)
+    if not dataset["state"]:
         return dataset
-    if root is not None:
-        # return and object of the root
-        root = return_object_root(root)
-        # map standarized names into db fields names
-        root = map_xml_fields(root)
-        # has field more than maximum set
-        maximum_fields_check_ob = maximum_fields_check(root, file_name_reference)
-        if maximum_fields_check_ob["state"] == False:
-            return {"state": False, "msg": maximum_fields_check_ob["msg"]}
-        # has field less than minimum set
-        minimum_set_check_ob = minimum_set_check(root, file_name_reference)
-        if minimum_set_check_ob["state"] == False:
-            return {"state": False, "msg": minimum_set_check_ob["msg"]}
-        root = lowercase_dataset_values(root)
-        root = handle_responsible_party_choices_fields(root)
-        root = handle_numeric_choices(root)
-        root = set_language_abbreviation(root)
-        # root = handle_date_fields(root)
-        return create_ckan_dataset(root)
-
-        # things went ok
-    else:
-        return {"state": False, "msg": "something went wrong during dataset creation"}
+    # map standarized names into db fields names
+    root = map_xml_fields(dataset["fields"])
+    # has field more than maximum set
+    maximum_fields_check_ob = maximum_fields_check(root, file_name_reference)
+    if maximum_fields_check_ob["state"] == False:
+        return {"state": False, "msg": maximum_fields_check_ob["msg"]}
+    # has field less than minimum set
+    minimum_set_check_ob = minimum_set_check(root, file_name_reference)
+    if minimum_set_check_ob["state"] == False:
+        return {"state": False, "msg": minimum_set_check_ob["msg"]}
+    root = lowercase_dataset_values(root)
+    root = handle_responsible_party_choices_fields(root)
+    root = handle_numeric_choices(root)
+    root = set_language_abbreviation(root)
+    # root = handle_date_fields(root)
+    return {"state": True, "data_dict": root}
+
+
+def _get_sans_fields_by_tag() -> dict:
+    """
+    esri/qgis exports use the SANS 1878
+    tag names, some of them are mapped
+    into more than one field
+    """
+    fields_by_tag: typing.Dict[str, typing.List[str]] = {}
+    for field, tag in SANS_NAMING_MAPPING.items():
+        fields_by_tag.setdefault(tag, []).append(field)
+    return {tag: tuple(fields) for tag, fields in fields_by_tag.items()}
+
+
+# precompiled lookup tables for extract_xml_fields
+_SANS_FIELDS_BY_TAG = _get_sans_fields_by_tag()
+
+# code lists are referenced by their position
+_CODE_LISTS = {
+    "RoleCd": dict(enumerate(ROLES)),
+    "TopicCatCd": {
+        position: category
+        for position, (category, _) in enumerate(ISO_TOPIC_CATEGORIES)
+    },
+    "CharSetCd": {
+        position: "UTF-8" if charset == "eucKR" else charset
+        for position, charset in enumerate(CHARSET)
+    },
+}
+
+_ESRI_TAG = "Esri"
+_TITLE_TAG = "citId"
+_SPATIAL_REFERENCE_SYSTEM_TAG = "idVersion"
+_BBOX_TAGS = ("northBL", "westBL", "southBL", "eastBL")
+_EXTRACTED_TAGS = frozenset(
+    (_ESRI_TAG, _TITLE_TAG, *_BBOX_TAGS, *_SANS_FIELDS_BY_TAG.keys())
+)
+_WHITESPACE_PATTERN = re.compile(r"(\s)")
 
 
-def file_has_xml_dataset(xml_file):
+def extract_xml_fields(xml_file, file_name_reference: str) -> dict:
     """
-    parses the file,
-    checks if file has a
-    dataset within it and
-    returns it.
+    parses the file and transforms it
+    into an object of tag_name:tag_value,
+    walking the tree only once.
+
+    files exported from esri/qgis have
+    an Esri element, their fields are
+    named after SANS_NAMING_MAPPING.
     """
     try:
-        dom_ob = ET.parse(xml_file).getroot()
-    except ExpatError:
+        root = ET.parse(xml_file).getroot()
+    except (ET.ParseError, ExpatError):
         """
         this happens when the file is
         completely empty without any tags
         """
-        return {"state": False, "msg": f"file {xml_file.filename} is empty!"}
+        return {"state": False, "msg": f"file {file_name_reference} is empty!"}
+    if len(root) == 0:
+        return {"state": False, "msg": f"file {file_name_reference} is empty!"}
+
+    # the last element with a given tag wins
+    tag_values = {}
+    sans_values = {}
+    bbox_parts: typing.Dict[str, typing.List[str]] = {tag: [] for tag in _BBOX_TAGS}
+    title = None
+    is_esri = root.tag == _ESRI_TAG
+    elements = root.iter()
+    next(elements)  # skip the root element
+    for elem in elements:
+        tag = elem.tag
+        tag_values[tag] = elem.text
+        if tag not in _EXTRACTED_TAGS:
+            continue
+        if tag == _ESRI_TAG:
+            is_esri = True
+        elif tag == _TITLE_TAG:
+            if len(elem) > 0:
+                title = elem[0].text
+        elif tag in bbox_parts:
+            bbox_parts[tag].append(elem.text or "")
+        else:
+            value = _get_sans_value(elem)
+            for field in _SANS_FIELDS_BY_TAG[tag]:
+                sans_values[field] = value
 
-    root = dom_ob
-    if root:
-        """
-        this will cause the same problem as above
-        """
-        return {"state": True, "root": root}
+    if not is_esri:
+        ob_root = tag_values
     else:
-        return {"state": False, "msg": f"file {xml_file.filename} is empty!"}
-
-
-def return_object_root(root):
-    """
-    transform the xml dom
-    root into an object of
-    tag_name:tag_value
-    """
-    ob_root = {}
-    logger.debug(f"root object {root}")
-    is_Esri = False
-    
-    for elem in root.iter():
-        if elem.tag == 'Esri':
-            is_Esri = True
-            break
-    
-    if not is_Esri:
-        #run normal if not exported from esri/qgis
-        num = 0
-        for field in root.iter():
-            if num > 0:
-                ob_root[field.tag] = field.text
-            num = num + 1
-    else:
-        for elem in SANS_NAMING_MAPPING:
-            logger.debug(f"sans fields {elem} {SANS_NAMING_MAPPING[elem]}")
-            for x in root.iter(SANS_NAMING_MAPPING[elem]):
-                value = x.text
-                if value is None:
-                    logger.debug(f"NONE_VALUES {elem} {SANS_NAMING_MAPPING[elem]}")
-                    _attr = dict(x.attrib)
-                    try:
-                        code_val = _attr['value']
-                        if SANS_NAMING_MAPPING[elem] == 'RoleCd':
-                            value = ROLES[int(code_val)]
-                        elif SANS_NAMING_MAPPING[elem] == 'TopicCatCd':
-                            value = ISO_TOPIC_CATEGORIES[int(code_val)]
-                        elif SANS_NAMING_MAPPING[elem] == 'CharSetCd':
-                            value = CHARSET[int(code_val)]
-                            if value == 'eucKR':
-                                value = "UTF-8"
-                        else:
-                            value = code_val
-                    except:
-                        pass
-                logger.debug(f'final val {value}')
-                if SANS_NAMING_MAPPING[elem] == 'idVersion':
-                    res = re.split(r'(\s)', value)
-                    res = [x for x in res if x != ' ']
-                    logger.debug(f"split text {res}")
-                    value = f"{res[0]}{res[1]}"
-                ob_root[elem] = value
-
-        #handle title
-        for x in root.iter('citId'):
-            ob_root["title"] = x[0].text
-        
-        #handle spatal box
-        spatial_bbox = ""
-        for x in root.iter("northBL"):
-            spatial_bbox = spatial_bbox + x.text
-        for x in root.iter("westBL"):
-            spatial_bbox = spatial_bbox + "," + x.text
-        for x in root.iter("southBL"):
-            spatial_bbox = spatial_bbox + "," + x.text
-        for x in root.iter("eastBL"):
-            spatial_bbox = spatial_bbox + "," + x.text
-        
-        ob_root["spatial"] = spatial_bbox
-
-        #add missing fields needed for ckan
-        for field in MISSING_FIELDS:
-            ob_root[field] = MISSING_FIELDS[field]
-
+        ob_root = {
+            field: sans_values[field]
+            for field in SANS_NAMING_MAPPING
+            if field in sans_values
+        }
+        if title is not None:
+            ob_root["title"] = title
+        north, west, south, east = (bbox_parts[tag] for tag in _BBOX_TAGS)
+        ob_root["spatial"] = "".join(
+            north + [f",{part}" for part in west + south + east]
+        )
+        # add missing fields needed for ckan
+        ob_root.update(MISSING_FIELDS)
     logger.debug(f"final ob_root {ob_root}")
- 
-    return ob_root
+    return {"state": True, "fields": ob_root}
+
+
+def _get_sans_value(elem):
+    """
+    code list elements have no text,
+    their value attribute is the position
+    of the code in the list.
+    """
+    value = elem.text
+    if value is None:
+        code_value = elem.get("value")
+        code_list = _CODE_LISTS.get(elem.tag)
+        if code_list is None or code_value is None:
+            value = code_value
+        else:
+            try:
+                value = code_list.get(int(code_value))
+            except ValueError:
+                value = None
+    if elem.tag == _SPATIAL_REFERENCE_SYSTEM_TAG and value is not None:
+        parts = [part for part in _WHITESPACE_PATTERN.split(value) if part != " "]
+        value = "".join(parts[:2])
+    return value
+
+
+_FULL_SET_OF_FIELDS = frozenset(xml_full_set)
+
 
 def maximum_fields_check(root_ob, file_name_reference: str):
     """
@@ -249,9 +270,8 @@ def maximum_fields_check(root_ob, file_name_reference: str):
     is more than the maximum set
     of EMC datasets fields.
     """
-    root_ob_keys = root_ob.keys()
-    for field in root_ob_keys:
-        if field not in xml_full_set:
+    for field in root_ob:
+        if field not in _FULL_SET_OF_FIELDS:
             return {
                 "state": False,
                 "msg": f'field "{field}" '
@@ -458,10 +478,11 @@ def handle_date_field(date_field):
     return iso_date
 
 
-def create_ckan_dataset(root_ob):
+def create_ckan_dataset(root_ob, upload_context: "xml_upload.XmlUploadContext"):
     """
     create package via ckan api's
-    package_create action.
+    package_create action, on behalf
+    of the uploader.
     """
     logger.debug("from xml parser blueprint", root_ob)
     package_title = root_ob["title"]
@@ -471,7 +492,7 @@ def create_ckan_dataset(root_ob):
     # root_ob.update({"name": slug_url_field})
     create_action = toolkit.get_action("package_create")
     try:
-        create_action(data_dict=root_ob)
+        create_action(context=upload_context.ckan_context, data_dict=root_ob)
     except ValidationError as e:
 
         if e.error_summary is None:
@@ -498,29 +519,34 @@ def create_ckan_dataset(root_ob):
 #     return user_ob
 
 
-def send_email_to_creator(res):
+def send_email_to_creator(upload_context: "xml_upload.XmlUploadContext"):
     """
     per issue #105 we need
-    to send emails to creator
-    for mail_user function
-    check https://github.com/ckan/ckan/blob/master/ckan/lib/mailer.py
+    to send emails to creator,
+    through the mail delivery of
+    email_notifications
     """
-    global creator
     msg_body = (
         "xml upload process completed, please navigate to the"
         + "following messages: \n"
     )
-    created_packages_msgs = res["info_msgs"]
-    error_packages_msgs = res["err_msgs"]
     msg_body += "created packages: \n"
-    for msg in created_packages_msgs:
+    for msg in upload_context.info_msgs:
         msg_body += f"{msg} \n"
     msg_body += "packages with errors upon creation \n"
-    for msg in error_packages_msgs:
+    for msg in upload_context.err_msgs:
         msg_body += f"{msg} \n"
     try:
-        mail_user(creator, subject="creating dataset via xml upload", body=msg_body)
+        email_notifications.send_notification(
+            {
+                "name": upload_context.user_name,
+                "display_name": upload_context.user_display_name,
+                "email": upload_context.user_email,
+            },
+            {"subject": "creating dataset via xml upload", "body": msg_body},
+        )
     except MailerException as e:
+        logger.exception(f"Could not email {upload_context.user_name!r}")
         return
 
 
@@ -532,23 +558,17 @@ def change_name_special_chars_to_underscore(title: str) -> str:
     return title
 
 
+_XML_FIELDS_BY_DB_FIELD = {
+    db_field_name: field for field, db_field_name in DATASET_NAMING_MAPPING.items()
+}
+
+
 def check_fields_mapping() -> list:
     """
     construct new checkers (minimum, maximum)
     with simplified names
     """
-
-    dataset_keys = list(DATASET_NAMING_MAPPING.keys())
-    dataset_values = list(DATASET_NAMING_MAPPING.values())
-    new_mapped_set = []
-    # logger.debug(f"dataset {dataset_values}")
-    for item in xml_minimum_set:
-        try:
-            new_val_pos = dataset_values.index(item)
-            new_mapped_set.append(dataset_keys[new_val_pos])
-        except ValueError:
-            new_mapped_set.append(item)
-    return new_mapped_set
+    return [_XML_FIELDS_BY_DB_FIELD.get(item, item) for item in xml_minimum_set]
 
 
 def map_xml_fields(root: dict) -> dict:
@@ -558,18 +578,15 @@ def map_xml_fields(root: dict) -> dict:
     the look of the repeating subfields
     field_name-0-subfield_name
     """
-    import copy
-
-    root_cp = copy.deepcopy(root)
-    for k in root_cp.keys():
-        try:
-            db_field_name = DATASET_NAMING_MAPPING[k]
-            root[db_field_name] = root.pop(k)
-        except KeyError:
+    mapped: typing.Dict[str, typing.Any] = {}
+    for k, value in root.items():
+        db_field_name = DATASET_NAMING_MAPPING.get(k)
+        if db_field_name is None:
             # the key will presist and fail in max/min checks
-            pass
-
-    return root
+            mapped.setdefault(k, value)
+        else:
+            mapped[db_field_name] = value
+    return mapped
 
 
 ################### notes #######################
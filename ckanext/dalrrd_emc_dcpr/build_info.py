@@ -0,0 +1,101 @@
+"""Registry of build and release information, resolved once at startup
+
+The footer and the page metadata show the installed version, the git SHA, the
+current release and the site author and keywords. None of these change while the
+application is running, so they are resolved when
+`DalrrdEmcDcprPlugin.update_config()` runs, rather than on every page render. The
+site description can be edited at runtime and is thus not part of this registry.
+
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import typing
+from importlib import metadata
+from pathlib import Path
+
+from ckan.plugins import toolkit
+
+logger = logging.getLogger(__name__)
+
+DISTRIBUTION_NAME: typing.Final[str] = "ckanext-dalrrd-emc-dcpr"
+RELEASE_CHANNEL_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.release_channel"
+_DEFAULT_RELEASE_CHANNEL = "development"
+_RELEASES_FILE_PATH = Path(__file__).parent / "releases.txt"
+_SEO_CONFIG_KEYS = {
+    "site_author": "ckan.site_author",
+    "site_keywords": "ckan.site_keywords",
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class BuildInfo:
+    version: typing.Optional[str]
+    git_sha: typing.Optional[str]
+    release_channel: str
+    release: str
+    seo_metatags: typing.Dict[str, typing.Optional[str]]
+
+
+_build_info: typing.Optional[BuildInfo] = None
+
+
+def load_build_info(config: typing.Mapping) -> BuildInfo:
+    """Resolve build information from the input config and store it"""
+    global _build_info
+    release_channel = config.get(RELEASE_CHANNEL_CONFIG_KEY, _DEFAULT_RELEASE_CHANNEL)
+    _build_info = BuildInfo(
+        version=_get_version(),
+        git_sha=os.getenv("GIT_COMMIT"),
+        release_channel=release_channel,
+        release=_get_release(release_channel),
+        seo_metatags={
+            name: config.get(config_key)
+            for name, config_key in _SEO_CONFIG_KEYS.items()
+        },
+    )
+    return _build_info
+
+
+def get_build_info() -> BuildInfo:
+    """Return the build information that was resolved at startup
+
+    Build information is resolved now if the plugin has not been configured yet
+    (e.g. when running some CLI commands).
+
+    """
+
+    return _build_info if _build_info is not None else load_build_info(toolkit.config)
+
+
+def _get_version() -> typing.Optional[str]:
+    try:
+        result = metadata.version(DISTRIBUTION_NAME)
+    except metadata.PackageNotFoundError:
+        logger.warning(f"Could not find the version of {DISTRIBUTION_NAME!r}")
+        result = None
+    return result
+
+
+def _get_release(release_channel: str) -> str:
+    """Return the latest release for the input channel
+
+    The `development` channel uses the latest release candidate (e.g. v*.*.*-rc) and
+    the `main` channel uses the latest release (e.g. v*.*.*).
+
+    """
+
+    try:
+        releases = json.loads(_RELEASES_FILE_PATH.read_text())
+    except (OSError, ValueError):
+        logger.exception(f"Could not read releases from {_RELEASES_FILE_PATH}")
+        releases = {}
+    if release_channel == "development":
+        result = releases.get("latest_release_candidate", "")
+    elif release_channel == "main":
+        result = releases.get("latest_release", "")
+    else:
+        result = ""
+    return result
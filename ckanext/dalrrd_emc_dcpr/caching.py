@@ -0,0 +1,282 @@
+"""Small caching utilities used throughout the extension
+
+Unless stated otherwise, these caches live in the memory of the current process. They
+are meant for data that is expensive to compute and that can be invalidated
+explicitly by the actions which modify it. Since other processes are not notified of
+such invalidations, entries also expire after a TTL.
+
+The `SearchCache` can alternatively store its entries in Redis, in which case
+invalidations are seen by all processes.
+
+"""
+
+import enum
+import json
+import logging
+import threading
+import time
+import typing
+
+import ckan.lib.plugins as lib_plugins
+from ckan.plugins import toolkit
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_BACKEND_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.search_cache_backend"
+SEARCH_CACHE_TTL_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.search_cache_ttl"
+_DEFAULT_SEARCH_CACHE_TTL_SECONDS = 300
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A thread-safe in-memory cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl: float, max_entries: typing.Optional[int] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: typing.Dict[
+            typing.Hashable, typing.Tuple[float, typing.Any]
+        ] = {}
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = default
+            else:
+                expires_at, value = entry
+                if expires_at < time.monotonic():
+                    del self._entries[key]
+                    result = default
+                else:
+                    result = value
+        return result
+
+    def set(self, key: typing.Hashable, value: typing.Any) -> None:
+        with self._lock:
+            if self.max_entries is not None and len(self._entries) >= self.max_entries:
+                self._evict_expired()
+                if len(self._entries) >= self.max_entries:
+                    # drop the entry that is closest to expiring
+                    oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                    del self._entries[oldest]
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_set(
+        self, key: typing.Hashable, factory: typing.Callable[[], typing.Any]
+    ) -> typing.Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def delete(self, key: typing.Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [
+            k for k, (expires_at, _) in self._entries.items() if expires_at < now
+        ]:
+            del self._entries[key]
+
+
+class CacheMetrics:
+    """Process-level hit and miss counters of a cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class InProcessCacheBackend:
+    """Cache backend storing entries in the memory of the current process"""
+
+    def __init__(self, ttl: float, max_entries: typing.Optional[int] = None):
+        self._cache = TTLCache(ttl, max_entries=max_entries)
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: str, value: typing.Any) -> None:
+        self._cache.set(key, value)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class RedisCacheBackend:
+    """Cache backend storing JSON-serializable entries in CKAN's Redis instance
+
+    Clearing the cache does not delete any keys, it bumps a generation counter
+    instead, which is part of every key. Entries of older generations are never read
+    again and are eventually expired by Redis.
+
+    Redis errors are logged and treated as cache misses.
+
+    """
+
+    def __init__(self, namespace: str, ttl: float):
+        self.namespace = namespace
+        self.ttl = int(ttl)
+        self._connection = None
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        try:
+            connection = self._get_connection()
+            raw_value = connection.get(self._get_redis_key(connection, key))
+        except Exception:
+            logger.exception(f"Could not read {key!r} from redis")
+            raw_value = None
+        return json.loads(raw_value) if raw_value is not None else default
+
+    def set(self, key: str, value: typing.Any) -> None:
+        try:
+            connection = self._get_connection()
+            connection.setex(
+                self._get_redis_key(connection, key), self.ttl, json.dumps(value)
+            )
+        except Exception:
+            logger.exception(f"Could not write {key!r} to redis")
+
+    def clear(self) -> None:
+        try:
+            self._get_connection().incr(self._generation_key)
+        except Exception:
+            logger.exception(f"Could not clear the {self.namespace!r} redis cache")
+
+    @property
+    def _generation_key(self) -> str:
+        return f"{self.namespace}:generation"
+
+    def _get_redis_key(self, connection, key: str) -> str:
+        generation = int(connection.get(self._generation_key) or 0)
+        return f"{self.namespace}:{generation}:{key}"
+
+    def _get_connection(self):
+        if self._connection is None:
+            from ckan.lib.redis import connect_to_redis
+
+            self._connection = connect_to_redis()
+        return self._connection
+
+
+class SearchCacheBackend(enum.Enum):
+    NONE = "none"
+    MEMORY = "memory"
+    REDIS = "redis"
+
+
+class SearchCache:
+    """Cache for the `package_search` calls made when rendering common pages
+
+    The homepage carousels and the dataset counters perform the same searches for
+    every visitor. Their results only depend on the datasets that the current user
+    is allowed to see, so they are cached per set of permission labels - anonymous
+    users, logged-in users and sysadmins get their own entries.
+
+    The cache is cleared whenever a dataset is created, updated or deleted. The
+    `ckan.dalrrd_emc_dcpr.search_cache_backend` setting chooses where the entries
+    are stored (`memory`, `redis` or `none` to disable caching).
+
+    """
+
+    namespace = "ckanext-dalrrd-emc-dcpr:search-cache"
+
+    def __init__(self):
+        self.metrics = CacheMetrics()
+        self._lock = threading.Lock()
+        self._backend = None
+        self._backend_type: typing.Optional[SearchCacheBackend] = None
+
+    def package_search(
+        self, data_dict: typing.Dict, user_obj: typing.Optional[typing.Any] = None
+    ) -> typing.Dict:
+        backend = self._get_backend()
+        if backend is None:
+            result = toolkit.get_action("package_search")(data_dict=data_dict)
+        else:
+            key = self._get_key(data_dict, user_obj)
+            result = backend.get(key, _MISSING)
+            self.metrics.record(hit=result is not _MISSING)
+            if result is _MISSING:
+                result = toolkit.get_action("package_search")(data_dict=data_dict)
+                backend.set(key, result)
+        return result
+
+    def invalidate(self) -> None:
+        backend = self._get_backend()
+        if backend is not None:
+            backend.clear()
+
+    def get_backend_type(self) -> SearchCacheBackend:
+        raw_backend = toolkit.config.get(
+            SEARCH_CACHE_BACKEND_CONFIG_KEY, SearchCacheBackend.MEMORY.value
+        )
+        try:
+            result = SearchCacheBackend(raw_backend.strip().lower())
+        except ValueError:
+            logger.warning(
+                f"Invalid value {raw_backend!r} for "
+                f"{SEARCH_CACHE_BACKEND_CONFIG_KEY!r}, using "
+                f"{SearchCacheBackend.MEMORY.value!r}"
+            )
+            result = SearchCacheBackend.MEMORY
+        return result
+
+    def _get_backend(self):
+        backend_type = self.get_backend_type()
+        with self._lock:
+            if backend_type != self._backend_type:
+                ttl = toolkit.asint(
+                    toolkit.config.get(
+                        SEARCH_CACHE_TTL_CONFIG_KEY, _DEFAULT_SEARCH_CACHE_TTL_SECONDS
+                    )
+                )
+                if backend_type == SearchCacheBackend.REDIS:
+                    self._backend = RedisCacheBackend(self.namespace, ttl)
+                elif backend_type == SearchCacheBackend.MEMORY:
+                    self._backend = InProcessCacheBackend(ttl, max_entries=1000)
+                else:
+                    self._backend = None
+                self._backend_type = backend_type
+            return self._backend
+
+    def _get_key(
+        self, data_dict: typing.Dict, user_obj: typing.Optional[typing.Any]
+    ) -> str:
+        if not data_dict.get("include_private", False):
+            # only public datasets are returned, regardless of the user
+            labels = ["public"]
+        elif user_obj is not None and user_obj.sysadmin:
+            labels = ["sysadmin"]
+        else:
+            labels = sorted(
+                lib_plugins.get_permission_labels().get_user_dataset_labels(user_obj)
+            )
+        return json.dumps({"search": data_dict, "labels": labels}, sort_keys=True)
+
+
+search_cache = SearchCache()
@@ -34,12 +34,13 @@ from ckanext.dalrrd_emc_dcpr.model.dcpr_request import (
 from ckanext.dalrrd_emc_dcpr.model.dcpr_error_report import DCPRErrorReport
 
 from .. import jobs
+from .. import stats
 from ..constants import (
     ISO_TOPIC_CATEGOY_VOCABULARY_NAME,
     ISO_TOPIC_CATEGORIES,
     SASDI_THEMES_VOCABULARY_NAME,
 )
-from ..email_notifications import get_and_send_notifications_for_all_users
+from ..email_notifications import send_activity_digests
 
 from . import utils
 from ._bootstrap_data import PORTAL_PAGES, SASDI_ORGANIZATIONS
@@ -76,7 +77,12 @@ def dalrrd_emc_dcpr(verbose: bool):
 
 
 @dalrrd_emc_dcpr.command()
-def send_email_notifications():
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report how many users have pending notifications, without emailing them",
+)
+def send_email_notifications(dry_run: bool):
     """Send pending email notifications to users
 
     This command should be ran periodically.
@@ -86,9 +92,17 @@ def send_email_notifications():
     setting_key = "ckan.activity_streams_email_notifications"
     if toolkit.asbool(toolkit.config.get(setting_key)):
         env_sentinel = "CKAN_SMTP_PASSWORD"
-        if os.getenv(env_sentinel) is not None:
-            num_sent = get_and_send_notifications_for_all_users()
-            logger.info(f"Sent {num_sent} emails")
+        if dry_run or os.getenv(env_sentinel) is not None:
+            result = send_activity_digests(dry_run=dry_run)
+            logger.info(
+                f"Found {result.num_users} users with {result.num_activities} pending "
+                f"activities in {result.query_seconds:.2f}s"
+            )
+            if not dry_run:
+                logger.info(
+                    f"Sent {result.num_sent} emails, {result.num_failed} failed, "
+                    f"in {result.total_seconds:.2f}s"
+                )
             logger.info("Done!")
         else:
             logger.error(
@@ -99,6 +113,59 @@ def send_email_notifications():
         logger.error(f"{setting_key} is not enabled in config. Aborting...")
 
 
+@dalrrd_emc_dcpr.command()
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Discard the stored weekly aggregates and recompute them from scratch",
+)
+@click.option(
+    "--background",
+    is_flag=True,
+    help="Enqueue a background job instead of refreshing right away",
+)
+def refresh_stats(rebuild: bool, background: bool):
+    """Refresh the precomputed statistics shown in the /stats page
+
+    Only the activities created since the previous refresh are aggregated, unless
+    `--rebuild` is passed. This command should be ran periodically.
+
+    """
+
+    if background:
+        job = toolkit.enqueue_job(jobs.refresh_stats, kwargs={"rebuild": rebuild})
+        logger.info(f"Enqueued job {job.id!r}")
+    else:
+        result = stats.refresh_stats(rebuild=rebuild)
+        logger.info(
+            f"Updated {result.weeks_updated} weeks, activity watermark is now "
+            f"{result.activity_watermark}"
+        )
+    logger.info("Done!")
+
+
+@dalrrd_emc_dcpr.command()
+@click.option(
+    "--background",
+    is_flag=True,
+    help="Enqueue a background job instead of checking right away",
+)
+def notify_saved_searches(background: bool):
+    """Notify users of new results for their saved searches
+
+    Each distinct saved query runs once, looking only for datasets modified since
+    the previous run. This command should be ran periodically.
+
+    """
+
+    if background:
+        job = toolkit.enqueue_job(jobs.notify_new_saved_search_results)
+        logger.info(f"Enqueued job {job.id!r}")
+    else:
+        jobs.notify_new_saved_search_results()
+    logger.info("Done!")
+
+
 @dalrrd_emc_dcpr.group()
 def bootstrap():
     """Bootstrap the dalrrd-emc-dcpr extension"""
@@ -1,5 +1,7 @@
 import enum
 import logging
+import os
+import threading
 import typing
 
 import click
@@ -8,18 +10,48 @@ from ckan.logic import NotFound
 from ckan.lib import jinja_extensions
 from ckan.plugins import toolkit
 from flask_babel import gettext as flask_ugettext, ngettext as flask_ungettext
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache
 
 logger = logging.getLogger(__name__)
 
+TEMPLATE_BYTECODE_CACHE_DIR_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.template_bytecode_cache_dir"
+
+_jinja_env: typing.Optional[Environment] = None
+_jinja_env_lock = threading.Lock()
+
 
 class DatasetCreationResult(enum.Enum):
     CREATED = "created"
     NOT_CREATED_ALREADY_EXISTS = "already_exists"
 
 
-def get_jinja_env():
-    jinja_env = Environment(**jinja_extensions.get_jinja_env_options())
+def get_jinja_env() -> Environment:
+    """Return the Jinja environment that is used to render emails
+
+    The environment is built once per process and is shared by all threads. It keeps
+    the templates that it has compiled in memory. Their bytecode is also stored on
+    disk, so that other processes do not need to compile them again.
+
+    """
+
+    global _jinja_env
+    if _jinja_env is None:
+        with _jinja_env_lock:
+            if _jinja_env is None:
+                _jinja_env = _build_jinja_env()
+    return _jinja_env
+
+
+def _build_jinja_env() -> Environment:
+    cache_dir = toolkit.config.get(TEMPLATE_BYTECODE_CACHE_DIR_CONFIG_KEY)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    jinja_env = Environment(
+        bytecode_cache=FileSystemBytecodeCache(cache_dir or None),
+        **jinja_extensions.get_jinja_env_options(),
+    )
     jinja_env.install_gettext_callables(flask_ugettext, flask_ungettext, newstyle=True)
     # custom filters
     jinja_env.policies["ext.i18n.trimmed"] = True
@@ -18,6 +18,8 @@ import typing
 import ast
 
 import ckan.lib.dictization as ckan_dictization
+import sqlalchemy
+from ckan import model
 
 from .model import dcpr_request as dcpr_request_model
 
@@ -28,23 +30,84 @@ def dcpr_request_dictize(
     dcpr_request: dcpr_request_model.DCPRRequest,
     context: typing.Dict,
 ) -> typing.Dict:
-    result_dict = ckan_dictization.table_dictize(dcpr_request, context)
-    result_dict["datasets"] = []
-    for dcpr_dataset in dcpr_request.datasets:
-        dataset_dict = dcpr_request_dataset_dictize(dcpr_dataset, context)
-        result_dict["datasets"].append(dataset_dict)
-    result_dict["capture_start_date"] = result_dict["capture_start_date"].partition(
-        "T"
-    )[0]
-    result_dict["capture_end_date"] = result_dict["capture_end_date"].partition("T")[0]
+    return dcpr_request_list_dictize([dcpr_request], context)[0]
+
+
+def dcpr_request_list_dictize(
+    dcpr_requests: typing.List[dcpr_request_model.DCPRRequest],
+    context: typing.Dict,
+) -> typing.List[typing.Dict]:
+    """Dictize multiple DCPR requests using a constant number of DB queries
+
+    Instead of lazily loading each request's datasets, owner and organization, these
+    are retrieved in bulk for all the input requests.
+
+    """
+
+    session = context["model"].Session
+    datasets = _get_datasets_by_request(dcpr_requests, session)
+    owner_names = {}
+    organization_names = {}
     if context.get("dictize_for_ui", False):
-        result_dict.update(
-            {
-                "owner": dcpr_request.owner.name,
-                "organization": dcpr_request.organization.name,
-            }
+        owner_ids = {r.owner_user for r in dcpr_requests}
+        organization_ids = {r.organization_id for r in dcpr_requests}
+        if owner_ids:
+            owner_names = dict(
+                session.query(model.User.id, model.User.name).filter(
+                    model.User.id.in_(owner_ids)
+                )
+            )
+        if organization_ids:
+            organization_names = dict(
+                session.query(model.Group.id, model.Group.name).filter(
+                    model.Group.id.in_(organization_ids)
+                )
+            )
+    result = []
+    for dcpr_request in dcpr_requests:
+        result_dict = ckan_dictization.table_dictize(dcpr_request, context)
+        result_dict["datasets"] = [
+            dcpr_request_dataset_dictize(dcpr_dataset, context)
+            for dcpr_dataset in datasets.get(dcpr_request.csi_reference_id, [])
+        ]
+        result_dict["capture_start_date"] = result_dict["capture_start_date"].partition(
+            "T"
+        )[0]
+        result_dict["capture_end_date"] = result_dict["capture_end_date"].partition(
+            "T"
+        )[0]
+        if context.get("dictize_for_ui", False):
+            result_dict.update(
+                {
+                    "owner": owner_names.get(dcpr_request.owner_user),
+                    "organization": organization_names.get(
+                        dcpr_request.organization_id
+                    ),
+                }
+            )
+        result.append(result_dict)
+    return result
+
+
+def _get_datasets_by_request(
+    dcpr_requests: typing.List[dcpr_request_model.DCPRRequest], session
+) -> typing.Dict[str, typing.List[dcpr_request_model.DCPRRequestDataset]]:
+    result = {}
+    to_load = []
+    for dcpr_request in dcpr_requests:
+        if "datasets" in sqlalchemy.inspect(dcpr_request).unloaded:
+            to_load.append(dcpr_request.csi_reference_id)
+        else:
+            # datasets are already loaded, e.g. when dictizing a request that has
+            # just been deleted
+            result[dcpr_request.csi_reference_id] = list(dcpr_request.datasets)
+    if to_load:
+        query = session.query(dcpr_request_model.DCPRRequestDataset).filter(
+            dcpr_request_model.DCPRRequestDataset.dcpr_request_id.in_(to_load)
         )
-    return result_dict
+        for dcpr_dataset in query:
+            result.setdefault(dcpr_dataset.dcpr_request_id, []).append(dcpr_dataset)
+    return result
 
 
 def dcpr_request_dataset_dictize(
@@ -7,13 +7,37 @@ This module reimplements the core CKAN email notifications in order to:
 
 - modify the default implementation in order to not require an active request
 
+- send all emails of a run through a single mail session, see `mail_delivery`
+
+- render emails with a shared, precompiled, set of templates. Templates that do not
+  depend on the recipient of a notification are rendered only once, regardless of
+  the number of recipients, see `render_notifications()`
+
+- scale to many users. CKAN loads the dashboard of each user and filters its
+  activities in Python. Here, the users that have pending activities are found with a
+  single query, which also counts their activities. Digests are then rendered and sent
+  by a pool of processes, in chunks of users. The time at which a digest was sent is
+  stored with one commit per chunk
+
+A digest covers the activities that would show up in the user's dashboard since the
+most recent of: the `ckan.email_notifications_since` period, the last digest that was
+sent to the user and the last time the user viewed their dashboard. The user's own
+activities are not included.
+
 """
 
+import dataclasses
 import datetime as dt
+import functools
 import logging
 import re
-import json
+import time
+import typing
+from concurrent import futures
+from pathlib import Path
 
+import sqlalchemy
+from jinja2 import meta as jinja_meta
 from ckan import (
     logic,
     model,
@@ -21,64 +45,187 @@ from ckan import (
 from ckan.plugins import toolkit
 from ckanext.dalrrd_emc_dcpr.cli.utils import get_jinja_env
 
+from . import mail_delivery
+
 logger = logging.getLogger(__name__)
 
+DIGEST_MAX_WORKERS_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.email_digest_max_workers"
+DIGEST_CHUNK_SIZE_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.email_digest_chunk_size"
+_DEFAULT_DIGEST_MAX_WORKERS = 4
+_DEFAULT_DIGEST_CHUNK_SIZE = 200
+_TEMPLATES_DIR = Path(__file__).parent / "templates"
+_EMAIL_TEMPLATES_DIR_NAME = "email_notifications"
+
+
+@dataclasses.dataclass(frozen=True)
+class PendingDigest:
+    user_id: str
+    name: str
+    display_name: str
+    email: str
+    num_activities: int
+
+
+@dataclasses.dataclass(frozen=True)
+class DigestRunResult:
+    dry_run: bool
+    num_users: int
+    num_activities: int
+    num_sent: int
+    num_failed: int
+    query_seconds: float
+    total_seconds: float
+
 
-def get_and_send_notifications_for_all_users() -> int:
-    context = {
-        "model": model,
-        "session": model.Session,
-        "ignore_auth": True,
-        "keep_email": True,
-    }
-    users = logic.get_action("user_list")(context, {})
+def send_activity_digests(dry_run: bool = False) -> DigestRunResult:
+    """Send an email with a digest of their pending activities to each user
+
+    :param dry_run: Only find out which users have pending activities, without
+        sending any email
+
+    """
+
+    start = time.perf_counter()
+    # activities that happen while the run is in progress are left for the next run
+    until = dt.datetime.utcnow()
+    digests = get_pending_digests(until)
+    query_seconds = time.perf_counter() - start
     num_sent = 0
-    for user in users:
-        num_sent += get_and_send_notifications_for_user(user)
-    return num_sent
+    num_failed = 0
+    if not dry_run and len(digests) > 0:
+        chunk_size = max(
+            1,
+            toolkit.asint(
+                toolkit.config.get(
+                    DIGEST_CHUNK_SIZE_CONFIG_KEY, _DEFAULT_DIGEST_CHUNK_SIZE
+                )
+            ),
+        )
+        chunks = [
+            digests[index : index + chunk_size]
+            for index in range(0, len(digests), chunk_size)
+        ]
+        for sent_user_ids, chunk_num_failed in _send_chunks(chunks):
+            _mark_digests_sent(sent_user_ids, until)
+            num_sent += len(sent_user_ids)
+            num_failed += chunk_num_failed
+    return DigestRunResult(
+        dry_run=dry_run,
+        num_users=len(digests),
+        num_activities=sum(d.num_activities for d in digests),
+        num_sent=num_sent,
+        num_failed=num_failed,
+        query_seconds=query_seconds,
+        total_seconds=time.perf_counter() - start,
+    )
+
 
+def get_pending_digests(until: dt.datetime) -> typing.List[PendingDigest]:
+    """Return the users that have pending activities, with their number of activities
 
-def get_and_send_notifications_for_user(user) -> int:
+    Only users that are active, have an email address and have enabled email
+    notifications are considered.
+
+    """
 
-    # Parse the email_notifications_since config setting, email notifications
-    # from longer ago than this time will not be sent.
-    email_notifications_since = toolkit.config.get(
-        "ckan.email_notifications_since", "2 days"
+    notifications_since = toolkit.config.get("ckan.email_notifications_since", "2 days")
+    floor = until - string_to_timedelta(notifications_since)
+    candidates = _get_dashboard_activities_query(floor, until).subquery()
+    since = sqlalchemy.func.greatest(
+        floor,
+        sqlalchemy.func.coalesce(model.Dashboard.email_last_sent, floor),
+        sqlalchemy.func.coalesce(model.Dashboard.activity_stream_last_viewed, floor),
     )
-    email_notifications_since = string_to_timedelta(email_notifications_since)
-    email_notifications_since = dt.datetime.utcnow() - email_notifications_since
-
-    # FIXME: We are accessing model from lib here but I'm not sure what
-    # else to do unless we add a get_email_last_sent() logic function which
-    # would only be needed by this lib.
-    email_last_sent = model.Dashboard.get(user["id"]).email_last_sent
-    activity_stream_last_viewed = model.Dashboard.get(
-        user["id"]
-    ).activity_stream_last_viewed  # the dashboard database table only has userid, activity_stream_last_viewed, email_last_sent
-
-    since = max(
-        email_notifications_since, email_last_sent, activity_stream_last_viewed
-    )  # the youngest
-
-    notifications = get_notifications(user, since)
-    num_sent = 0
-    # TODO: Handle failures from send_email_notification.
-    for notification in notifications:
-        send_notification(user, notification)
-        num_sent += 1
+    num_activities = sqlalchemy.func.count(
+        sqlalchemy.distinct(candidates.c.activity_id)
+    ).label("num_activities")
+    query = (
+        model.Session.query(
+            model.User.id,
+            model.User.name,
+            model.User.fullname,
+            model.User.email,
+            num_activities,
+        )
+        .join(candidates, candidates.c.follower_id == model.User.id)
+        .outerjoin(model.Dashboard, model.Dashboard.user_id == model.User.id)
+        .filter(
+            model.User.state == "active",
+            model.User.activity_streams_email_notifications.is_(True),
+            model.User.email.isnot(None),
+            model.User.email != "",
+            # users are not notified of their own activities
+            candidates.c.actor_id != model.User.id,
+            candidates.c.timestamp > since,
+        )
+        .group_by(model.User.id, model.User.name, model.User.fullname, model.User.email)
+        .order_by(model.User.name)
+    )
+    hidden_user_ids = _get_hidden_user_ids()
+    if len(hidden_user_ids) > 0:
+        query = query.filter(candidates.c.actor_id.notin_(hidden_user_ids))
+    return [
+        PendingDigest(
+            user_id=row.id,
+            name=row.name,
+            display_name=row.fullname or row.name,
+            email=row.email,
+            num_activities=row.num_activities,
+        )
+        for row in query.all()
+    ]
 
-    # FIXME: We are accessing model from lib here but I'm not sure what
-    # else to do unless we add a update_email_last_sent()
-    # logic function which would only be needed by this lib.
-    dash = model.Dashboard.get(user["id"])
-    dash.email_last_sent = dt.datetime.utcnow()
-    model.repo.commit()
-    return num_sent
+
+def send_digest_chunk(
+    digests: typing.List[PendingDigest],
+) -> typing.Tuple[typing.List[str], int]:
+    """Send the digests of a chunk of users through a single mail session
+
+    This does not access the DB, so that it can run in a separate process.
+
+    :returns: The ids of the users whose digest was sent and the number of digests
+        that could not be sent
+
+    """
+
+    sent_user_ids = []
+    num_failed = 0
+    jinja_env = get_jinja_env()
+    # the content of a digest only depends on its number of activities
+    notifications: typing.Dict[int, typing.Dict[str, str]] = {}
+    with mail_delivery.mail_session():
+        for digest in digests:
+            notification = notifications.get(digest.num_activities)
+            try:
+                if notification is None:
+                    notification = _render_digest(jinja_env, digest.num_activities)
+                    notifications[digest.num_activities] = notification
+                send_notification(
+                    {
+                        "name": digest.name,
+                        "display_name": digest.display_name,
+                        "email": digest.email,
+                    },
+                    notification,
+                )
+            except Exception:
+                logger.exception(f"Could not send digest to user {digest.name!r}")
+                num_failed += 1
+            else:
+                sent_user_ids.append(digest.user_id)
+    return sent_user_ids, num_failed
 
 
 def send_notification(user, email_dict):
-    """Email `email_dict` to `user`."""
-    import ckan.lib.mailer
+    """Email `email_dict` to `user`.
+
+    The email is sent through the current mail session, if there is one.
+
+    """
 
     if not user.get("email"):
         logger.debug(
@@ -87,113 +234,220 @@ def send_notification(user, email_dict):
         # FIXME: Raise an exception.
         return
 
-    try:
-        ckan.lib.mailer.mail_recipient(
-            user["display_name"],
-            user["email"],
-            email_dict["subject"],
-            email_dict["body"],
+    mail_delivery.send_email(
+        mail_delivery.OutgoingEmail(
+            recipient_name=user["display_name"],
+            recipient_email=user["email"],
+            subject=email_dict["subject"],
+            body=email_dict["body"],
         )
-    except ckan.lib.mailer.MailerException:
-        logger.error(ckan.lib.mailer.MailerException)
-        raise
-    else:
-        logger.debug(f"Email sent!")
-
+    )
 
-def _notifications_for_activities(activities, user_dict):
-    """Return one or more email notifications covering the given activities.
 
-    This function handles grouping multiple activities into a single digest
-    email.
+def render_notifications(
+    subject_template_path: str,
+    body_template_path: str,
+    context: typing.Dict,
+    recipients: typing.Iterable,
+    recipient_variable: str,
+) -> typing.List[typing.Tuple[typing.Any, str, str]]:
+    """Render the subject and body of a notification for each recipient
 
-    :param activities: the activities to consider
-    :type activities: list of activity dicts like those returned by
-        ckan.logic.action.get.dashboard_activity_list()
+    Each recipient is passed to the templates as `recipient_variable`. A template
+    that does not use this variable is rendered only once and its result is shared
+    by all recipients.
 
-    :returns: a list of email notifications
-    :rtype: list of dicts each with keys 'subject' and 'body'
+    :returns: A list of `(recipient, subject, body)` tuples
 
     """
-    if not activities:
-        return []
-
-    if not user_dict.get("activity_streams_email_notifications"):
-        return []
-
-    # We just group all activities into a single "new activity" email that
-    # doesn't say anything about _what_ new activities they are.
-    # TODO: Here we could generate some smarter content for the emails e.g.
-    # say something about the contents of the activities, or single out
-    # certain types of activity to be sent in their own individual emails,
-    # etc.
-    subject = toolkit.ungettext(
-        "{n} new activity from {site_title}",
-        "{n} new activities from {site_title}",
-        len(activities),
-    ).format(site_title=toolkit.config.get("ckan.site_title"), n=len(activities))
+
     jinja_env = get_jinja_env()
-    body_template = jinja_env.get_template("email_notifications/email_body.txt")
-    rendered_body = body_template.render(
-        activities=activities,
-        site_url=toolkit.config.get("ckan.site_url"),
-        site_title=toolkit.config.get("ckan.site_title"),
-    )
-    notifications = [{"subject": subject, "body": rendered_body}]
+    templates = []
+    for path in (subject_template_path, body_template_path):
+        template = jinja_env.get_template(path)
+        if recipient_variable in get_template_variables(path):
+            shared = None
+        else:
+            shared = template.render(**context)
+        templates.append((template, shared))
+    result = []
+    for recipient in recipients:
+        recipient_context = {**context, recipient_variable: recipient}
+        subject, body = (
+            shared if shared is not None else template.render(**recipient_context)
+            for template, shared in templates
+        )
+        result.append((recipient, subject, body))
+    return result
 
-    return notifications
 
+@functools.lru_cache(maxsize=None)
+def get_template_variables(template_path: str) -> typing.FrozenSet[str]:
+    """Return the names of the variables that a template expects to be passed in
 
-def _notifications_from_dashboard_activity_list(user_dict, since):
-    """Return any email notifications from the given user's dashboard activity
-    list since `since`.
+    Variables used by included or extended templates are not taken into account.
 
     """
-    # Get the user's dashboard activity stream.
-    context = {"model": model, "session": model.Session, "user": user_dict["id"]}
-    activities = logic.get_action("dashboard_activity_list")(context, {})
 
-    # Filter out the user's own activities., so they don't get an email every
-    # time they themselves do something (we are not Trac).
-    activities = [act for act in activities if act["user_id"] != user_dict["id"]]
+    jinja_env = get_jinja_env()
+    source, _, _ = jinja_env.loader.get_source(jinja_env, template_path)
+    return frozenset(jinja_meta.find_undeclared_variables(jinja_env.parse(source)))
 
-    # Filter out the old activities.
-    strptime = dt.datetime.strptime
-    fmt = "%Y-%m-%dT%H:%M:%S.%f"
-    activities = [act for act in activities if strptime(act["timestamp"], fmt) > since]
-    return _notifications_for_activities(activities, user_dict)
 
+def precompile_templates() -> int:
+    """Compile the email templates and cache them in the shared Jinja environment
 
-# A list of functions that provide email notifications for users from different
-# sources. Add to this list if you want to implement a new source of email
-# notifications.
-_notifications_functions = [
-    _notifications_from_dashboard_activity_list,
-]
+    :returns: The number of templates that have been compiled
 
+    """
 
-def get_notifications(user_dict, since):
-    """Return any email notifications for the given user since `since`.
+    jinja_env = get_jinja_env()
+    template_paths = sorted(
+        f"{_EMAIL_TEMPLATES_DIR_NAME}/{path.name}"
+        for path in (_TEMPLATES_DIR / _EMAIL_TEMPLATES_DIR_NAME).glob("*.txt")
+    )
+    for template_path in template_paths:
+        jinja_env.get_template(template_path)
+    return len(template_paths)
 
-    For example email notifications about activity streams will be returned for
-    any activities the occurred since `since`.
 
-    :param user_dict: a dictionary representing the user, should contain 'id'
-        and 'name'
-    :type user_dict: dictionary
+def _send_chunks(
+    chunks: typing.List[typing.List[PendingDigest]],
+) -> typing.Iterator[typing.Tuple[typing.List[str], int]]:
+    max_workers = toolkit.asint(
+        toolkit.config.get(DIGEST_MAX_WORKERS_CONFIG_KEY, _DEFAULT_DIGEST_MAX_WORKERS)
+    )
+    if max_workers <= 1 or len(chunks) == 1:
+        for chunk in chunks:
+            yield send_digest_chunk(chunk)
+    else:
+        # forked workers must not share the DB connections of this process
+        model.Session.remove()
+        model.meta.engine.dispose()
+        with futures.ProcessPoolExecutor(
+            max_workers=min(max_workers, len(chunks))
+        ) as executor:
+            to_do = {executor.submit(send_digest_chunk, c): c for c in chunks}
+            for future in futures.as_completed(to_do):
+                try:
+                    yield future.result()
+                except Exception:
+                    chunk = to_do[future]
+                    logger.exception(f"Could not send a chunk of {len(chunk)} digests")
+                    yield [], len(chunk)
+
+
+def _mark_digests_sent(user_ids: typing.List[str], sent_at: dt.datetime) -> None:
+    if len(user_ids) > 0:
+        existing = {
+            row.user_id
+            for row in model.Session.query(model.Dashboard.user_id).filter(
+                model.Dashboard.user_id.in_(user_ids)
+            )
+        }
+        # CKAN only creates a user's dashboard when it is first looked up
+        model.Session.add_all(
+            model.Dashboard(user_id) for user_id in user_ids if user_id not in existing
+        )
+        model.Session.flush()
+        model.Session.query(model.Dashboard).filter(
+            model.Dashboard.user_id.in_(user_ids)
+        ).update({"email_last_sent": sent_at}, synchronize_session=False)
+        model.Session.commit()
 
-    :param since: datetime after which to return notifications from
-    :rtype since: datetime.datetime
 
-    :returns: a list of email notifications
-    :rtype: list of dicts with keys 'subject' and 'body'
+def _get_dashboard_activities_query(floor: dt.datetime, until: dt.datetime):
+    """Return a query of the activities shown in the dashboard of each user
+
+    This mirrors CKAN's `dashboard_activity_list`: a user sees the activities of the
+    users they follow and the activities about themselves, the users, datasets and
+    groups they follow, as well as about the datasets of the groups and
+    organizations they follow.
+
+    Each row has `follower_id`, `activity_id`, `actor_id` and `timestamp` columns.
 
     """
-    notifications = []
-    logger.debug(f"Retrieving notifications for {user_dict['name']!r} since {since!r}")
-    for function in _notifications_functions:
-        notifications.extend(function(user_dict, since))
-    return notifications
+
+    followed_dataset = model.UserFollowingDataset
+    followed_group = model.UserFollowingGroup
+    followed_user = model.UserFollowingUser
+    followed_objects = (
+        model.Session.query(
+            followed_dataset.follower_id.label("follower_id"),
+            followed_dataset.object_id.label("object_id"),
+        )
+        .union_all(
+            model.Session.query(followed_group.follower_id, followed_group.object_id),
+            model.Session.query(followed_user.follower_id, followed_user.object_id),
+            model.Session.query(followed_group.follower_id, model.Member.table_id).join(
+                model.Member,
+                sqlalchemy.and_(
+                    model.Member.group_id == followed_group.object_id,
+                    model.Member.table_name == "package",
+                    model.Member.state == "active",
+                ),
+            ),
+            model.Session.query(followed_group.follower_id, model.Package.id).join(
+                model.Package, model.Package.owner_org == followed_group.object_id
+            ),
+            model.Session.query(
+                model.User.id.label("user_id"), model.User.id.label("object_id")
+            ),
+        )
+        .subquery()
+    )
+    in_period = sqlalchemy.and_(
+        model.Activity.timestamp > floor, model.Activity.timestamp <= until
+    )
+    about_followed_objects = (
+        model.Session.query(
+            followed_objects.c.follower_id.label("follower_id"),
+            model.Activity.id.label("activity_id"),
+            model.Activity.user_id.label("actor_id"),
+            model.Activity.timestamp.label("timestamp"),
+        )
+        .select_from(followed_objects)
+        .join(model.Activity, model.Activity.object_id == followed_objects.c.object_id)
+        .filter(in_period)
+    )
+    by_followed_users = (
+        model.Session.query(
+            followed_user.follower_id,
+            model.Activity.id,
+            model.Activity.user_id,
+            model.Activity.timestamp,
+        )
+        .join(model.Activity, model.Activity.user_id == followed_user.object_id)
+        .filter(in_period)
+    )
+    return about_followed_objects.union_all(by_followed_users)
+
+
+def _get_hidden_user_ids() -> typing.List[str]:
+    """Return the ids of the users whose activities are not shown in dashboards"""
+    raw_names = toolkit.config.get("ckan.hide_activity_from_users")
+    if raw_names:
+        names = raw_names.split()
+    else:
+        site_user = toolkit.get_action("get_site_user")({"ignore_auth": True}, {})
+        names = [site_user["name"]]
+    return model.User.user_ids_for_name_or_id(names)
+
+
+def _render_digest(jinja_env, num_activities: int) -> typing.Dict[str, str]:
+    site_title = toolkit.config.get("ckan.site_title")
+    subject = toolkit.ungettext(
+        "{n} new activity from {site_title}",
+        "{n} new activities from {site_title}",
+        num_activities,
+    ).format(site_title=site_title, n=num_activities)
+    body_template = jinja_env.get_template("email_notifications/email_body.txt")
+    rendered_body = body_template.render(
+        num_activities=num_activities,
+        site_url=toolkit.config.get("ckan.site_url"),
+        site_title=site_title,
+    )
+    return {"subject": subject, "body": rendered_body}
 
 
 def string_to_timedelta(s):
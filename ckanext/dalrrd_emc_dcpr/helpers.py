@@ -3,31 +3,39 @@ import logging
 import typing
 import datetime
 import uuid
-from urllib.parse import quote, urlparse, parse_qsl, urlencode
+from urllib.parse import quote
 from html import escape as html_escape
-from pathlib import Path
+import sqlalchemy
 from shapely import geometry
 from ckan import model
-from .model.saved_search import SavedSearches
 from ckan.plugins import toolkit
 from ckan.lib.helpers import build_nav_main as core_build_nav_main
-import ckan.lib.munge as munge
 import ckan.lib.helpers as h
 
 from ckan.logic import NotAuthorized
 
-from . import constants
-from .logic.action.emc import show_version
+from . import (
+    build_info,
+    caching,
+    constants,
+    memberships,
+    saved_searches,
+    thumbnails,
+    user_context,
+)
 from .constants import DCPRRequestStatus
 from .model.dcpr_request import DCPRRequest
 
 from ckan.common import c
-from ckan.lib.dictization.model_dictize import package_dictize
 from ckan.lib.dictization import table_dictize
 
 
 logger = logging.getLogger(__name__)
 
+_DASHBOARD_PAGE_SIZE = 20
+# extras that are used when rendering dashboard datasets
+_DASHBOARD_PACKAGE_EXTRAS = ("origin", "action", "metadata_thumbnail")
+
 
 def get_sasdi_themes(*args, **kwargs) -> typing.List[typing.Dict[str, str]]:
     logger.debug(f"inside get_sasdi_themes {args=} {kwargs=}")
@@ -113,7 +121,8 @@ def convert_string_extent_to_bbox(extent: str) -> typing.List[float]:
 
 
 def helper_show_version(*args, **kwargs) -> typing.Dict:
-    return show_version()
+    info = build_info.get_build_info()
+    return {"version": info.version, "git_sha": info.git_sha}
 
 
 def user_is_org_member(
@@ -122,20 +131,9 @@ def user_is_org_member(
     """Check if user has editor role in the input organization."""
     result = False
     if user is not None:
-        member_list_action = toolkit.get_action("member_list")
-        try:
-            org_members = member_list_action(
-                data_dict={"id": org_id, "object_type": "user"}
-            )
-        except:
-            return result
-        logger.debug(f"{user.id=}")
-        logger.debug(f"{org_members=}")
-        for member_id, _, member_role in org_members:
-            if user.id == member_id:
-                if role is None or member_role.lower() == role.lower():
-                    result = True
-                break
+        member_role = memberships.get_user_org_role(user.id, org_id)
+        if member_role is not None:
+            result = role is None or member_role == role.lower()
     return result
 
 
@@ -154,22 +152,20 @@ def org_member_list(org_id: str, role: typing.Optional[str] = None) -> typing.Li
 
 def user_is_staff_member(user_id: str) -> bool:
     """Check if user is a member of the staff org"""
-    memberships_action = toolkit.get_action("organization_list_for_user")
-    memberships = memberships_action(context={"user": user_id}, data_dict={})
-    portal_staff = toolkit.config.get(
-        "ckan.dalrrd_emc_dcpr.portal_staff_organization_name", "sasdi emc staff"
-    )
-    for group in memberships:
-        is_org = group.get("type", "organization") == "organization"
-        is_portal_staff = group.get("title").lower() == portal_staff.lower()
-        if is_org and is_portal_staff:
-            result = True
-            break
+    current_context = user_context.get_user_context()
+    if user_id == current_context.user_id:
+        result = current_context.is_staff_member
     else:
-        result = False
+        user_obj = model.User.get(user_id)
+        result = user_context.build_user_context(user_obj).is_staff_member
     return result
 
 
+def get_user_context() -> user_context.UserContext:
+    """Return memberships, roles and staff status of the current user"""
+    return user_context.get_user_context()
+
+
 def build_pages_nav_main(*args):
     """Reimplementation of ckanext-pages `build_pages_nav_main()`
 
@@ -228,8 +224,9 @@ def build_pages_nav_main(*args):
 
 
 def get_featured_datasets():
-    search_action = toolkit.get_action("package_search")
-    result = search_action(data_dict={"q": "featured:true", "rows": 5})
+    result = caching.search_cache.package_search(
+        {"q": "featured:true", "rows": 5}, c.userobj
+    )
     return result["results"]
 
 
@@ -237,14 +234,16 @@ def get_featured_datasets_count():
     """
     used with facets count
     """
-    search_action = toolkit.get_action("package_search")
-    result = search_action(data_dict={"q": "featured:true", "include_private": True})
+    result = caching.search_cache.package_search(
+        {"q": "featured:true", "include_private": True}, c.userobj
+    )
     return result["count"]
 
 
 def get_recently_modified_datasets():
-    search_action = toolkit.get_action("package_search")
-    result = search_action(data_dict={"sort": "metadata_modified desc", "rows": 5})
+    result = caching.search_cache.package_search(
+        {"sort": "metadata_modified desc", "rows": 5}, c.userobj
+    )
     return result["results"]
 
 
@@ -266,8 +265,8 @@ def get_all_datasets_count(user_obj):
     # this doesn't work
     # results = toolkit.get_action("package_list")(context={"auth_user_obj": c.userobj}, data_dict={'include_private':True})
 
-    result = toolkit.get_action("package_search")(
-        data_dict={"q": "*:*", "include_private": True}
+    result = caching.search_cache.package_search(
+        {"q": "*:*", "include_private": True}, c.userobj
     )
     return result["count"]
 
@@ -279,50 +278,44 @@ def get_org_public_records_count(org_id: str) -> int:
     user is not a part of them in org
     list page, we are adjusting
     """
-    query = model.Session.query(model.Package).filter(
-        model.Package.owner_org == org_id,
-        model.Package.private == "f",
-        model.Package.state == "active",
-        model.Package.type == "dataset",
-    )
-    count = len(query.all())
-    return count
+    return get_orgs_public_records_count().get(org_id, 0)
+
+
+def get_orgs_public_records_count() -> typing.Dict[str, int]:
+    """Return the number of public datasets of each organization
+
+    Counts for all organizations are retrieved with a single query, once per
+    request, as the organization list page shows many organizations.
+
+    """
+
+    counts = getattr(toolkit.g, "_emc_orgs_public_records_count", None)
+    if counts is None:
+        query = (
+            model.Session.query(model.Package.owner_org, sqlalchemy.func.count())
+            .filter(
+                model.Package.owner_org.isnot(None),
+                model.Package.private == False,
+                model.Package.state == "active",
+                model.Package.type == "dataset",
+            )
+            .group_by(model.Package.owner_org)
+        )
+        counts = dict(query.all())
+        toolkit.g._emc_orgs_public_records_count = counts
+    return counts
 
 
 def get_datasets_thumbnail(data_dict):
     """
-    Generate thumbnails based on metadataset
+    Return the thumbnail of a dataset
+
+    Thumbnails are resolved when datasets are indexed, they are only resolved here
+    for datasets that were indexed before this was the case.
     """
-    data_thumbnail = "/images/org.png"
-    logger.debug(f"data dict from helper {data_dict['organization']['image_url']}")
-    if data_dict.get("metadata_thumbnail"):
-        data_thumbnail = data_dict.get("metadata_thumbnail")
-    else:
-        is_wms = False
-        data_resource = data_dict.get("resources")
-        for resource in data_resource:
-            if resource["format"].lower() == "wms":
-                wms_url = resource["url"]
-                parsed_url = dict(parse_qsl(urlparse(wms_url).query))
-                parsed_url["format"] = "image/png; mode=8bit"
-                data_thumbnail = "%s?%s" % (
-                    wms_url.split("?")[0],
-                    urlencode(parsed_url),
-                )
-                is_wms = True
-                break
-        if not is_wms:
-            image_url = data_dict['organization']['image_url']
-            if image_url and not image_url.startswith('http'):
-                #munge here should not have an effect only doing it incase
-                #of potential vulnerability of dodgy api input
-                image_url = munge.munge_filename_legacy(image_url)
-                data_thumbnail = h.url_for_static(
-                'uploads/group/%s' % data_dict['organization']['image_url'],
-                qualified=True
-                )
-        
-    return data_thumbnail
+    return data_dict.get(thumbnails.THUMBNAIL_FIELD) or thumbnails.get_thumbnail_url(
+        data_dict
+    )
 
 
 def _pad_geospatial_extent(extent: typing.Dict, padding: float) -> typing.Dict:
@@ -386,86 +379,61 @@ def user_is_dcpr_request_owner(user_id, dcpr_request_id) -> bool:
     return result
 
 
-def get_org_memberships(user_id: str):
+def get_org_memberships(user_id: str) -> typing.List[memberships.Membership]:
     """Return a list of organizations and roles where the input user is a member"""
-    query = (
-        model.Session.query(model.Group, model.Member.capacity)
-        .join(model.Member, model.Member.group_id == model.Group.id)
-        .join(model.User, model.User.id == model.Member.table_id)
-        .filter(
-            model.User.id == user_id,
-            model.Member.state == "active",
-            model.Group.is_organization == True,
-        )
-        .order_by(model.Group.name)
-    )
-    return query.all()
+    return memberships.get_user_memberships(user_id)
 
 
 def get_public_dcpr_requests_count():
     """
     used by the dcpr facet
     """
-    public_requests = toolkit.get_action("dcpr_request_list_public")(
-        {"context": {"auth_user_obj": c.userobj}, "data_dict": {}}
-    )
-    return len(public_requests)
+    return _get_dcpr_request_status_count("public")
 
 
 def get_my_dcpr_requests_count():
     """
     used by the dcpr facet
     """
-    try:
-        my_requests = toolkit.get_action("my_dcpr_request_list")(
-            {"context": {"auth_user_obj": c.userobj}, "data_dict": {}}
-        )
-    except NotAuthorized:
-        return ""
-
-    return len(my_requests)
+    return _get_dcpr_request_status_count("mine")
 
 
 def get_under_preparation_dcpr_requests_count():
     """
     used by the dcpr facet
     """
-    try:
-        requests = toolkit.get_action("dcpr_request_list_under_preparation")(
-            {"context": {"auth_user_obj": c.userobj}, "data_dict": {}}
-        )
-    except NotAuthorized:
-        return ""
-
-    return len(requests)
+    return _get_dcpr_request_status_count("under_preparation")
 
 
 def get_dcpr_requests_awaiting_csi_moderation_count():
     """
     used by the dcpr facet
     """
-    try:
-        requests = toolkit.get_action("dcpr_request_list_awaiting_csi_moderation")(
-            {"context": {"auth_user_obj": c.userobj}, "data_dict": {}}
-        )
-    except NotAuthorized:
-        return ""
-
-    return len(requests)
+    return _get_dcpr_request_status_count("awaiting_csi_moderation")
 
 
 def get_dcpr_requests_awaiting_nsif_moderation_count():
     """
     used by the dcpr facet
     """
-    try:
-        requests = toolkit.get_action("dcpr_request_list_awaiting_nsif_moderation")(
-            {"context": {"auth_user_obj": c.userobj}, "data_dict": {}}
-        )
-    except NotAuthorized:
-        return ""
+    return _get_dcpr_request_status_count("awaiting_nsif_moderation")
+
 
-    return len(requests)
+def _get_dcpr_request_status_count(list_name: str):
+    """Return the count of a DCPR request list, or an empty string if not authorized
+
+    Counts are retrieved once per request, as the DCPR facet shows all of them.
+
+    """
+
+    counts = getattr(toolkit.g, "_emc_dcpr_request_status_counts", None)
+    if counts is None:
+        counts = toolkit.get_action("dcpr_request_status_counts")(
+            context={"auth_user_obj": c.userobj}, data_dict={}
+        )
+        toolkit.g._emc_dcpr_request_status_counts = counts
+    count = counts.get(list_name)
+    return count if count is not None else ""
 
 
 def get_dcpr_requests_approved_by_nsif(request_origin):
@@ -579,48 +547,20 @@ def get_current_release():
     if it's staging it uses v*.*.*-rc, rather
     if it's production v.*.*.*
     """
-    current_file_path = Path(__file__)
-    releases_file_path = current_file_path.parent.joinpath("releases.txt")
-    with open(releases_file_path) as f:
-        releases = json.loads(f.read())
-        current_branch = _get_git_branch()
-        # this might change so main is release candidate
-        # and release branch is the latest release
-        if current_branch == "development":
-            return releases.get("latest_release_candidate")
-        elif current_branch == "main":
-            return releases.get("latest_release")
-        else:
-            return ""
-
-
-def _get_git_branch():
-    """
-    getting the current
-    branch name
-    """
-    return "development"
+    return build_info.get_build_info().release
 
 
-def get_saved_searches():
+def get_saved_searches(
+    cursor: typing.Optional[str] = None,
+) -> saved_searches.SavedSearchPage:
     """
-    returns saved searches
-    based on a user id
+    returns a page of saved searches of the current user,
+    or of all users if the current user is a sysadmin
     """
     if c.userobj is None:
-        return []
-
-    user_id = c.userobj.id
-    if c.userobj.sysadmin:
-        q = f""" select saved_search_title, search_query, saved_search_date, saved_search_id, owner_user from saved_searches order by owner_user """
-    else:
-        q = f""" select saved_search_title, search_query, saved_search_date, saved_search_id from saved_searches where owner_user='{user_id}' order by saved_search_date desc """
-    rows = model.Session.execute(q)
-    saved_searches_list = []
-    for row in rows:
-        saved_searches_list.append(row)
-    # saved_searches_list = SavedSearches.get(SavedSearches,owner_user=user_id)
-    return saved_searches_list
+        return saved_searches.SavedSearchPage(items=[], next_cursor=None)
+    owner_user = None if c.userobj.sysadmin else c.userobj.id
+    return saved_searches.list_saved_searches(owner_user, cursor=cursor)
 
 
 def get_user_name(user_id):
@@ -665,18 +605,10 @@ def get_seo_metatags(site_key):
     """
     get metatags value for SEO
     """
-    data_dict = {
-        "site_author": toolkit.config.get(
-            "ckan.site_author",
-        ),
-        "site_description": toolkit.config.get(
-            "ckan.site_description",
-        ),
-        "site_keywords": toolkit.config.get(
-            "ckan.site_keywords",
-        ),
-    }
-    return data_dict[site_key]
+    if site_key == "site_description":
+        # the site description can be edited at runtime
+        return toolkit.config.get("ckan.site_description")
+    return build_info.get_build_info().seo_metatags[site_key]
 
 
 def get_year():
@@ -687,24 +619,168 @@ def get_year():
     return datetime.datetime.now().year
 
 
-def get_user_dashboard_packages(user_id):
+def get_user_dashboard_packages(
+    user_id: str, limit: int = _DASHBOARD_PAGE_SIZE, offset: int = 0
+) -> typing.List[typing.Dict]:
     """
     the current behavior displays
     all the avialable datastes to the
     user, we need only the datasets
     created by the user
-    """
-    # q = f""" select package.*, key, value from package join package_extra on package_id=package.id where package.creator_user_id='{user_id}' """
-    # rows = model.Session.execute(q)
-    # packages = []
-    # for row in rows:
-    #     packages.append(dict(row))
-    # return packages
-    query = model.Session.query(model.Package).filter(
-        model.Package.creator_user_id == user_id
+
+    Only the fields that are rendered by the dashboard are retrieved, with a
+    constant number of queries per page. Results are memoized for the current
+    request.
+    """
+    memo = _get_dashboard_packages_memo()
+    key = ("packages", user_id, limit, offset)
+    if key not in memo:
+        memo[key] = _list_user_dashboard_packages(user_id, limit, offset)
+    return memo[key]
+
+
+def get_user_dashboard_packages_count(user_id: str) -> int:
+    memo = _get_dashboard_packages_memo()
+    key = ("count", user_id)
+    if key not in memo:
+        memo[key] = (
+            model.Session.query(sqlalchemy.func.count(model.Package.id))
+            .filter(model.Package.creator_user_id == user_id)
+            .scalar()
+        )
+    return memo[key]
+
+
+def get_user_dashboard_packages_page(user_id: str):
+    """Return the current page of the datasets created by the user"""
+    page = h.get_page_number(toolkit.request.args)
+    # repeated query args are kept as lists, which url_for() repeats in the url
+    url_args = {
+        k: values if len(values) > 1 else values[0]
+        for k, values in toolkit.request.args.to_dict(flat=False).items()
+        if k != "page"
+    }
+
+    def pager_url(q=None, page=None):
+        return h.url_for(
+            toolkit.request.endpoint,
+            **{**url_args, "page": page, **(toolkit.request.view_args or {})},
+        )
+
+    return h.Page(
+        collection=get_user_dashboard_packages(
+            user_id,
+            limit=_DASHBOARD_PAGE_SIZE,
+            offset=(page - 1) * _DASHBOARD_PAGE_SIZE,
+        ),
+        items_per_page=_DASHBOARD_PAGE_SIZE,
+        url=pager_url,
+        page=page,
+        item_count=get_user_dashboard_packages_count(user_id),
+        presliced_list=True,
     )
-    packages = [
-        package_dictize(package, context={"user": user_id, "model": model})
-        for package in query.all()
-    ]
-    return packages
+
+
+def _get_dashboard_packages_memo() -> typing.Dict:
+    memo = getattr(toolkit.g, "_emc_dashboard_packages", None)
+    if memo is None:
+        memo = {}
+        toolkit.g._emc_dashboard_packages = memo
+    return memo
+
+
+def _list_user_dashboard_packages(
+    user_id: str, limit: int, offset: int
+) -> typing.List[typing.Dict]:
+    packages = (
+        model.Session.query(
+            model.Package.id,
+            model.Package.name,
+            model.Package.title,
+            model.Package.notes,
+            model.Package.type,
+            model.Package.private,
+            model.Package.state,
+            model.Package.metadata_modified,
+            model.Package.owner_org,
+        )
+        .filter(model.Package.creator_user_id == user_id)
+        .order_by(model.Package.metadata_modified.desc(), model.Package.id)
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    package_ids = [package.id for package in packages]
+    extras_by_package: typing.Dict[str, typing.List] = {}
+    resources_by_package: typing.Dict[str, typing.List] = {}
+    organizations = {}
+    if len(package_ids) > 0:
+        extras_query = model.Session.query(
+            model.PackageExtra.package_id,
+            model.PackageExtra.key,
+            model.PackageExtra.value,
+        ).filter(
+            model.PackageExtra.package_id.in_(package_ids),
+            model.PackageExtra.key.in_(_DASHBOARD_PACKAGE_EXTRAS),
+            model.PackageExtra.state == "active",
+        )
+        for package_id, key, value in extras_query.all():
+            extras_by_package.setdefault(package_id, []).append(
+                {"key": key, "value": value}
+            )
+        resources_query = (
+            model.Session.query(
+                model.Resource.package_id,
+                model.Resource.id,
+                model.Resource.name,
+                model.Resource.format,
+                model.Resource.url,
+            )
+            .filter(
+                model.Resource.package_id.in_(package_ids),
+                model.Resource.state == "active",
+            )
+            .order_by(model.Resource.position)
+        )
+        for package_id, *resource in resources_query.all():
+            resources_by_package.setdefault(package_id, []).append(
+                dict(zip(("id", "name", "format", "url"), resource))
+            )
+        org_ids = {package.owner_org for package in packages if package.owner_org}
+        if len(org_ids) > 0:
+            orgs_query = model.Session.query(
+                model.Group.id,
+                model.Group.name,
+                model.Group.title,
+                model.Group.image_url,
+            ).filter(model.Group.id.in_(org_ids))
+            for org_id, *org in orgs_query.all():
+                organizations[org_id] = dict(
+                    zip(("id", "name", "title", "image_url"), (org_id, *org))
+                )
+    result = []
+    for package in packages:
+        extras = extras_by_package.get(package.id, [])
+        package_dict = {
+            "id": package.id,
+            "name": package.name,
+            "title": package.title,
+            "notes": package.notes,
+            "type": package.type,
+            "private": package.private,
+            "state": package.state,
+            "metadata_modified": (
+                package.metadata_modified.isoformat()
+                if package.metadata_modified
+                else None
+            ),
+            "owner_org": package.owner_org,
+            "organization": organizations.get(package.owner_org),
+            "extras": extras,
+            "resources": resources_by_package.get(package.id, []),
+        }
+        for extra in extras:
+            if extra["key"] == "metadata_thumbnail":
+                package_dict["metadata_thumbnail"] = extra["value"]
+        result.append(package_dict)
+    return result
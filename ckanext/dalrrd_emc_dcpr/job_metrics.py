@@ -0,0 +1,86 @@
+"""Latency metrics of background jobs
+
+RQ workers run each job in a forked process, so metrics kept in memory would be lost
+as soon as the job finishes. Instead, each job adds its timings to counters stored in
+CKAN's Redis instance, which are shared by all workers. For each job name:
+
+- `queued_seconds` is how long jobs waited in their queue before starting. A growing
+  value means workers cannot keep up with the rate at which jobs are enqueued;
+- `run_seconds` is how long jobs took to run.
+
+Redis errors are logged and otherwise ignored, a job never fails because its metrics
+could not be stored.
+
+"""
+
+import datetime as dt
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+_NAMESPACE = "ckanext-dalrrd-emc-dcpr:job-metrics"
+_JOB_NAMES_KEY = f"{_NAMESPACE}:job-names"
+
+
+def record_job(
+    job_name: str, queued_seconds: typing.Optional[float], run_seconds: float
+) -> None:
+    key = f"{_NAMESPACE}:{job_name}"
+    try:
+        pipeline = _connect().pipeline()
+        pipeline.sadd(_JOB_NAMES_KEY, job_name)
+        pipeline.hincrby(key, "runs", 1)
+        pipeline.hincrbyfloat(key, "total_run_seconds", run_seconds)
+        pipeline.hset(key, "last_run_seconds", run_seconds)
+        if queued_seconds is not None:
+            pipeline.hincrby(key, "queued_runs", 1)
+            pipeline.hincrbyfloat(key, "total_queued_seconds", queued_seconds)
+            pipeline.hset(key, "last_queued_seconds", queued_seconds)
+        pipeline.hset(key, "last_finished_at", dt.datetime.utcnow().isoformat())
+        pipeline.execute()
+    except Exception:
+        logger.exception(f"Could not store the metrics of job {job_name!r}")
+
+
+def get_job_metrics() -> typing.Dict[str, typing.Dict]:
+    """Return the metrics of each job that has run, keyed by job name"""
+    connection = _connect()
+    result = {}
+    for raw_name in sorted(connection.smembers(_JOB_NAMES_KEY)):
+        job_name = _decode(raw_name)
+        raw_metrics = {
+            _decode(k): _decode(v)
+            for k, v in connection.hgetall(f"{_NAMESPACE}:{job_name}").items()
+        }
+        runs = int(raw_metrics.get("runs", 0))
+        queued_runs = int(raw_metrics.get("queued_runs", 0))
+        result[job_name] = {
+            "runs": runs,
+            "mean_run_seconds": _mean(raw_metrics.get("total_run_seconds"), runs),
+            "last_run_seconds": _as_float(raw_metrics.get("last_run_seconds")),
+            "mean_queued_seconds": _mean(
+                raw_metrics.get("total_queued_seconds"), queued_runs
+            ),
+            "last_queued_seconds": _as_float(raw_metrics.get("last_queued_seconds")),
+            "last_finished_at": raw_metrics.get("last_finished_at"),
+        }
+    return result
+
+
+def _connect():
+    from ckan.lib.redis import connect_to_redis
+
+    return connect_to_redis()
+
+
+def _decode(value: typing.Union[str, bytes]) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _as_float(value: typing.Optional[str]) -> typing.Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _mean(total: typing.Optional[str], count: int) -> typing.Optional[float]:
+    return float(total) / count if total is not None and count > 0 else None
@@ -8,7 +8,13 @@ from ckan.plugins import toolkit
 
 from . import (
     email_notifications,
+    mail_delivery,
     provide_request_context,
+    recipients,
+    saved_search_notifications,
+    stats,
+    thumbnails,
+    xml_upload,
 )
 from .constants import (
     DatasetManagementActivityType,
@@ -24,6 +30,42 @@ def test_job(*args, **kwargs):
     logger.debug(f"inside test_job - {args=} {kwargs=}")
 
 
+def refresh_stats(rebuild: bool = False):
+    result = stats.refresh_stats(rebuild=rebuild)
+    logger.info(
+        f"Refreshed stats - updated {result.weeks_updated} weeks, activity "
+        f"watermark is now {result.activity_watermark}"
+    )
+
+
+@provide_request_context
+def notify_new_saved_search_results(context):
+    result = saved_search_notifications.notify_new_saved_search_results()
+    logger.info(
+        f"Checked {result.num_saved_searches} saved searches with "
+        f"{result.num_distinct_queries} distinct queries "
+        f"({result.num_failed_queries} failed) - sent {result.num_notifications} "
+        f"notifications"
+    )
+
+
+@provide_request_context
+def process_xml_upload(context, upload_id: str):
+    xml_upload.process_upload(upload_id)
+
+
+@provide_request_context
+def create_xml_upload_datasets(context, upload_id: str, positions: typing.List[int]):
+    xml_upload.create_datasets(upload_id, positions)
+    logger.info(f"Processed files {positions} of XML upload {upload_id!r}")
+
+
+def prerender_wms_thumbnail(dataset_id: str):
+    path = thumbnails.prerender_wms_thumbnail(dataset_id)
+    if path is not None:
+        logger.info(f"Stored thumbnail of dataset {dataset_id!r} at {str(path)!r}")
+
+
 @provide_request_context
 def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
     activity_obj = model.Activity.get(activity_id)
@@ -31,9 +73,8 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
         activity_type = DcprManagementActivityType(activity_obj.activity_type)
         dcpr_request = (activity_obj.data or {}).get("dcpr_request")
         if dcpr_request is not None:
-            owner_user_obj = model.User.get(dcpr_request["owner_user"])
-            nsif_reviewer_obj = model.User.get(dcpr_request["nsif_reviewer"])
-            csi_reviewer_obj = model.User.get(dcpr_request["csi_moderator"])
+            dcpr_recipients = recipients.resolve_dcpr_recipients(dcpr_request)
+            owners = [r for r in [dcpr_recipients.owner] if r is not None]
             render_context = {
                 "site_title": toolkit.config.get("ckan.site_title", "SASDI EMC"),
                 "site_url": toolkit.config.get("ckan.site_url"),
@@ -68,9 +109,9 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                     organization=CSI_ORG_NAME,
                 ),
                 "activity_type": activity_type,
-                "owner_user_obj": owner_user_obj,
-                "nsif_reviewer_obj": nsif_reviewer_obj,
-                "csi_reviewer_obj": csi_reviewer_obj,
+                "owner_user_obj": dcpr_recipients.owner,
+                "nsif_reviewer_obj": dcpr_recipients.nsif_reviewer,
+                "csi_reviewer_obj": dcpr_recipients.csi_moderator,
             }
             if (
                 activity_type == DcprManagementActivityType.SUBMIT_DCPR_REQUEST
@@ -83,7 +124,9 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                         ),
                     }
                 )
-                messages = _get_dcpr_nsif_rendered_messages(render_context)
+                messages = _get_dcpr_nsif_rendered_messages(
+                    dcpr_recipients.nsif_members, render_context
+                )
             elif (
                 activity_type == DcprManagementActivityType.ACCEPT_DCPR_REQUEST_NSIF
             ):  # notify owner and CSI members
@@ -95,9 +138,11 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                         ),
                     }
                 )
-                messages = _get_dcpr_csi_rendered_messages(render_context)
+                messages = _get_dcpr_csi_rendered_messages(
+                    dcpr_recipients.csi_members, render_context
+                )
                 messages.extend(
-                    _get_dcpr_owner_rendered_messages([owner_user_obj], render_context)
+                    _get_dcpr_owner_rendered_messages(owners, render_context)
                 )
             elif (
                 activity_type == DcprManagementActivityType.REJECT_DCPR_REQUEST_NSIF
@@ -105,9 +150,7 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                 render_context["action_subject_message"] = toolkit._(
                     "has been rejected by NSIF"
                 )
-                messages = _get_dcpr_owner_rendered_messages(
-                    [owner_user_obj], render_context
-                )
+                messages = _get_dcpr_owner_rendered_messages(owners, render_context)
             elif (
                 activity_type
                 == DcprManagementActivityType.REQUEST_CLARIFICATION_DCPR_REQUEST_NSIF
@@ -115,9 +158,7 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                 render_context["action_subject_message"] = toolkit._(
                     "needs clarification"
                 )
-                messages = _get_dcpr_owner_rendered_messages(
-                    [owner_user_obj], render_context
-                )
+                messages = _get_dcpr_owner_rendered_messages(owners, render_context)
             elif (
                 activity_type
                 == DcprManagementActivityType.RESIGN_NSIF_REVIEWER_DCPR_REQUEST
@@ -130,25 +171,23 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                         ),
                     }
                 )
-                messages = _get_dcpr_nsif_rendered_messages(render_context)
+                messages = _get_dcpr_nsif_rendered_messages(
+                    dcpr_recipients.nsif_members, render_context
+                )
             elif (
                 activity_type == DcprManagementActivityType.ACCEPT_DCPR_REQUEST_CSI
             ):  # notify owner
                 render_context["action_subject_message"] = toolkit._(
                     "has been accepted by CSI"
                 )
-                messages = _get_dcpr_owner_rendered_messages(
-                    [owner_user_obj], render_context
-                )
+                messages = _get_dcpr_owner_rendered_messages(owners, render_context)
             elif (
                 activity_type == DcprManagementActivityType.REJECT_DCPR_REQUEST_CSI
             ):  # notify owner
                 render_context["action_subject_message"] = toolkit._(
                     "has been rejected by CSI"
                 )
-                messages = _get_dcpr_owner_rendered_messages(
-                    [owner_user_obj], render_context
-                )
+                messages = _get_dcpr_owner_rendered_messages(owners, render_context)
             elif (
                 activity_type
                 == DcprManagementActivityType.REQUEST_CLARIFICATION_DCPR_REQUEST_CSI
@@ -156,9 +195,7 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                 render_context["action_subject_message"] = toolkit._(
                     "needs clarification"
                 )
-                messages = _get_dcpr_owner_rendered_messages(
-                    [owner_user_obj], render_context
-                )
+                messages = _get_dcpr_owner_rendered_messages(owners, render_context)
             elif (
                 activity_type
                 == DcprManagementActivityType.RESIGN_CSI_REVIEWER_DCPR_REQUEST
@@ -171,21 +208,24 @@ def notify_dcpr_actors_of_relevant_status_change(context, activity_id: str):
                         ),
                     }
                 )
-                messages = _get_dcpr_csi_rendered_messages(render_context)
+                messages = _get_dcpr_csi_rendered_messages(
+                    dcpr_recipients.csi_members, render_context
+                )
             else:
                 raise NotImplementedError
-            for user_obj, subject, body in messages:
-                logger.debug(f"{subject=}")
-                logger.debug(f"{body=}")
-                logger.debug(f"----------")
-                email_notifications.send_notification(
-                    {
-                        "name": user_obj.name,
-                        "display_name": user_obj.display_name,
-                        "email": user_obj.email,
-                    },
-                    {"subject": subject, "body": body},
-                )
+            with mail_delivery.mail_session():
+                for user_obj, subject, body in messages:
+                    logger.debug(f"{subject=}")
+                    logger.debug(f"{body=}")
+                    logger.debug(f"----------")
+                    email_notifications.send_notification(
+                        {
+                            "name": user_obj.name,
+                            "display_name": user_obj.display_name,
+                            "email": user_obj.email,
+                        },
+                        {"subject": subject, "body": body},
+                    )
     else:
         raise RuntimeError(f"Could not retrieve activity with id {activity_id!r}")
 
@@ -208,31 +248,28 @@ def notify_org_admins_of_dataset_management_request(activity_id: str):
                 context={"ignore_auth": True},
                 data_dict={
                     "id": org_id,
-                    "include_users": True,
+                    "include_users": False,
                 },
             )
-            jinja_env = email_notifications.get_jinja_env()
             subject_path, body_path = templates_map[activity_type]
-            subject_template = jinja_env.get_template(subject_path)
-            body_template = jinja_env.get_template(body_path)
-            for member in organization.get("users", []):
-                is_active = member.get("state") == "active"
-                is_org_admin = member.get("capacity") == "admin"
-                if is_active and is_org_admin:
-                    user_obj = model.User.get(member["id"])
+            messages = email_notifications.render_notifications(
+                subject_path,
+                body_path,
+                context={
+                    "organization": organization,
+                    "dataset": dataset,
+                    "h": toolkit.h,
+                    "site_title": toolkit.config.get("ckan.site_title", "SASDI EMC"),
+                    "site_url": toolkit.config.get("ckan.site_url", ""),
+                },
+                recipients=recipients.get_org_admins(org_id),
+                recipient_variable="user_obj",
+            )
+            with mail_delivery.mail_session():
+                for user_obj, subject, body in messages:
                     logger.debug(
                         f"About to send a notification to {user_obj.name!r}..."
                     )
-                    subject = subject_template.render(
-                        site_title=toolkit.config.get("ckan.site_title", "SASDI EMC")
-                    )
-                    body = body_template.render(
-                        organization=organization,
-                        user_obj=user_obj,
-                        dataset=dataset,
-                        h=toolkit.h,
-                        site_url=toolkit.config.get("ckan.site_url", ""),
-                    )
                     email_notifications.send_notification(
                         {
                             "name": user_obj.name,
@@ -246,9 +283,9 @@ def notify_org_admins_of_dataset_management_request(activity_id: str):
 
 
 def _get_dcpr_owner_rendered_messages(
-    owners: typing.List[model.User],
+    owners: typing.List[recipients.Recipient],
     render_context: typing.Dict,
-) -> typing.List[typing.Tuple[model.User, str, str]]:
+) -> typing.List[typing.Tuple[recipients.Recipient, str, str]]:
     return _get_dcpr_rendered_messages(
         owners,
         render_context=render_context,
@@ -258,10 +295,11 @@ def _get_dcpr_owner_rendered_messages(
 
 
 def _get_dcpr_nsif_rendered_messages(
+    nsif_members: typing.List[recipients.Recipient],
     render_context: typing.Dict,
-) -> typing.List[typing.Tuple[model.User, str, str]]:
+) -> typing.List[typing.Tuple[recipients.Recipient, str, str]]:
     return _get_dcpr_rendered_messages(
-        _get_org_members(NSIF_ORG_NAME),
+        nsif_members,
         render_context=render_context,
         subject_template_path="email_notifications/dcpr_request_workflow_change_subject.txt",
         body_template_path="email_notifications/dcpr_request_workflow_change_reviewer_body.txt",
@@ -269,10 +307,11 @@ def _get_dcpr_nsif_rendered_messages(
 
 
 def _get_dcpr_csi_rendered_messages(
+    csi_members: typing.List[recipients.Recipient],
     render_context: typing.Dict,
-) -> typing.List[typing.Tuple[model.User, str, str]]:
+) -> typing.List[typing.Tuple[recipients.Recipient, str, str]]:
     return _get_dcpr_rendered_messages(
-        _get_org_members(CSI_ORG_NAME),
+        csi_members,
         render_context=render_context,
         subject_template_path="email_notifications/dcpr_request_workflow_change_subject.txt",
         body_template_path="email_notifications/dcpr_request_workflow_change_reviewer_body.txt",
@@ -280,38 +319,16 @@ def _get_dcpr_csi_rendered_messages(
 
 
 def _get_dcpr_rendered_messages(
-    recipients: typing.List,
+    users: typing.List[recipients.Recipient],
     render_context: typing.Dict,
     subject_template_path: str,
     body_template_path: str,
-) -> typing.List[typing.Tuple[model.User, str, str]]:
-    logger.debug("render context:", render_context, "\n", "recipients:", recipients)
-    jinja_env = email_notifications.get_jinja_env()
-    subject_template = jinja_env.get_template(subject_template_path)
-    body_template = jinja_env.get_template(body_template_path)
-    result = []
-    for user_obj in recipients:
-        subject_context = render_context.copy()
-        subject_context["recipient_user_obj"] = user_obj
-        body_context = render_context.copy()
-        body_context["recipient_user_obj"] = user_obj
-        rendered_subject = subject_template.render(**subject_context)
-        rendered_body = body_template.render(**body_context)
-        result.append((user_obj, rendered_subject, rendered_body))
-    return result
-
-
-def _get_org_members(org_name: str) -> typing.List:
-    organization: typing.Dict = toolkit.get_action("organization_show")(
-        context={"ignore_auth": True},
-        data_dict={
-            "id": org_name,
-            "include_users": True,
-        },
+) -> typing.List[typing.Tuple[recipients.Recipient, str, str]]:
+    logger.debug(f"render context: {render_context} recipients: {users}")
+    return email_notifications.render_notifications(
+        subject_template_path,
+        body_template_path,
+        context=render_context,
+        recipients=users,
+        recipient_variable="recipient_user_obj",
     )
-    members = []
-    for user in organization.get("users", []):
-        user_obj = model.User.get(user["id"])
-        if user.get("state") == "active":
-            members.append(user_obj)
-    return members
@@ -6,7 +6,9 @@ import typing
 import ckan.plugins.toolkit as toolkit
 from ckan.model.domain_object import DomainObject
 
+from ... import memberships, user_context
 from ...model.user_extra_fields import UserExtraFields
+from ...plugins import facets
 from .dataset_versioning_control import handle_versioning
 from .handle_repeating_subfields import handle_repeating_subfields_naming
 from .add_named_url import handle_named_url
@@ -246,6 +248,10 @@ def _dictize_user_extra_fields(user_extra_fields: UserExtraFields) -> typing.Dic
 @toolkit.chained_action
 def organization_create(original_action, context, data_dict):
     original_result = original_action(context, data_dict)
+    facets.group_title_index.set_title(
+        original_result["name"], original_result.get("title")
+    )
+    user_context.invalidate_portal_staff_org()
     # mime = MimeTypes()
     # mime_type = mime.guess_type(original_result["image_url"])
 
@@ -257,6 +263,7 @@ def organization_create(original_action, context, data_dict):
 
 @toolkit.chained_action
 def organization_update(original_action, context, data_dict):
+    previous_name = _get_group_name(context, data_dict)
     original_result = original_action(context, data_dict)
     mime = MimeTypes()
     mime_type = mime.guess_type(original_result["image_url"])
@@ -265,8 +272,52 @@ def organization_update(original_action, context, data_dict):
     
     if mime_type[0] in mimeNotAllowed:
         raise ValidationError([f"Mimetype {mime_type} is not allowed!"])
+    if previous_name is not None and previous_name != original_result["name"]:
+        facets.group_title_index.remove(previous_name)
+    facets.group_title_index.set_title(
+        original_result["name"], original_result.get("title")
+    )
+    user_context.invalidate_portal_staff_org()
+    if "users" in data_dict:
+        # members are saved directly, without going through `member_create`
+        memberships.invalidate()
+    return original_result
+
+
+@toolkit.chained_action
+def organization_delete(original_action, context, data_dict):
+    name = _get_group_name(context, data_dict)
+    original_result = original_action(context, data_dict)
+    if name is not None:
+        facets.group_title_index.remove(name)
+    memberships.invalidate()
+    user_context.invalidate_portal_staff_org()
+    return original_result
+
+
+@toolkit.chained_action
+def member_create(original_action, context, data_dict):
+    original_result = original_action(context, data_dict)
+    if data_dict.get("object_type") == "user":
+        memberships.invalidate()
+    return original_result
+
+
+@toolkit.chained_action
+def member_delete(original_action, context, data_dict):
+    original_result = original_action(context, data_dict)
+    if data_dict.get("object_type") == "user":
+        memberships.invalidate()
     return original_result
 
+
+def _get_group_name(
+    context: typing.Dict, data_dict: typing.Dict
+) -> typing.Optional[str]:
+    group = context["model"].Group.get(data_dict.get("id"))
+    return group.name if group is not None else None
+
+
 @toolkit.chained_action
 def package_create(original_action, context, data_dict):
     """
@@ -11,6 +11,7 @@ from ....constants import (
     DCPRRequestStatus,
 )
 from .. import create_dcpr_management_activity
+from .get import invalidate_dcpr_request_status_counts
 
 logger = logging.getLogger(__name__)
 
@@ -105,6 +106,7 @@ def dcpr_request_create(context, data_dict):
     context["updated_by"] = "owner"
     request_obj = dcpr_dictization.dcpr_request_dict_save(validated_data, context)
     model.Session.commit()
+    invalidate_dcpr_request_status_counts()
     logger.debug(f"{request_obj=}")
     create_dcpr_management_activity(
         request_obj,
@@ -6,6 +6,7 @@ from ....constants import DcprManagementActivityType
 from ....model import dcpr_request
 from ...schema import delete_dcpr_request_schema
 from .. import create_dcpr_management_activity
+from .get import invalidate_dcpr_request_status_counts
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +28,7 @@ def dcpr_request_delete(context, data_dict):
     )
     model.Session.delete(request_obj)
     model.Session.commit()
+    invalidate_dcpr_request_status_counts()
     create_dcpr_management_activity(
         request_obj,
         activity_type=DcprManagementActivityType.DELETE_DCPR_REQUEST,
@@ -1,15 +1,44 @@
+import base64
+import binascii
+import datetime as dt
+import json
 import logging
 import typing
 
 from ckan.plugins import toolkit
+from sqlalchemy import and_, func, or_
 
+from ....caching import TTLCache
 from ....model import dcpr_request
 from .... import dcpr_dictization
 from ....constants import DCPRRequestStatus
-from ...schema import show_dcpr_request_schema
+from ...schema import list_dcpr_requests_schema, show_dcpr_request_schema
 
 logger = logging.getLogger(__name__)
 
+# grouped (status, owner_user) counts of DCPR requests. This is invalidated by the
+# actions that modify DCPR requests - the TTL takes care of modifications made by
+# other processes
+_status_counts_cache = TTLCache(ttl=60)
+_STATUS_COUNTS_CACHE_KEY = "dcpr_request_status_owner_counts"
+
+# ordering of DCPR request lists, as (column, is_descending) pairs. The last column
+# ensures the order is deterministic, which is needed for keyset pagination
+_ORDERING = (
+    (dcpr_request.DCPRRequest.submission_date, True),
+    (dcpr_request.DCPRRequest.nsif_review_date, False),
+    (dcpr_request.DCPRRequest.csi_moderation_date, False),
+    (dcpr_request.DCPRRequest.proposed_project_name, False),
+    (dcpr_request.DCPRRequest.csi_reference_id, False),
+)
+_DATETIME_COLUMN_NAMES = (
+    "submission_date",
+    "nsif_review_date",
+    "csi_moderation_date",
+)
+_DEFAULT_PAGE_SIZE = 20
+_MAX_PAGE_SIZE = 1000
+
 
 @toolkit.side_effect_free
 def dcpr_request_show(context: typing.Dict, data_dict: typing.Dict) -> typing.Dict:
@@ -27,7 +56,7 @@ def dcpr_request_show(context: typing.Dict, data_dict: typing.Dict) -> typing.Di
 @toolkit.side_effect_free
 def dcpr_request_list_public(
     context: typing.Dict, data_dict: typing.Dict
-) -> typing.List:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
     """Return a list of public DCPR requests."""
     toolkit.check_access("dcpr_request_list_public_auth", context, data_dict or {})
     relevant_statuses = (
@@ -44,7 +73,7 @@ def dcpr_request_list_public(
 @toolkit.side_effect_free
 def my_dcpr_request_list(
     context: typing.Dict, data_dict: typing.Optional[typing.Dict] = None
-) -> typing.List[typing.Dict]:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
     toolkit.check_access("my_dcpr_request_list_auth", context, data_dict or {})
     return _get_dcpr_request_list(
         context,
@@ -56,7 +85,7 @@ def my_dcpr_request_list(
 @toolkit.side_effect_free
 def dcpr_request_list_under_preparation(
     context: typing.Dict, data_dict: typing.Dict
-) -> typing.List[typing.Dict]:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
     """Return a list of DCPR requests that are still being prepared.
 
     This function returns all DCPR requests that are being prepared by all users.
@@ -77,7 +106,7 @@ def dcpr_request_list_under_preparation(
 @toolkit.side_effect_free
 def dcpr_request_list_awaiting_csi_moderation(
     context: typing.Dict, data_dict: typing.Dict
-) -> typing.List:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
     """Return a list of DCPR requests that are awaiting moderation by CSI members."""
     # mohab: we are adding request_origin
     # so the check is not applied when it
@@ -104,7 +133,7 @@ def dcpr_request_list_awaiting_csi_moderation(
 @toolkit.side_effect_free
 def dcpr_request_list_awaiting_nsif_moderation(
     context: typing.Dict, data_dict: typing.Dict
-) -> typing.List:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
     """Return a list of DCPR requests that are awaiting moderation by NSIF members."""
     toolkit.check_access(
         "dcpr_request_list_pending_nsif_auth", context, data_dict or {}
@@ -120,24 +149,218 @@ def dcpr_request_list_awaiting_nsif_moderation(
     )
 
 
+@toolkit.side_effect_free
+def dcpr_request_status_counts(
+    context: typing.Dict, data_dict: typing.Optional[typing.Dict] = None
+) -> typing.Dict:
+    """Return the number of DCPR requests shown in each of the DCPR request lists
+
+    All counts are derived from a single grouped query, which is cached. Counts for
+    lists that the current user is not authorized to see are returned as `None`.
+
+    """
+
+    counts = _status_counts_cache.get_or_set(
+        _STATUS_COUNTS_CACHE_KEY,
+        lambda: _get_status_owner_counts(context["model"].Session),
+    )
+    by_status: typing.Dict[str, int] = {}
+    for (status, _), count in counts.items():
+        by_status[status] = by_status.get(status, 0) + count
+    list_definitions = {
+        "public": (
+            "dcpr_request_list_public_auth",
+            (DCPRRequestStatus.ACCEPTED, DCPRRequestStatus.REJECTED),
+        ),
+        "under_preparation": (
+            "dcpr_request_list_under_preparation_auth",
+            (DCPRRequestStatus.UNDER_PREPARATION,),
+        ),
+        "awaiting_nsif_moderation": (
+            "dcpr_request_list_pending_nsif_auth",
+            (
+                DCPRRequestStatus.AWAITING_NSIF_REVIEW,
+                DCPRRequestStatus.UNDER_NSIF_REVIEW,
+            ),
+        ),
+        "awaiting_csi_moderation": (
+            "dcpr_request_list_pending_csi_auth",
+            (
+                DCPRRequestStatus.AWAITING_CSI_REVIEW,
+                DCPRRequestStatus.UNDER_CSI_REVIEW,
+            ),
+        ),
+    }
+    result: typing.Dict[str, typing.Any] = {}
+    for name, (auth_function, statuses) in list_definitions.items():
+        if _is_authorized(auth_function, context, data_dict):
+            result[name] = sum(by_status.get(s.value, 0) for s in statuses)
+        else:
+            result[name] = None
+    if _is_authorized("my_dcpr_request_list_auth", context, data_dict):
+        # auth_user_obj is only guaranteed to be in the context after checking access
+        user_id = getattr(context.get("auth_user_obj"), "id", None)
+        result["mine"] = sum(
+            count for (_, owner), count in counts.items() if owner == user_id
+        )
+    else:
+        result["mine"] = None
+    # the full breakdown includes requests that are still private to their owners
+    is_sysadmin = getattr(context.get("auth_user_obj"), "sysadmin", False)
+    result["by_status"] = by_status if is_sysadmin else None
+    return result
+
+
+def invalidate_dcpr_request_status_counts() -> None:
+    """Discard cached DCPR request counts. Call this whenever DCPR requests change"""
+    _status_counts_cache.delete(_STATUS_COUNTS_CACHE_KEY)
+
+
+def _get_status_owner_counts(session) -> typing.Dict[typing.Tuple[str, str], int]:
+    query = session.query(
+        dcpr_request.DCPRRequest.status,
+        dcpr_request.DCPRRequest.owner_user,
+        func.count(dcpr_request.DCPRRequest.csi_reference_id),
+    ).group_by(
+        dcpr_request.DCPRRequest.status,
+        dcpr_request.DCPRRequest.owner_user,
+    )
+    return {(status, owner): count for status, owner, count in query.all()}
+
+
+def _is_authorized(
+    auth_function: str, context: typing.Dict, data_dict: typing.Optional[typing.Dict]
+) -> bool:
+    try:
+        toolkit.check_access(auth_function, context, data_dict or {})
+    except toolkit.NotAuthorized:
+        result = False
+    else:
+        result = True
+    return result
+
+
 def _get_dcpr_request_list(
     context: typing.Dict,
     data_dict: typing.Optional[typing.Dict] = None,
     filter_=None,
-) -> typing.List[typing.Dict]:
+) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
+    """Return DCPR requests, optionally paginated
+
+    If the input `data_dict` does not include any of the `limit`, `offset` or
+    `cursor` keys, a list with all the relevant DCPR requests is returned. Otherwise
+    the result is a page, as returned by `_get_dcpr_request_page()`.
+
+    """
+
     data_ = data_dict if data_dict is not None else {}
+    validated_data, errors = toolkit.navl_validate(
+        data_, list_dcpr_requests_schema(), context
+    )
+    if errors:
+        raise toolkit.ValidationError(errors)
     query = context["model"].Session.query(dcpr_request.DCPRRequest)
     if filter_ is not None:
         query = query.filter(filter_)
-    query = (
-        query.order_by(
-            # dcpr_request.DCPRRequest.status,
-            dcpr_request.DCPRRequest.submission_date.desc(),
-            dcpr_request.DCPRRequest.nsif_review_date,
-            dcpr_request.DCPRRequest.csi_moderation_date,
-            dcpr_request.DCPRRequest.proposed_project_name,
-        )
-        # .limit(data_.get("limit", 10))
-        # .offset(data_.get("offset", 0))
+    query = query.order_by(
+        *(column.desc() if descending else column for column, descending in _ORDERING)
     )
-    return [dcpr_dictization.dcpr_request_dictize(i, context) for i in query.all()]
+    is_paginated = any(k in validated_data for k in ("limit", "offset", "cursor"))
+    result: typing.Union[typing.List[typing.Dict], typing.Dict]
+    if is_paginated:
+        result = _get_dcpr_request_page(context, query, validated_data)
+    else:
+        result = dcpr_dictization.dcpr_request_list_dictize(query.all(), context)
+    return result
+
+
+def _get_dcpr_request_page(
+    context: typing.Dict, query, validated_data: typing.Dict
+) -> typing.Dict:
+    """Return a page of the DCPR requests selected by the input ordered query
+
+    The result is a dict with keys:
+
+    - `count` - total number of DCPR requests in the list
+    - `results` - the DCPR requests in the current page
+    - `next_cursor` - opaque value to be passed as the `cursor` in order to get the
+      next page, or `None` if there are no more results
+
+    Pagination via `cursor` uses keyset pagination and is more efficient than using
+    `offset` when retrieving pages deep into the list.
+
+    """
+
+    total = query.order_by(None).count()
+    limit = min(validated_data.get("limit", _DEFAULT_PAGE_SIZE), _MAX_PAGE_SIZE)
+    cursor = validated_data.get("cursor")
+    if cursor is not None:
+        try:
+            cursor_values = _decode_cursor(cursor)
+        except ValueError:
+            raise toolkit.ValidationError({"cursor": ["Invalid cursor"]})
+        query = query.filter(_get_keyset_filter(cursor_values))
+    else:
+        query = query.offset(validated_data.get("offset", 0))
+    request_objects = query.limit(limit).all()
+    if len(request_objects) == limit:
+        next_cursor = _encode_cursor(request_objects[-1])
+    else:
+        next_cursor = None
+    return {
+        "count": total,
+        "results": dcpr_dictization.dcpr_request_list_dictize(request_objects, context),
+        "next_cursor": next_cursor,
+    }
+
+
+def _get_keyset_filter(cursor_values: typing.List):
+    """Build a filter that selects the rows that come after the cursor
+
+    Postgres sorts NULLs first when using descending order and last when using
+    ascending order, which is taken into account here.
+
+    """
+
+    clauses = []
+    previous_are_equal: typing.List = []
+    for (column, descending), value in zip(_ORDERING, cursor_values):
+        if value is None:
+            comes_after = column.isnot(None) if descending else None
+            is_equal = column.is_(None)
+        else:
+            if descending:
+                comes_after = column < value
+            else:
+                comes_after = or_(column > value, column.is_(None))
+            is_equal = column == value
+        if comes_after is not None:
+            clauses.append(and_(*previous_are_equal, comes_after))
+        previous_are_equal.append(is_equal)
+    return or_(*clauses)
+
+
+def _encode_cursor(request_obj: dcpr_request.DCPRRequest) -> str:
+    values = []
+    for column, _ in _ORDERING:
+        value = getattr(request_obj, column.key)
+        values.append(value.isoformat() if isinstance(value, dt.datetime) else value)
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> typing.List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as exc:
+        raise ValueError(f"Could not decode cursor {cursor!r}") from exc
+    if not isinstance(values, list) or len(values) != len(_ORDERING):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    decoded = []
+    for (column, _), value in zip(_ORDERING, values):
+        if value is not None and column.key in _DATETIME_COLUMN_NAMES:
+            try:
+                value = dt.datetime.fromisoformat(value)
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"Invalid cursor {cursor!r}") from exc
+        decoded.append(value)
+    return decoded
@@ -15,6 +15,7 @@ from ... import schema as dcpr_schema
 from ....model import dcpr_request
 from .... import dcpr_dictization
 from .. import create_dcpr_management_activity
+from .get import invalidate_dcpr_request_status_counts
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +44,7 @@ def dcpr_request_update_by_owner(context, data_dict):
         validated_data, context
     )
     context["model"].Session.commit()  # the session commit
+    invalidate_dcpr_request_status_counts()
     create_dcpr_management_activity(
         request_obj,
         activity_type=DcprManagementActivityType.UPDATE_DCPR_REQUEST_BY_OWNER,
@@ -74,6 +76,7 @@ def dcpr_request_update_by_nsif(context, data_dict):
     )
     request_obj = dcpr_dictization.dcpr_request_dict_save(validated_data, context)
     context["model"].Session.commit()
+    invalidate_dcpr_request_status_counts()
     create_dcpr_management_activity(
         request_obj,
         activity_type=DcprManagementActivityType.UPDATE_DCPR_REQUEST_BY_NSIF,
@@ -105,6 +108,7 @@ def dcpr_request_update_by_csi(context, data_dict):
     )
     request_obj = dcpr_dictization.dcpr_request_dict_save(validated_data, context)
     context["model"].Session.commit()
+    invalidate_dcpr_request_status_counts()
     create_dcpr_management_activity(
         request_obj,
         activity_type=DcprManagementActivityType.UPDATE_DCPR_REQUEST_BY_CSI,
@@ -147,6 +151,7 @@ def dcpr_request_submit(context, data_dict):
             )
 
         model.Session.commit()
+        invalidate_dcpr_request_status_counts()
         activity = create_dcpr_management_activity(
             request_obj,
             activity_type=DcprManagementActivityType.SUBMIT_DCPR_REQUEST,
@@ -205,6 +210,7 @@ def dcpr_request_nsif_moderate(
                     f"NSIF reviewer for DCPR request {request_obj.csi_reference_id}"
                 )
             context["model"].Session.commit()
+            invalidate_dcpr_request_status_counts()
             activity_type = {
                 DcprRequestModerationAction.APPROVE: DcprManagementActivityType.ACCEPT_DCPR_REQUEST_NSIF,
                 DcprRequestModerationAction.REJECT: DcprManagementActivityType.REJECT_DCPR_REQUEST_NSIF,
@@ -260,6 +266,7 @@ def dcpr_request_csi_moderate(
                     f"CSI moderator for DCPR request {request_obj.csi_reference_id}"
                 )
             context["model"].Session.commit()
+            invalidate_dcpr_request_status_counts()
             activity_type = {
                 DcprRequestModerationAction.APPROVE: DcprManagementActivityType.ACCEPT_DCPR_REQUEST_CSI,
                 DcprRequestModerationAction.REJECT: DcprManagementActivityType.REJECT_DCPR_REQUEST_CSI,
@@ -425,6 +432,7 @@ def _become_reviewer(
         _update_dcpr_request_status(request_obj)
         setattr(request_obj, reviewer_request_attribute, context["auth_user_obj"].id)
         model.Session.commit()
+        invalidate_dcpr_request_status_counts()
     else:
         raise toolkit.ObjectNotFound
     create_dcpr_management_activity(
@@ -476,6 +484,7 @@ def _resign_reviewer(
             request_obj, transition_action=DcprRequestModerationAction.RESIGN
         )
         context["model"].Session.commit()
+        invalidate_dcpr_request_status_counts()
     else:
         raise toolkit.ObjectNotFound
     activity = create_dcpr_management_activity(
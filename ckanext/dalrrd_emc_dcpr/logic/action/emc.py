@@ -1,13 +1,12 @@
 import logging
-import os
-import pkg_resources
 import typing
 
 import ckan.plugins.toolkit as toolkit
 import sqlalchemy
 
-from ... import jobs
+from ... import build_info, caching, job_metrics, jobs
 from ...constants import DatasetManagementActivityType
+from ...plugins import facets
 
 from . import create_dataset_management_activity
 
@@ -20,12 +19,48 @@ def show_version(
     data_dict: typing.Optional[typing.Dict] = None,
 ) -> typing.Dict:
     """return the current version of this project"""
+    info = build_info.get_build_info()
     return {
-        "version": pkg_resources.require("ckanext-dalrrd-emc-dcpr")[0].version,
-        "git_sha": os.getenv("GIT_COMMIT"),
+        "version": info.version,
+        "git_sha": info.git_sha,
     }
 
 
+@toolkit.side_effect_free
+def show_search_facets_stats(
+    context: typing.Dict,
+    data_dict: typing.Optional[typing.Dict] = None,
+) -> typing.Dict:
+    """Return the counters of the search facets engine"""
+    toolkit.check_access("sysadmin", context, data_dict)
+    return {
+        **facets.stats.as_dict(),
+        "mode": facets.get_search_facets_mode().value,
+    }
+
+
+@toolkit.side_effect_free
+def show_search_cache_stats(
+    context: typing.Dict,
+    data_dict: typing.Optional[typing.Dict] = None,
+) -> typing.Dict:
+    """Return the hit and miss counters of the search cache"""
+    toolkit.check_access("sysadmin", context, data_dict)
+    result = caching.search_cache.metrics.as_dict()
+    result["backend"] = caching.search_cache.get_backend_type().value
+    return result
+
+
+@toolkit.side_effect_free
+def show_job_metrics(
+    context: typing.Dict,
+    data_dict: typing.Optional[typing.Dict] = None,
+) -> typing.Dict:
+    """Return how long background jobs wait in their queue and take to run"""
+    toolkit.check_access("sysadmin", context, data_dict)
+    return job_metrics.get_job_metrics()
+
+
 @toolkit.side_effect_free
 def list_featured_datasets(
     context: typing.Dict,
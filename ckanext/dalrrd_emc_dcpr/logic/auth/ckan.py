@@ -6,6 +6,8 @@ from ckan.logic.auth import get_package_object
 
 from ckanext.harvest.utils import DATASET_TYPE_NAME as CKANEXT_HARVEST_DATASET_TYPE_NAME
 
+from ... import memberships
+
 logger = logging.getLogger(__name__)
 
 
@@ -37,13 +39,9 @@ def package_update(next_auth, context, data_dict=None):
             else:
                 org_id = data_dict.get("owner_org", package.owner_org)
                 if org_id is not None:
-                    members = toolkit.get_action("member_list")(
-                        data_dict={"id": org_id, "object_type": "user"}
-                    )
-                    for member_id, _, role in members:
-                        if member_id == user.id and role.lower() == "admin":
-                            result["success"] = True
-                            break
+                    role = memberships.get_user_org_role(user.id, org_id)
+                    if role == "admin":
+                        result["success"] = True
                     else:
                         result["msg"] = (
                             f"Only administrators of organization {org_id!r} are "
@@ -89,14 +87,7 @@ def authorize_package_publish(
         # beforehand, so we deny
         owner_org = data_.get("owner_org", data_.get("group_id"))
         if owner_org is not None:
-            members = toolkit.get_action("member_list")(
-                data_dict={"id": owner_org, "object_type": "user"}
-            )
-            admin_member_ids = [
-                member_tuple[0]
-                for member_tuple in members
-                if member_tuple[2] == "Admin"
-            ]
-            if user.id in admin_member_ids:
+            role = memberships.get_user_org_role(user.id, owner_org)
+            if role == "admin":
                 result = {"success": True}
     return result
@@ -6,6 +6,17 @@ def show_dcpr_request_schema(not_missing, not_empty, unicode_safe):
     return {"csi_reference_id": [not_missing, not_empty, unicode_safe]}
 
 
+@validator_args
+def list_dcpr_requests_schema(
+    ignore_missing, is_positive_integer, natural_number_validator, unicode_safe
+):
+    return {
+        "limit": [ignore_missing, is_positive_integer],
+        "offset": [ignore_missing, natural_number_validator],
+        "cursor": [ignore_missing, unicode_safe],
+    }
+
+
 @validator_args
 def create_dcpr_request_schema(
     ignore_missing,
@@ -0,0 +1,302 @@
+"""Delivery of the emails sent by the extension
+
+CKAN's `mail_recipient()` opens a new SMTP connection, including the STARTTLS
+handshake and login, for every single email. This module sends emails through a mail
+session instead, which keeps its connection open while a batch of emails is sent:
+
+    with mail_delivery.mail_session():
+        for user in users:
+            email_notifications.send_notification(user, notification)
+
+All emails sent inside the `with` block, including those sent by nested functions,
+share the session. Outside of a session, each email gets its own connection.
+
+- The connection is recycled after a configurable number of messages, as SMTP
+  servers usually limit how many messages they accept per connection;
+- each message is retried with exponential backoff when sending it fails with a
+  temporary error, e.g. a dropped connection or a 4xx reply. Permanent (5xx) errors
+  are not retried;
+- with the `maildir` backend, emails are stored in a local Maildir instead of being
+  sent, which is useful for development and testing.
+
+Messages have the same headers as the ones sent by CKAN's mailer and the same `smtp.*`
+settings are used.
+
+"""
+
+import contextlib
+import dataclasses
+import enum
+import logging
+import mailbox
+import smtplib
+import threading
+import time
+import typing
+from email import utils as email_utils
+from email.header import Header
+from email.mime.text import MIMEText
+
+import ckan
+from ckan.lib.mailer import MailerException
+from ckan.plugins import toolkit
+
+logger = logging.getLogger(__name__)
+
+MAIL_BACKEND_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.mail_backend"
+MAILDIR_PATH_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.mail_maildir_path"
+MESSAGES_PER_CONNECTION_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.mail_messages_per_connection"
+MAX_ATTEMPTS_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.mail_max_attempts"
+RETRY_BACKOFF_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.mail_retry_backoff_seconds"
+_DEFAULT_MESSAGES_PER_CONNECTION = 500
+_DEFAULT_MAX_ATTEMPTS = 3
+_DEFAULT_RETRY_BACKOFF_SECONDS = 2
+_SMTP_TIMEOUT_SECONDS = 30
+
+_local = threading.local()
+
+
+class MailBackend(enum.Enum):
+    SMTP = "smtp"
+    MAILDIR = "maildir"
+
+
+@dataclasses.dataclass(frozen=True)
+class OutgoingEmail:
+    recipient_name: str
+    recipient_email: str
+    subject: str
+    body: str
+
+
+class SmtpTransport:
+    """An SMTP connection, which is reused for successive messages"""
+
+    def __init__(self, messages_per_connection: int):
+        self.messages_per_connection = messages_per_connection
+        self.num_connections = 0
+        self._connection: typing.Optional[smtplib.SMTP] = None
+        self._num_sent_on_connection = 0
+
+    def send(self, mail_from: str, recipient_email: str, message: MIMEText) -> None:
+        if self._num_sent_on_connection >= self.messages_per_connection:
+            self.close()
+        if self._connection is None:
+            self._connection = self._connect()
+        self._connection.sendmail(mail_from, [recipient_email], message.as_string())
+        self._num_sent_on_connection += 1
+
+    def reset(self) -> None:
+        """Drop the current connection, which may be broken"""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            finally:
+                self._connection = None
+                self._num_sent_on_connection = 0
+
+    def close(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except smtplib.SMTPException:
+                logger.debug("Could not close SMTP connection cleanly", exc_info=True)
+            finally:
+                self._connection = None
+                self._num_sent_on_connection = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        config = toolkit.config
+        if "smtp.test_server" in config:
+            # same as ckan's mailer, the test server takes no other smtp settings
+            server = config["smtp.test_server"]
+            starttls = False
+            user = None
+            password = None
+        else:
+            server = config.get("smtp.server", "localhost")
+            starttls = toolkit.asbool(config.get("smtp.starttls"))
+            user = config.get("smtp.user")
+            password = config.get("smtp.password")
+        connection = smtplib.SMTP(server, timeout=_SMTP_TIMEOUT_SECONDS)
+        try:
+            connection.ehlo()
+            if starttls:
+                if not connection.has_extn("STARTTLS"):
+                    raise smtplib.SMTPNotSupportedError(
+                        "SMTP server does not support STARTTLS"
+                    )
+                connection.starttls()
+                connection.ehlo()
+            if user:
+                connection.login(user, password or "")
+        except Exception:
+            connection.close()
+            raise
+        self.num_connections += 1
+        return connection
+
+
+class MaildirTransport:
+    """Stores messages in a local Maildir, instead of sending them"""
+
+    def __init__(self, path: str):
+        self._maildir = mailbox.Maildir(path, create=True)
+
+    def send(self, mail_from: str, recipient_email: str, message: MIMEText) -> None:
+        self._maildir.add(message)
+
+    def reset(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MailSession:
+    def __init__(
+        self,
+        transport: typing.Union[SmtpTransport, MaildirTransport],
+        max_attempts: int,
+        retry_backoff_seconds: float,
+    ):
+        self.transport = transport
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.num_sent = 0
+
+    def send(self, email: OutgoingEmail) -> None:
+        """Send an email, retrying temporary failures
+
+        Raises `MailerException` if the email could not be sent.
+
+        """
+
+        mail_from = toolkit.config.get("smtp.mail_from")
+        message = build_message(email, mail_from)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.transport.send(mail_from, email.recipient_email, message)
+            except (smtplib.SMTPException, OSError) as exc:
+                is_permanent = _is_permanent_failure(exc)
+                if not is_permanent:
+                    # the server has already reset the transaction after a permanent
+                    # failure, otherwise the connection may be unusable
+                    self.transport.reset()
+                if is_permanent or attempt == self.max_attempts:
+                    logger.exception(f"Could not send email to {email.recipient_email}")
+                    raise MailerException(repr(exc)) from exc
+                delay = self.retry_backoff_seconds * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Attempt {attempt} to send email to {email.recipient_email} "
+                    f"failed ({exc!r}), retrying in {delay}s"
+                )
+                time.sleep(delay)
+            else:
+                self.num_sent += 1
+                logger.info(f"Sent email to {email.recipient_email}")
+                break
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+@contextlib.contextmanager
+def mail_session() -> typing.Iterator[MailSession]:
+    """Send all emails of the enclosed block through the same session
+
+    Nested blocks reuse the outermost session.
+
+    """
+
+    current = getattr(_local, "session", None)
+    if current is not None:
+        yield current
+    else:
+        session = _build_session()
+        _local.session = session
+        try:
+            yield session
+        finally:
+            _local.session = None
+            session.close()
+
+
+def send_email(email: OutgoingEmail) -> None:
+    with mail_session() as session:
+        session.send(email)
+
+
+def build_message(email: OutgoingEmail, mail_from: str) -> MIMEText:
+    """Build a message with the same headers as the ones sent by ckan's mailer"""
+    message = MIMEText(email.body, "plain", "utf-8")
+    site_title = toolkit.config.get("ckan.site_title")
+    message["Subject"] = Header(email.subject, "utf-8")
+    message["From"] = f"{site_title} <{mail_from}>"
+    # unlike ckan's mailer, only the name is encoded, so that the address stays valid
+    message["To"] = email_utils.formataddr(
+        (email.recipient_name, email.recipient_email), charset="utf-8"
+    )
+    message["Date"] = email_utils.formatdate(time.time())
+    message["X-Mailer"] = f"CKAN {ckan.__version__}"
+    reply_to = toolkit.config.get("smtp.reply_to")
+    if reply_to:
+        message["Reply-to"] = reply_to
+    return message
+
+
+def get_mail_backend() -> MailBackend:
+    raw_backend = toolkit.config.get(MAIL_BACKEND_CONFIG_KEY, MailBackend.SMTP.value)
+    try:
+        result = MailBackend(raw_backend.strip().lower())
+    except ValueError:
+        logger.warning(
+            f"Invalid value for {MAIL_BACKEND_CONFIG_KEY!r}: {raw_backend!r}, "
+            f"using {MailBackend.SMTP.value!r}"
+        )
+        result = MailBackend.SMTP
+    return result
+
+
+def _build_session() -> MailSession:
+    config = toolkit.config
+    transport: typing.Union[SmtpTransport, MaildirTransport]
+    if get_mail_backend() == MailBackend.MAILDIR:
+        maildir_path = config.get(MAILDIR_PATH_CONFIG_KEY)
+        if not maildir_path:
+            raise MailerException(
+                f"{MAILDIR_PATH_CONFIG_KEY!r} must be set in order to use the "
+                f"{MailBackend.MAILDIR.value!r} mail backend"
+            )
+        transport = MaildirTransport(maildir_path)
+    else:
+        transport = SmtpTransport(
+            messages_per_connection=toolkit.asint(
+                config.get(
+                    MESSAGES_PER_CONNECTION_CONFIG_KEY, _DEFAULT_MESSAGES_PER_CONNECTION
+                )
+            )
+        )
+    return MailSession(
+        transport,
+        max_attempts=toolkit.asint(
+            config.get(MAX_ATTEMPTS_CONFIG_KEY, _DEFAULT_MAX_ATTEMPTS)
+        ),
+        retry_backoff_seconds=float(
+            config.get(RETRY_BACKOFF_CONFIG_KEY, _DEFAULT_RETRY_BACKOFF_SECONDS)
+        ),
+    )
+
+
+def _is_permanent_failure(exc: Exception) -> bool:
+    if isinstance(exc, (smtplib.SMTPRecipientsRefused, smtplib.SMTPNotSupportedError)):
+        result = True
+    elif isinstance(exc, smtplib.SMTPResponseException):
+        result = 500 <= exc.smtp_code < 600
+    else:
+        result = False
+    return result
@@ -0,0 +1,133 @@
+"""Index of the organizations that a user is a member of, together with their role
+
+Many pages and auth functions need to know whether the current user is a member of
+some organization. Instead of calling the `member_list` action and scanning all
+members of each organization, the memberships of a user are loaded with a single
+query and kept:
+
+- for the duration of the current request, in `toolkit.g`;
+- in a short-lived process-level cache, shared between requests. The `member_create`
+  `member_delete` and `organization_update` actions invalidate it, the TTL takes
+  care of changes made in other processes. The TTL is read from the config in
+  `configure()`, when the application starts.
+
+"""
+
+import logging
+import typing
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from .caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MEMBERSHIP_CACHE_TTL_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.membership_cache_ttl"
+_DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS = 30
+
+
+class Membership(typing.NamedTuple):
+    org_id: str
+    org_name: str
+    org_title: typing.Optional[str]
+    role: str
+
+
+_membership_cache = TTLCache(
+    ttl=_DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS, max_entries=10000
+)
+
+
+def configure(config: typing.Mapping) -> None:
+    """Set the TTL of the process-level cache from the input config"""
+    _membership_cache.ttl = toolkit.asint(
+        config.get(
+            MEMBERSHIP_CACHE_TTL_CONFIG_KEY, _DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS
+        )
+    )
+
+
+def get_user_memberships(user_id: str) -> typing.List[Membership]:
+    """Return the user's organizations, ordered by name, and the user's role in them
+
+    Roles are lowercase (e.g. `admin`, `editor`, `member`).
+
+    """
+
+    request_memberships = _get_request_memberships()
+    result = None
+    if request_memberships is not None:
+        result = request_memberships.get(user_id)
+    if result is None:
+        result = _membership_cache.get_or_set(
+            user_id, lambda: _load_user_memberships(user_id)
+        )
+        if request_memberships is not None:
+            request_memberships[user_id] = result
+    return result
+
+
+def get_user_org_role(user_id: str, org_id_or_name: str) -> typing.Optional[str]:
+    """Return the user's role in the input organization, or None if not a member"""
+    for membership in get_user_memberships(user_id):
+        if org_id_or_name in (membership.org_id, membership.org_name):
+            result = membership.role
+            break
+    else:
+        result = None
+    return result
+
+
+def invalidate(user_id: typing.Optional[str] = None) -> None:
+    """Forget the cached memberships of the input user, or of all users"""
+    if user_id is None:
+        _membership_cache.clear()
+    else:
+        _membership_cache.delete(user_id)
+    request_memberships = _get_request_memberships()
+    if request_memberships is not None:
+        if user_id is None:
+            request_memberships.clear()
+        else:
+            request_memberships.pop(user_id, None)
+
+
+def _load_user_memberships(user_id: str) -> typing.List[Membership]:
+    query = (
+        model.Session.query(
+            model.Group.id, model.Group.name, model.Group.title, model.Member.capacity
+        )
+        .join(model.Member, model.Member.group_id == model.Group.id)
+        .filter(
+            model.Member.table_name == "user",
+            model.Member.table_id == user_id,
+            model.Member.state == "active",
+            model.Group.state == "active",
+            model.Group.is_organization == True,
+        )
+        .order_by(model.Group.name)
+    )
+    return [
+        Membership(org_id, org_name, org_title, (capacity or "").lower())
+        for org_id, org_name, org_title, capacity in query.all()
+    ]
+
+
+def _get_request_memberships() -> typing.Optional[typing.Dict]:
+    """Return the memberships that have been loaded during the current request
+
+    Returns None when running outside of a request, e.g. in a CLI command.
+
+    """
+
+    try:
+        request_memberships = getattr(toolkit.g, "_emc_memberships", None)
+        if request_memberships is None:
+            request_memberships = {}
+            toolkit.g._emc_memberships = request_memberships
+    except (RuntimeError, TypeError):
+        request_memberships = None
+    return request_memberships
@@ -0,0 +1,47 @@
+"""Create tables for the precomputed /stats page
+
+Revision ID: 0c2a7d9e41b5
+Revises: 6f445840f4f8
+Create Date: 2026-10-18 14:02:11.519803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0c2a7d9e41b5"
+down_revision = "6f445840f4f8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "emc_stats_weekly_package_activity",
+        sa.Column("week", sa.types.Date, primary_key=True),
+        sa.Column("created", sa.types.Integer, nullable=False, server_default="0"),
+        sa.Column("deleted", sa.types.Integer, nullable=False, server_default="0"),
+        sa.Column("revisions", sa.types.Integer, nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "emc_stats_leaderboard",
+        sa.Column("widget", sa.types.UnicodeText, primary_key=True),
+        sa.Column("position", sa.types.Integer, primary_key=True),
+        sa.Column("object_id", sa.types.UnicodeText),
+        sa.Column("object_type", sa.types.UnicodeText),
+        sa.Column("name", sa.types.UnicodeText),
+        sa.Column("title", sa.types.UnicodeText),
+        sa.Column("value", sa.types.Integer, nullable=False),
+    )
+    op.create_table(
+        "emc_stats_refresh_state",
+        sa.Column("name", sa.types.UnicodeText, primary_key=True),
+        sa.Column("activity_watermark", sa.types.DateTime),
+        sa.Column("refreshed_at", sa.types.DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table("emc_stats_refresh_state")
+    op.drop_table("emc_stats_leaderboard")
+    op.drop_table("emc_stats_weekly_package_activity")
@@ -0,0 +1,51 @@
+"""Create tables for tracking bulk XML metadata uploads
+
+Revision ID: 5e9b0c3d7a18
+Revises: d41c8a6e5f27
+Create Date: 2026-10-18 18:52:37.204915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5e9b0c3d7a18"
+down_revision = "d41c8a6e5f27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "emc_xml_upload",
+        sa.Column("upload_id", sa.types.UnicodeText, primary_key=True),
+        sa.Column(
+            "user_id",
+            sa.types.UnicodeText,
+            sa.ForeignKey("user.id"),
+            nullable=False,
+        ),
+        sa.Column("created_at", sa.types.DateTime),
+        sa.Column("notified_at", sa.types.DateTime),
+    )
+    op.create_table(
+        "emc_xml_upload_file",
+        sa.Column(
+            "upload_id",
+            sa.types.UnicodeText,
+            sa.ForeignKey("emc_xml_upload.upload_id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("position", sa.types.Integer, primary_key=True),
+        sa.Column("filename", sa.types.UnicodeText),
+        sa.Column("state", sa.types.UnicodeText, nullable=False),
+        sa.Column("message", sa.types.UnicodeText),
+        sa.Column("package_name", sa.types.UnicodeText),
+        sa.Column("data_dict", sa.types.UnicodeText),
+        sa.Column("updated_at", sa.types.DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table("emc_xml_upload_file")
+    op.drop_table("emc_xml_upload")
@@ -0,0 +1,45 @@
+"""Add indexes for filtering and paginating DCPR request lists
+
+Revision ID: 6f445840f4f8
+Revises: 3297b0e63432
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "6f445840f4f8"
+down_revision = "3297b0e63432"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_dcpr_request_status", "dcpr_request", ["status"])
+    op.create_index("ix_dcpr_request_owner_user", "dcpr_request", ["owner_user"])
+    op.create_index(
+        "ix_dcpr_request_list_ordering",
+        "dcpr_request",
+        [
+            sa.text("submission_date DESC"),
+            "nsif_review_date",
+            "csi_moderation_date",
+            "proposed_project_name",
+            "csi_reference_id",
+        ],
+    )
+    op.create_index(
+        "ix_dcpr_request_dataset_dcpr_request_id",
+        "dcpr_request_dataset",
+        ["dcpr_request_id"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_dcpr_request_dataset_dcpr_request_id", table_name="dcpr_request_dataset"
+    )
+    op.drop_index("ix_dcpr_request_list_ordering", table_name="dcpr_request")
+    op.drop_index("ix_dcpr_request_owner_user", table_name="dcpr_request")
+    op.drop_index("ix_dcpr_request_status", table_name="dcpr_request")
@@ -0,0 +1,28 @@
+"""Add index for listing saved searches by owner and date
+
+Revision ID: b7e3f1a92c04
+Revises: 0c2a7d9e41b5
+Create Date: 2026-10-18 16:40:52.118204
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b7e3f1a92c04"
+down_revision = "0c2a7d9e41b5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_saved_searches_owner_user_saved_search_date",
+        "saved_searches",
+        ["owner_user", "saved_search_date"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_saved_searches_owner_user_saved_search_date", table_name="saved_searches"
+    )
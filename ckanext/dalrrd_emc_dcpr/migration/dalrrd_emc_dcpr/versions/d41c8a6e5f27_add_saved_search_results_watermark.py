@@ -0,0 +1,23 @@
+"""Add watermark of the notified results of saved searches
+
+Revision ID: d41c8a6e5f27
+Revises: b7e3f1a92c04
+Create Date: 2026-10-18 17:25:09.633871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "d41c8a6e5f27"
+down_revision = "b7e3f1a92c04"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("saved_searches", sa.Column("results_watermark", sa.types.DateTime))
+
+
+def downgrade():
+    op.drop_column("saved_searches", "results_watermark")
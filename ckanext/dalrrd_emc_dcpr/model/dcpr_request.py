@@ -6,7 +6,7 @@ from logging import getLogger
 
 log = getLogger(__name__)
 
-from sqlalchemy import orm, types, Column, Table, ForeignKey
+from sqlalchemy import orm, types, Column, Index, Table, ForeignKey
 
 from ckan import model
 
@@ -95,6 +95,22 @@ dcpr_request_dataset_table = Table(
     Column("metadata_characterset", types.UnicodeText),
 )
 
+# support filtering and keyset pagination of the DCPR request lists
+Index("ix_dcpr_request_status", dcpr_request_table.c.status)
+Index("ix_dcpr_request_owner_user", dcpr_request_table.c.owner_user)
+Index(
+    "ix_dcpr_request_list_ordering",
+    dcpr_request_table.c.submission_date.desc(),
+    dcpr_request_table.c.nsif_review_date,
+    dcpr_request_table.c.csi_moderation_date,
+    dcpr_request_table.c.proposed_project_name,
+    dcpr_request_table.c.csi_reference_id,
+)
+Index(
+    "ix_dcpr_request_dataset_dcpr_request_id",
+    dcpr_request_dataset_table.c.dcpr_request_id,
+)
+
 dcpr_request_notification_table = Table(
     "dcpr_request_notification",
     model.meta.metadata,
@@ -9,7 +9,7 @@ from logging import getLogger
 
 log = getLogger(__name__)
 
-from sqlalchemy import orm, types, Column, Table, ForeignKey
+from sqlalchemy import orm, types, Column, Index, Table, ForeignKey
 
 from ckan import model
 
@@ -38,6 +38,13 @@ saved_searches_table = Table(
         types.UnicodeText,
     ),
     Column("saved_search_date", types.DateTime, default=datetime.datetime.utcnow),
+    Column("results_watermark", types.DateTime),
+)
+
+Index(
+    "ix_saved_searches_owner_user_saved_search_date",
+    saved_searches_table.c.owner_user,
+    saved_searches_table.c.saved_search_date,
 )
 
 
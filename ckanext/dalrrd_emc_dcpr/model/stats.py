@@ -0,0 +1,54 @@
+"""Tables holding the precomputed statistics that are shown in the /stats page
+
+These tables are only written by `ckanext.dalrrd_emc_dcpr.stats.refresh_stats()`,
+the `/stats` view just reads them.
+
+"""
+
+import logging
+
+import sqlalchemy
+from ckan.model import meta
+
+logger = logging.getLogger(__name__)
+
+# one row per week, with the number of package activities of that week. Rows are
+# updated incrementally with the activities created since the last refresh
+stats_weekly_package_activity_table = sqlalchemy.Table(
+    "emc_stats_weekly_package_activity",
+    meta.metadata,
+    sqlalchemy.Column("week", sqlalchemy.types.Date, primary_key=True),
+    sqlalchemy.Column(
+        "created", sqlalchemy.types.Integer, nullable=False, server_default="0"
+    ),
+    sqlalchemy.Column(
+        "deleted", sqlalchemy.types.Integer, nullable=False, server_default="0"
+    ),
+    sqlalchemy.Column(
+        "revisions", sqlalchemy.types.Integer, nullable=False, server_default="0"
+    ),
+)
+
+# snapshot of the leaderboards (largest groups, top tags, etc.), these are fully
+# replaced on each refresh, as they depend on the current state of the catalogue
+stats_leaderboard_table = sqlalchemy.Table(
+    "emc_stats_leaderboard",
+    meta.metadata,
+    sqlalchemy.Column("widget", sqlalchemy.types.UnicodeText, primary_key=True),
+    sqlalchemy.Column("position", sqlalchemy.types.Integer, primary_key=True),
+    sqlalchemy.Column("object_id", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("object_type", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("name", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("title", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("value", sqlalchemy.types.Integer, nullable=False),
+)
+
+# bookkeeping for the incremental refresh - stores the timestamp of the most recent
+# activity that has already been aggregated
+stats_refresh_state_table = sqlalchemy.Table(
+    "emc_stats_refresh_state",
+    meta.metadata,
+    sqlalchemy.Column("name", sqlalchemy.types.UnicodeText, primary_key=True),
+    sqlalchemy.Column("activity_watermark", sqlalchemy.types.DateTime),
+    sqlalchemy.Column("refreshed_at", sqlalchemy.types.DateTime),
+)
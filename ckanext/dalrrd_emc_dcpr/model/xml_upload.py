@@ -0,0 +1,57 @@
+"""Tables tracking bulk XML metadata uploads
+
+An upload is accepted by the `xml_parser` blueprint, which spools its files to
+storage. Files are then parsed, validated and turned into datasets by background
+jobs, which record the progress of each file here.
+
+"""
+
+import datetime as dt
+import logging
+
+import sqlalchemy
+from ckan.model import meta, types as ckan_types
+
+logger = logging.getLogger(__name__)
+
+xml_upload_table = sqlalchemy.Table(
+    "emc_xml_upload",
+    meta.metadata,
+    sqlalchemy.Column(
+        "upload_id",
+        sqlalchemy.types.UnicodeText,
+        primary_key=True,
+        default=ckan_types.make_uuid,
+    ),
+    sqlalchemy.Column(
+        "user_id",
+        sqlalchemy.types.UnicodeText,
+        sqlalchemy.ForeignKey("user.id"),
+        nullable=False,
+    ),
+    sqlalchemy.Column(
+        "created_at", sqlalchemy.types.DateTime, default=dt.datetime.utcnow
+    ),
+    # set when the uploader has been notified of the outcome of the upload
+    sqlalchemy.Column("notified_at", sqlalchemy.types.DateTime),
+)
+
+# one row per uploaded file, `data_dict` holds the dataset that was extracted from
+# the file, until it gets created
+xml_upload_file_table = sqlalchemy.Table(
+    "emc_xml_upload_file",
+    meta.metadata,
+    sqlalchemy.Column(
+        "upload_id",
+        sqlalchemy.types.UnicodeText,
+        sqlalchemy.ForeignKey("emc_xml_upload.upload_id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column("position", sqlalchemy.types.Integer, primary_key=True),
+    sqlalchemy.Column("filename", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("state", sqlalchemy.types.UnicodeText, nullable=False),
+    sqlalchemy.Column("message", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("package_name", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("data_dict", sqlalchemy.types.UnicodeText),
+    sqlalchemy.Column("updated_at", sqlalchemy.types.DateTime),
+)
@@ -1,18 +1,12 @@
 import logging
 import typing
-from collections import OrderedDict
 from functools import partial
 
 import ckan.plugins as plugins
-import ckan.lib.helpers as h
-import ckan.lib.search as search
-import ckan.lib.plugins as lib_plugins
 import ckan.plugins.toolkit as toolkit
 import datetime as dt
 import dateutil.parser
 from ckan import model
-from ckan.common import _, g
-from ckan.common import c
 from flask import Blueprint
 from sqlalchemy import orm
 
@@ -21,8 +15,15 @@ from ckanext.harvest.harvesters.ckanharvester import CKANHarvester
 
 
 from .. import (
+    build_info,
+    caching,
     constants,
+    email_notifications,
     helpers,
+    jobs,
+    memberships,
+    thumbnails,
+    user_context,
 )
 from ..blueprints.dcpr import dcpr_blueprint
 from ..blueprints.emc import emc_blueprint
@@ -61,6 +62,7 @@ from ..logic.auth import error_report as error_report_auth
 from ..model.user_extra_fields import UserExtraFields
 
 import ckanext.dalrrd_emc_dcpr.plugins.utils as utils
+from . import facets
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +71,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IAuthFunctions)
     plugins.implements(plugins.IClick)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IConfigurer)
     plugins.implements(plugins.IPackageController)
     plugins.implements(plugins.IDatasetForm)
@@ -76,6 +79,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
     plugins.implements(plugins.ITemplateHelpers)
     plugins.implements(plugins.IBlueprint)
     plugins.implements(plugins.IFacets)
+    plugins.implements(plugins.IMiddleware)
     plugins.implements(plugins.IPluginObserver)
 
     def before_load(self, plugin_class):
@@ -107,86 +111,25 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
         pass
 
     def after_create(self, context, pkg_dict):
-        """IPackageController interface requires reimplementation of this method."""
+        caching.search_cache.invalidate()
+        _enqueue_thumbnail_prerendering(pkg_dict)
         return context, pkg_dict
 
     def after_delete(self, context, pkg_dict):
-        """IPackageController interface requires reimplementation of this method."""
+        caching.search_cache.invalidate()
+        if pkg_dict.get("id"):
+            thumbnails.delete_stored_thumbnail(pkg_dict["id"])
         return context, pkg_dict
 
     def after_search(self, search_results, search_params):
-        """IPackageController interface requires reimplementation of this method."""
+        """Restructure the search facets
 
-        context = {}
-        facets = OrderedDict()
-        default_facet_titles = {
-            "groups": _("Groups"),
-            "tags": _("Tags"),
-        }
+        Facets are built by the facet engine, which by default reuses the facets
+        that were already retrieved by the main search query.
 
-        for facet in h.facets():
-            if facet in default_facet_titles:
-                facets[facet] = default_facet_titles[facet]
-            else:
-                facets[facet] = facet
-
-        # Facet titles
-        for plugin in plugins.PluginImplementations(plugins.IFacets):
-            facets = plugin.dataset_facets(facets, "dataset")
-
-        data_dict = {
-            "fq": "",
-            "facet.field": list(facets.keys()),
-        }
-
-        if not getattr(g, "user", None):
-            data_dict["fq"] = "+capacity:public " + data_dict["fq"]
-
-        query = search.query_for(model.Package)
-        try:
-            if context.get("ignore_auth") or c.userobj.sysadmin:
-                labels = None
-            else:
-                labels = lib_plugins.get_permission_labels().get_user_dataset_labels(
-                    c.userobj
-                )
-
-            query.run(data_dict, permission_labels=labels)
-        except:
-            query.run(data_dict, permission_labels=None)
-
-        facets = query.facets
-
-        # organizations in the current search's facets.
-        group_names = []
-        for field_name in ("groups", "organization"):
-            group_names.extend(facets.get(field_name, {}).keys())
-
-        groups = (
-            model.Session.query(model.Group.name, model.Group.title)
-            .filter(model.Group.name.in_(group_names))
-            .all()
-            if group_names
-            else []
-        )
-        group_titles_by_name = dict(groups)
-        restructured_facets = {}
-        for key, value in facets.items():
-            restructured_facets[key] = {"title": key, "items": []}
-            for key_, value_ in value.items():
-                new_facet_dict = {"name": key_}
-                if key in ("groups", "organization"):
-                    display_name = group_titles_by_name.get(key_, key_)
-                    display_name = (
-                        display_name if display_name and display_name.strip() else key_
-                    )
-                    new_facet_dict["display_name"] = display_name
-                else:
-                    new_facet_dict["display_name"] = key_
-                new_facet_dict["count"] = value_
-                restructured_facets[key]["items"].append(new_facet_dict)
-        search_results["search_facets"] = restructured_facets
+        """
 
+        search_results["search_facets"] = facets.build_search_facets(search_results)
         return search_results
 
     def after_show(self, context, pkg_dict):
@@ -194,12 +137,12 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
         return context, pkg_dict
 
     def after_update(self, context, pkg_dict):
-        """IPackageController interface requires reimplementation of this method."""
+        caching.search_cache.invalidate()
+        _enqueue_thumbnail_prerendering(pkg_dict)
         return context, pkg_dict
 
     def before_index(self, pkg_dict):
-        """IPackageController interface requires reimplementation of this method."""
-        return pkg_dict
+        return thumbnails.index_thumbnail(pkg_dict)
 
     def before_search(self, search_params: typing.Dict):
         start_date = search_params.get("extras", {}).get("ext_start_reference_date")
@@ -213,7 +156,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             filter_query = " ".join((search_params["fq"], temporal_query))
             search_params["fq"] = filter_query
         search_params["fq"] = utils.handle_search(search_params)
-        return search_params
+        return facets.prepare_search_params(search_params)
 
     def before_view(self, pkg_dict: typing.Dict):
         return pkg_dict
@@ -238,6 +181,23 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
         toolkit.add_template_directory(config_, "../templates")
         toolkit.add_public_directory(config_, "../public")
         toolkit.add_resource("../assets", "ckanext-dalrrdemcdcpr")
+        build_info.load_build_info(config_)
+
+    def configure(self, config_):
+        """Compile the email templates and set up caches when the application starts
+
+        RQ workers fork a new process for each job, which then inherits the
+        compiled templates.
+
+        """
+
+        memberships.configure(config_)
+        try:
+            num_compiled = email_notifications.precompile_templates()
+        except Exception:
+            logger.exception("Could not precompile the email templates")
+        else:
+            logger.debug(f"Precompiled {num_compiled} email templates")
 
     def get_commands(self):
         return [
@@ -328,6 +288,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
                 dcpr_get_actions.dcpr_request_list_awaiting_nsif_moderation
             ),
             "dcpr_request_show": dcpr_get_actions.dcpr_request_show,
+            "dcpr_request_status_counts": dcpr_get_actions.dcpr_request_status_counts,
             "dcpr_request_update_by_owner": dcpr_update_actions.dcpr_request_update_by_owner,
             "dcpr_request_submit": dcpr_update_actions.dcpr_request_submit,
             "dcpr_request_update_by_nsif": dcpr_update_actions.dcpr_request_update_by_nsif,
@@ -340,6 +301,9 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             "dcpr_request_csi_moderate": dcpr_update_actions.dcpr_request_csi_moderate,
             "dcpr_request_delete": dcpr_delete_actions.dcpr_request_delete,
             "emc_version": emc_actions.show_version,
+            "emc_search_facets_stats": emc_actions.show_search_facets_stats,
+            "emc_search_cache_stats": emc_actions.show_search_cache_stats,
+            "emc_job_metrics": emc_actions.show_job_metrics,
             "emc_request_dataset_maintenance": emc_actions.request_dataset_maintenance,
             "emc_request_dataset_publication": emc_actions.request_dataset_publication,
             "emc_user_patch": ckan_actions.user_patch,
@@ -359,6 +323,9 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             "resource_create": ckan_actions.resource_create,
             "organization_create": ckan_actions.organization_create,
             "organization_update": ckan_actions.organization_update,
+            "organization_delete": ckan_actions.organization_delete,
+            "member_create": ckan_actions.member_create,
+            "member_delete": ckan_actions.member_delete,
         }
 
     def get_validators(self) -> typing.Dict[str, typing.Callable]:
@@ -406,6 +373,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             "dcpr_get_next_intermediate_dcpr_request_status": helpers.get_next_intermediate_dcpr_status,
             "dcpr_user_is_dcpr_request_owner": helpers.user_is_dcpr_request_owner,
             "emc_org_memberships": helpers.get_org_memberships,
+            "emc_user_context": helpers.get_user_context,
             "dcpr_requests_approved_by_nsif": helpers.get_dcpr_requests_approved_by_nsif,
             "is_dcpr_request": helpers.is_dcpr_request,
             "get_dcpr_request_action": helpers.get_dcpr_request_action,
@@ -428,6 +396,7 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             "get_datasets_thumbnail": helpers.get_datasets_thumbnail,
             "get_year": helpers.get_year,
             "get_user_dashboard_packages": helpers.get_user_dashboard_packages,
+            "get_user_dashboard_packages_page": helpers.get_user_dashboard_packages_page,
             "get_org_public_records_count": helpers.get_org_public_records_count,
         }
 
@@ -446,6 +415,15 @@ class DalrrdEmcDcprPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
             reset_blueprint
         ]
 
+    def make_middleware(self, app, config):
+        """Load the context of the current user before each request"""
+        app.before_request(user_context.load_user_context_for_request)
+        return app
+
+    def make_error_log_middleware(self, app, config):
+        """IMiddleware interface requires reimplementation of this method."""
+        return app
+
     def dataset_facets(
         self, facets_dict: typing.OrderedDict, package_type: str
     ) -> typing.OrderedDict:
@@ -485,4 +463,13 @@ def _parse_date(raw_date: str) -> typing.Optional[str]:
     except dateutil.parser.ParserError:
         logger.exception("Could not parse date from input string")
         result = None
-    return result
\ No newline at end of file
+    return result
+
+
+def _enqueue_thumbnail_prerendering(pkg_dict: typing.Dict) -> None:
+    if pkg_dict.get("id") and thumbnails.should_prerender(pkg_dict):
+        toolkit.enqueue_job(
+            jobs.prerender_wms_thumbnail,
+            args=[pkg_dict["id"]],
+            title=f"Prerender thumbnail of dataset {pkg_dict['id']}",
+        )
@@ -0,0 +1,252 @@
+"""Facet engine used by the DalrrdEmcDcprPlugin when processing search results
+
+Historically, `DalrrdEmcDcprPlugin.after_search()` would issue a second Solr query on
+every `package_search` in order to retrieve facet counts for all facet fields. This
+module implements two modes of operation, which are selected by the
+`ckan.dalrrd_emc_dcpr.search_facets_mode` configuration setting:
+
+- `passthrough` (the default) - reuse the facets that have already been computed by
+  the main search query. In order to make sure all the facet fields are present,
+  the `before_search()` hook asks for them in the main query.
+
+- `requery` - the legacy behavior, which runs a second Solr query in order to
+  retrieve facet counts for the whole catalogue.
+
+"""
+
+import enum
+import logging
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+import ckan.lib.helpers as h
+import ckan.lib.plugins as lib_plugins
+import ckan.lib.search as search
+import ckan.plugins as plugins
+from ckan import model
+from ckan.common import _, c, g
+from ckan.plugins import toolkit
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FACETS_MODE_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.search_facets_mode"
+GROUP_TITLE_INDEX_TTL_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.group_title_index_ttl"
+_DEFAULT_GROUP_TITLE_INDEX_TTL_SECONDS = 300
+
+
+class SearchFacetsMode(enum.Enum):
+    PASSTHROUGH = "passthrough"
+    REQUERY = "requery"
+
+
+class FacetEngineStats:
+    """Process-level counters of the facet engine's work."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.secondary_queries_avoided = 0
+        self.secondary_queries_run = 0
+
+    def record(self, requeried: bool) -> None:
+        with self._lock:
+            if requeried:
+                self.secondary_queries_run += 1
+            else:
+                self.secondary_queries_avoided += 1
+
+    def as_dict(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "secondary_queries_avoided": self.secondary_queries_avoided,
+                "secondary_queries_run": self.secondary_queries_run,
+            }
+
+
+stats = FacetEngineStats()
+
+
+class GroupTitleIndex:
+    """Process-level index of group (and organization) titles, keyed by name
+
+    The index is loaded with a single query and is reloaded after its TTL expires.
+    The organization actions keep it up to date for changes made in the current
+    process, the TTL takes care of changes made in other processes.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._titles: typing.Dict[str, typing.Optional[str]] = {}
+        self._loaded_at: typing.Optional[float] = None
+
+    def get_titles(
+        self, names: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.Optional[str]]:
+        names = list(names)
+        with self._lock:
+            if self._is_expired():
+                self._titles = dict(
+                    model.Session.query(model.Group.name, model.Group.title).all()
+                )
+                self._loaded_at = time.monotonic()
+            missing = [name for name in names if name not in self._titles]
+            if missing:
+                # groups created by another process since our last load. Names that
+                # are not found are also stored, in order to not look them up again
+                # until the index expires
+                self._titles.update({name: None for name in missing})
+                self._titles.update(
+                    model.Session.query(model.Group.name, model.Group.title)
+                    .filter(model.Group.name.in_(missing))
+                    .all()
+                )
+            return {name: self._titles[name] for name in names}
+
+    def set_title(self, name: str, title: typing.Optional[str]) -> None:
+        with self._lock:
+            self._titles[name] = title
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._titles.pop(name, None)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+    def _is_expired(self) -> bool:
+        if self._loaded_at is None:
+            result = True
+        else:
+            ttl = toolkit.asint(
+                toolkit.config.get(
+                    GROUP_TITLE_INDEX_TTL_CONFIG_KEY,
+                    _DEFAULT_GROUP_TITLE_INDEX_TTL_SECONDS,
+                )
+            )
+            result = time.monotonic() - self._loaded_at > ttl
+        return result
+
+
+group_title_index = GroupTitleIndex()
+
+
+def get_search_facets_mode() -> SearchFacetsMode:
+    raw_mode = toolkit.config.get(
+        SEARCH_FACETS_MODE_CONFIG_KEY, SearchFacetsMode.PASSTHROUGH.value
+    )
+    try:
+        result = SearchFacetsMode(raw_mode.strip().lower())
+    except ValueError:
+        logger.warning(
+            f"Invalid value {raw_mode!r} for {SEARCH_FACETS_MODE_CONFIG_KEY!r}, "
+            f"using {SearchFacetsMode.PASSTHROUGH.value!r}"
+        )
+        result = SearchFacetsMode.PASSTHROUGH
+    return result
+
+
+def get_facet_fields() -> typing.List[str]:
+    """Return the names of all the facet fields that are shown in the search page"""
+    facets = OrderedDict()
+    default_facet_titles = {
+        "groups": _("Groups"),
+        "tags": _("Tags"),
+    }
+    for facet in h.facets():
+        facets[facet] = default_facet_titles.get(facet, facet)
+    for plugin in plugins.PluginImplementations(plugins.IFacets):
+        facets = plugin.dataset_facets(facets, "dataset")
+    return list(facets.keys())
+
+
+def prepare_search_params(search_params: typing.Dict) -> typing.Dict:
+    """Make sure the main search query retrieves all the relevant facet fields
+
+    Searches that do not ask for any facets (e.g. the ones performed by the homepage
+    helpers) are left untouched, as nobody is going to render their facets.
+
+    """
+
+    if get_search_facets_mode() == SearchFacetsMode.PASSTHROUGH:
+        requested = list(search_params.get("facet.field") or [])
+        if requested:
+            for field in get_facet_fields():
+                if field not in requested:
+                    requested.append(field)
+            search_params["facet.field"] = requested
+    return search_params
+
+
+def build_search_facets(search_results: typing.Dict) -> typing.Dict:
+    """Return the `search_facets` structure for the input search results"""
+    if get_search_facets_mode() == SearchFacetsMode.REQUERY:
+        raw_facets = _run_facets_query(get_facet_fields())
+        stats.record(requeried=True)
+    else:
+        raw_facets = search_results.get("facets") or {}
+        stats.record(requeried=False)
+    return restructure_facets(raw_facets)
+
+
+def restructure_facets(
+    raw_facets: typing.Dict[str, typing.Dict[str, int]]
+) -> typing.Dict:
+    """Transform Solr facets into the structure expected by CKAN templates"""
+    # organizations in the current search's facets.
+    group_names: typing.List[str] = []
+    for field_name in ("groups", "organization"):
+        group_names.extend(raw_facets.get(field_name, {}).keys())
+
+    group_titles_by_name = (
+        group_title_index.get_titles(group_names) if group_names else {}
+    )
+    restructured_facets: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+    for key, value in raw_facets.items():
+        restructured_facets[key] = {"title": key, "items": []}
+        for key_, value_ in value.items():
+            new_facet_dict: typing.Dict[str, typing.Any] = {"name": key_}
+            if key in ("groups", "organization"):
+                display_name = group_titles_by_name.get(key_, key_)
+                display_name = (
+                    display_name if display_name and display_name.strip() else key_
+                )
+                new_facet_dict["display_name"] = display_name
+            else:
+                new_facet_dict["display_name"] = key_
+            new_facet_dict["count"] = value_
+            restructured_facets[key]["items"].append(new_facet_dict)
+    return restructured_facets
+
+
+def _run_facets_query(
+    facet_fields: typing.List[str],
+) -> typing.Dict[str, typing.Dict[str, int]]:
+    """Run a separate Solr query in order to get facets for the whole catalogue"""
+    data_dict: typing.Dict[str, typing.Any] = {
+        "fq": "",
+        "facet.field": facet_fields,
+    }
+
+    if not getattr(g, "user", None):
+        data_dict["fq"] = "+capacity:public " + data_dict["fq"]
+
+    query = search.query_for(model.Package)
+    try:
+        if c.userobj.sysadmin:
+            labels = None
+        else:
+            labels = lib_plugins.get_permission_labels().get_user_dataset_labels(
+                c.userobj
+            )
+
+        query.run(data_dict, permission_labels=labels)
+    except:
+        query.run(data_dict, permission_labels=None)
+    return query.facets
@@ -0,0 +1,120 @@
+"""Resolution of the users that receive notifications
+
+Notification jobs only need a few details of each recipient, in order to address
+emails and to render their templates. Instead of dictizing whole organizations and
+then loading each of their members as an ORM `User`, recipients are fetched with a
+single query and returned as lightweight `Recipient` tuples.
+
+The recipients of a DCPR request notification are resolved once, when its job
+starts, and reused for all the messages that the job sends.
+
+"""
+
+import dataclasses
+import logging
+import typing
+
+import sqlalchemy
+from ckan import model
+
+from .constants import CSI_ORG_NAME, NSIF_ORG_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class Recipient(typing.NamedTuple):
+    id: str
+    name: str
+    display_name: str
+    email: typing.Optional[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class DcprRecipients:
+    owner: typing.Optional[Recipient]
+    nsif_reviewer: typing.Optional[Recipient]
+    csi_moderator: typing.Optional[Recipient]
+    nsif_members: typing.List[Recipient]
+    csi_members: typing.List[Recipient]
+
+
+def resolve_dcpr_recipients(dcpr_request: typing.Dict) -> DcprRecipients:
+    """Return the actors of a DCPR request and the active members of NSIF and CSI
+
+    :param dcpr_request: A dictized DCPR request
+
+    """
+
+    actor_ids = {
+        dcpr_request.get(role)
+        for role in ("owner_user", "nsif_reviewer", "csi_moderator")
+    } - {None}
+    query = _get_org_members_query(model.Group.name.in_([NSIF_ORG_NAME, CSI_ORG_NAME]))
+    if len(actor_ids) > 0:
+        query = query.union_all(
+            model.Session.query(
+                model.User.id,
+                model.User.name,
+                model.User.fullname,
+                model.User.email,
+                sqlalchemy.cast(sqlalchemy.null(), sqlalchemy.UnicodeText),
+            ).filter(model.User.id.in_(actor_ids))
+        )
+    actors: typing.Dict[typing.Optional[str], Recipient] = {}
+    org_members: typing.Dict[str, typing.List[Recipient]] = {
+        NSIF_ORG_NAME: [],
+        CSI_ORG_NAME: [],
+    }
+    for row in query.all():
+        recipient = _as_recipient(row)
+        if row.org_name is None:
+            actors[recipient.id] = recipient
+        else:
+            org_members[row.org_name].append(recipient)
+    return DcprRecipients(
+        owner=actors.get(dcpr_request.get("owner_user")),
+        nsif_reviewer=actors.get(dcpr_request.get("nsif_reviewer")),
+        csi_moderator=actors.get(dcpr_request.get("csi_moderator")),
+        nsif_members=sorted(org_members[NSIF_ORG_NAME], key=lambda r: r.name),
+        csi_members=sorted(org_members[CSI_ORG_NAME], key=lambda r: r.name),
+    )
+
+
+def get_org_admins(org_id: str) -> typing.List[Recipient]:
+    """Return the active administrators of an organization, ordered by name"""
+    query = _get_org_members_query(
+        model.Group.id == org_id, model.Member.capacity == "admin"
+    ).order_by(model.User.name)
+    return [_as_recipient(row) for row in query.all()]
+
+
+def _get_org_members_query(*criteria):
+    """Return a query of the active members of the organizations matching `criteria`"""
+    return (
+        model.Session.query(
+            model.User.id,
+            model.User.name,
+            model.User.fullname,
+            model.User.email,
+            model.Group.name.label("org_name"),
+        )
+        .join(model.Member, model.Member.table_id == model.User.id)
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Member.table_name == "user",
+            model.Member.state == "active",
+            model.User.state == "active",
+            model.Group.state == "active",
+            model.Group.is_organization == True,
+            *criteria,
+        )
+    )
+
+
+def _as_recipient(row) -> Recipient:
+    return Recipient(
+        id=row.id,
+        name=row.name,
+        display_name=row.fullname or row.name,
+        email=row.email,
+    )
@@ -0,0 +1,293 @@
+"""Notify users of new results for their saved searches
+
+Each saved search keeps a watermark, which is the `metadata_modified` of the most
+recent result its owner has been notified of. On each run:
+
+- saved searches are grouped by their query string, so that each distinct query runs
+  only once, filtered to datasets modified after the oldest watermark of its group;
+- at most a configurable number of searches runs concurrently;
+- each owner gets a single email, listing all of their saved searches with new
+  results, and watermarks are advanced.
+
+A saved search that has never been checked has its watermark initialized to the
+current time, without notifying its owner.
+
+"""
+
+import collections
+import dataclasses
+import datetime as dt
+import logging
+import typing
+from concurrent import futures
+from urllib.parse import parse_qsl
+
+import dateutil.parser
+import flask
+import sqlalchemy
+from ckan import model
+from ckan.plugins import toolkit
+
+from . import email_notifications, mail_delivery
+from .model.saved_search import saved_searches_table
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_SEARCHES_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.saved_search_notifications_max_concurrent_searches"
+_DEFAULT_MAX_CONCURRENT_SEARCHES = 4
+_MAX_RESULTS_PER_SEARCH = 20
+_IGNORED_SEARCH_PARAMS = ("page", "sort")
+
+
+@dataclasses.dataclass(frozen=True)
+class _SavedSearchToCheck:
+    id: str
+    title: str
+    search_query: str
+    watermark: typing.Optional[dt.datetime]
+    owner_user: str
+    owner_name: str
+    owner_display_name: str
+    owner_email: typing.Optional[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class NewSearchResults:
+    title: str
+    search_query: str
+    num_new_results: int
+    datasets: typing.List[typing.Dict]
+
+
+@dataclasses.dataclass(frozen=True)
+class NotificationRunResult:
+    num_saved_searches: int
+    num_distinct_queries: int
+    num_failed_queries: int
+    num_notifications: int
+
+
+def notify_new_saved_search_results() -> NotificationRunResult:
+    run_started = dt.datetime.utcnow()
+    by_query = collections.defaultdict(list)
+    saved_searches = _get_saved_searches_to_check()
+    for saved_search in saved_searches:
+        by_query[saved_search.search_query].append(saved_search)
+
+    new_watermarks = {s.id: run_started for s in saved_searches if s.watermark is None}
+    queries_to_run = {}
+    for search_query, group in by_query.items():
+        watermarks = [s.watermark for s in group if s.watermark is not None]
+        if len(watermarks) > 0:
+            queries_to_run[search_query] = min(watermarks)
+    search_responses = _run_searches(queries_to_run)
+
+    per_owner = collections.defaultdict(list)
+    for search_query, response in search_responses.items():
+        datasets = [
+            {**d, "_modified": _parse_date(d["metadata_modified"])}
+            for d in response["results"]
+        ]
+        for saved_search in by_query[search_query]:
+            if saved_search.watermark is None:
+                continue
+            new_datasets = [
+                d for d in datasets if d["_modified"] > saved_search.watermark
+            ]
+            if len(new_datasets) > 0:
+                is_oldest = saved_search.watermark == queries_to_run[search_query]
+                per_owner[saved_search.owner_user].append(
+                    (
+                        saved_search,
+                        NewSearchResults(
+                            title=saved_search.title,
+                            search_query=saved_search.search_query,
+                            num_new_results=(
+                                response["count"] if is_oldest else len(new_datasets)
+                            ),
+                            datasets=new_datasets,
+                        ),
+                    )
+                )
+                new_watermarks[saved_search.id] = max(
+                    d["_modified"] for d in new_datasets
+                )
+
+    num_notifications = 0
+    with mail_delivery.mail_session():
+        for owner_searches in per_owner.values():
+            owner = owner_searches[0][0]
+            try:
+                email_notifications.send_notification(
+                    {
+                        "name": owner.owner_name,
+                        "display_name": owner.owner_display_name,
+                        "email": owner.owner_email,
+                    },
+                    _render_notification([results for _, results in owner_searches]),
+                )
+            except Exception:
+                logger.exception(f"Could not notify user {owner.owner_name!r}")
+                # do not advance the watermarks, the user will be notified on next run
+                for saved_search, _ in owner_searches:
+                    new_watermarks.pop(saved_search.id, None)
+            else:
+                num_notifications += 1
+    _update_watermarks(new_watermarks)
+    return NotificationRunResult(
+        num_saved_searches=len(saved_searches),
+        num_distinct_queries=len(queries_to_run),
+        num_failed_queries=len(queries_to_run) - len(search_responses),
+        num_notifications=num_notifications,
+    )
+
+
+def build_search_data_dict(
+    search_query: str, modified_after: dt.datetime
+) -> typing.Dict:
+    """Build `package_search` parameters from a saved query string
+
+    Mimics the way the dataset search page turns its URL query string into search
+    parameters.
+
+    """
+
+    q = ""
+    fq = ""
+    extras = {}
+    for param, value in parse_qsl(search_query):
+        if param == "q":
+            q = value
+        elif param.startswith("ext_"):
+            extras[param] = value
+        elif param not in _IGNORED_SEARCH_PARAMS and value:
+            fq += f' {param}:"{_escape_phrase(value)}"'
+    # the watermark filter goes in `fq_list`, because our `before_search()` joins
+    # the terms of `fq` with OR
+    watermark = modified_after.isoformat(timespec="milliseconds")
+    return {
+        "q": q,
+        "fq": fq.strip(),
+        "fq_list": [f"metadata_modified:{{{watermark}Z TO *]"],
+        "extras": extras,
+        "sort": "metadata_modified desc",
+        "rows": _MAX_RESULTS_PER_SEARCH,
+        "include_private": False,
+    }
+
+
+def _escape_phrase(value: str) -> str:
+    """Escape a value, so that it can be used as a quoted Solr phrase"""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _run_searches(
+    queries: typing.Dict[str, dt.datetime]
+) -> typing.Dict[str, typing.Dict]:
+    max_workers = toolkit.asint(
+        toolkit.config.get(
+            MAX_CONCURRENT_SEARCHES_CONFIG_KEY, _DEFAULT_MAX_CONCURRENT_SEARCHES
+        )
+    )
+    result = {}
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        to_do = {}
+        for search_query, watermark in queries.items():
+            search = _run_search
+            if flask.has_request_context():
+                # each worker needs its own copy of the request context
+                search = flask.copy_current_request_context(_run_search)
+            future = executor.submit(
+                search, build_search_data_dict(search_query, watermark)
+            )
+            to_do[future] = search_query
+        for future in futures.as_completed(to_do):
+            search_query = to_do[future]
+            try:
+                result[search_query] = future.result()
+            except Exception:
+                logger.exception(f"Could not run saved search {search_query!r}")
+    return result
+
+
+def _run_search(data_dict: typing.Dict) -> typing.Dict:
+    try:
+        result = toolkit.get_action("package_search")(
+            context={"ignore_auth": True}, data_dict=data_dict
+        )
+    finally:
+        # each worker thread gets its own session
+        model.Session.remove()
+    return result
+
+
+def _get_saved_searches_to_check() -> typing.List[_SavedSearchToCheck]:
+    table = saved_searches_table
+    query = (
+        model.Session.query(
+            table.c.saved_search_id,
+            table.c.saved_search_title,
+            table.c.search_query,
+            table.c.results_watermark,
+            table.c.owner_user,
+            model.User.name,
+            model.User.fullname,
+            model.User.email,
+        )
+        .join(model.User, model.User.id == table.c.owner_user)
+        .filter(model.User.state == "active", table.c.search_query.isnot(None))
+    )
+    return [
+        _SavedSearchToCheck(
+            id=row.saved_search_id,
+            title=row.saved_search_title,
+            search_query=row.search_query,
+            watermark=row.results_watermark,
+            owner_user=row.owner_user,
+            owner_name=row.name,
+            owner_display_name=row.fullname or row.name,
+            owner_email=row.email,
+        )
+        for row in query.all()
+    ]
+
+
+def _update_watermarks(watermarks: typing.Dict[str, dt.datetime]) -> None:
+    if len(watermarks) > 0:
+        model.Session.execute(
+            saved_searches_table.update()
+            .where(
+                saved_searches_table.c.saved_search_id
+                == sqlalchemy.bindparam("_saved_search_id")
+            )
+            .values(results_watermark=sqlalchemy.bindparam("_watermark")),
+            [
+                {"_saved_search_id": id_, "_watermark": watermark}
+                for id_, watermark in watermarks.items()
+            ],
+        )
+    model.Session.commit()
+
+
+def _render_notification(results: typing.List[NewSearchResults]) -> typing.Dict:
+    jinja_env = email_notifications.get_jinja_env()
+    site_title = toolkit.config.get("ckan.site_title", "SASDI EMC")
+    subject = toolkit.ungettext(
+        "{n} of your saved searches has new results on {site_title}",
+        "{n} of your saved searches have new results on {site_title}",
+        len(results),
+    ).format(n=len(results), site_title=site_title)
+    body = jinja_env.get_template(
+        "email_notifications/saved_search_new_results_body.txt"
+    ).render(
+        results=results,
+        site_title=site_title,
+        site_url=toolkit.config.get("ckan.site_url", ""),
+    )
+    return {"subject": subject, "body": body}
+
+
+def _parse_date(value: typing.Union[str, dt.datetime]) -> dt.datetime:
+    return value if isinstance(value, dt.datetime) else dateutil.parser.isoparse(value)
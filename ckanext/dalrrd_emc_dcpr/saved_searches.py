@@ -0,0 +1,146 @@
+"""Storage and retrieval of the searches that users save
+
+Saved searches are listed with keyset pagination, ordered by owner and by most
+recent first. This ordering is backed by the `(owner_user, saved_search_date)`
+index, which means that listing a page costs the same regardless of how many saved
+searches exist.
+
+"""
+
+import base64
+import dataclasses
+import datetime as dt
+import json
+import logging
+import typing
+
+import sqlalchemy
+from ckan import model
+
+from .model.saved_search import SavedSearches, saved_searches_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE: typing.Final[int] = 50
+
+
+@dataclasses.dataclass(frozen=True)
+class SavedSearch:
+    id: str
+    title: str
+    search_query: str
+    saved_search_date: dt.datetime
+    owner_user: str
+    owner_name: str
+    owner_display_name: str
+
+
+@dataclasses.dataclass(frozen=True)
+class SavedSearchPage:
+    items: typing.List[SavedSearch]
+    next_cursor: typing.Optional[str]
+
+
+def create_saved_search(
+    owner_user: str, search_query: str, title: str
+) -> SavedSearches:
+    saved_search = SavedSearches(
+        owner_user=owner_user,
+        search_query=search_query,
+        saved_search_title=title,
+        saved_search_date=dt.datetime.utcnow(),
+    )
+    model.Session.add(saved_search)
+    model.Session.commit()
+    return saved_search
+
+
+def delete_saved_search(saved_search_id: str, user_obj: model.User) -> bool:
+    """Delete a saved search, as long as it belongs to the user or user is sysadmin"""
+    query = model.Session.query(SavedSearches).filter(
+        SavedSearches.saved_search_id == saved_search_id
+    )
+    if not user_obj.sysadmin:
+        query = query.filter(SavedSearches.owner_user == user_obj.id)
+    num_deleted = query.delete(synchronize_session=False)
+    model.Session.commit()
+    return num_deleted > 0
+
+
+def list_saved_searches(
+    owner_user: typing.Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: typing.Optional[str] = None,
+) -> SavedSearchPage:
+    """Return a page of saved searches, together with the names of their owners
+
+    :param owner_user: Only list the saved searches of this user. Lists saved
+        searches of all users if None
+    :param limit: Maximum number of saved searches in the page
+    :param cursor: The `next_cursor` of the previous page, if any
+
+    """
+
+    table = saved_searches_table
+    sort_key = sqlalchemy.tuple_(
+        table.c.owner_user, table.c.saved_search_date, table.c.saved_search_id
+    )
+    query = (
+        model.Session.query(
+            table.c.saved_search_id,
+            table.c.saved_search_title,
+            table.c.search_query,
+            table.c.saved_search_date,
+            table.c.owner_user,
+            model.User.name,
+            model.User.fullname,
+        )
+        .join(model.User, model.User.id == table.c.owner_user)
+        .order_by(
+            table.c.owner_user.desc(),
+            table.c.saved_search_date.desc(),
+            table.c.saved_search_id.desc(),
+        )
+    )
+    if owner_user is not None:
+        query = query.filter(table.c.owner_user == owner_user)
+    if cursor is not None:
+        query = query.filter(sort_key < sqlalchemy.tuple_(*_decode_cursor(cursor)))
+    # fetch one more row than needed in order to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    items = [
+        SavedSearch(
+            id=row.saved_search_id,
+            title=row.saved_search_title,
+            search_query=row.search_query,
+            saved_search_date=row.saved_search_date,
+            owner_user=row.owner_user,
+            owner_name=row.name,
+            owner_display_name=row.fullname or row.name,
+        )
+        for row in rows[:limit]
+    ]
+    next_cursor = _encode_cursor(items[-1]) if len(rows) > limit else None
+    return SavedSearchPage(items=items, next_cursor=next_cursor)
+
+
+def _encode_cursor(saved_search: SavedSearch) -> str:
+    raw = json.dumps(
+        [
+            saved_search.owner_user,
+            saved_search.saved_search_date.isoformat(),
+            saved_search.id,
+        ]
+    )
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> typing.Tuple[str, dt.datetime, str]:
+    try:
+        owner_user, raw_date, saved_search_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii"))
+        )
+        result = (owner_user, dt.datetime.fromisoformat(raw_date), saved_search_id)
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f"Invalid saved search cursor: {cursor!r}") from exc
+    return result
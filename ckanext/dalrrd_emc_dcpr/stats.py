@@ -0,0 +1,478 @@
+"""Precomputed statistics for the /stats page
+
+Computing the statistics shown in the /stats page requires going through the whole
+activity history of the catalogue, which is too slow to be done on each request.
+Instead, `refresh_stats()` stores:
+
+- weekly aggregates of package activity - these are updated incrementally, only the
+  activities created since the last refresh (the watermark) are aggregated;
+- a snapshot of each leaderboard (largest groups, top tags, etc.).
+
+`refresh_stats()` is meant to be called periodically, either by running the
+`ckan dalrrd-emc-dcpr refresh-stats` CLI command or by enqueueing the
+`jobs.refresh_stats` background job. The /stats view only reads the stored rows.
+
+"""
+
+import dataclasses
+import datetime as dt
+import enum
+import functools
+import logging
+import typing
+
+import sqlalchemy
+from sqlalchemy import Table, select, func, and_
+from sqlalchemy.dialects import postgresql
+
+from ckan import model
+
+from .model import stats as stats_model
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d"
+LEADERBOARD_LIMIT = 10
+
+_REFRESH_STATE_NAME = "package_activity"
+
+# activities are only aggregated once they are this old, in order to not miss
+# those that belong to transactions which are still in progress when the refresh runs
+_WATERMARK_SAFETY_MARGIN = dt.timedelta(minutes=5)
+
+# weeks without activity are generated with `generate_series()` and the total
+# number of packages is a running sum over the weekly net change
+_WEEKLY_PACKAGE_STATS_QUERY = sqlalchemy.text(
+    """
+    WITH bounds AS (
+        SELECT
+            min(week) AS first_week,
+            greatest(max(week), date_trunc('week', current_date)::date) AS last_week
+        FROM emc_stats_weekly_package_activity
+    ), weeks AS (
+        SELECT generate_series(first_week, last_week, interval '1 week')::date AS week
+        FROM bounds
+    )
+    SELECT
+        weeks.week,
+        coalesce(s.created, 0) AS created,
+        coalesce(s.deleted, 0) AS deleted,
+        coalesce(s.revisions, 0) AS revisions,
+        sum(coalesce(s.created, 0) - coalesce(s.deleted, 0)) OVER (
+            ORDER BY weeks.week
+        ) AS total
+    FROM weeks
+    LEFT JOIN emc_stats_weekly_package_activity AS s ON s.week = weeks.week
+    ORDER BY weeks.week
+    """
+)
+
+
+class LeaderboardWidget(enum.Enum):
+    LARGEST_GROUPS = "largest_groups"
+    TOP_TAGS = "top_tags"
+    TOP_PACKAGE_CREATORS = "top_package_creators"
+    MOST_EDITED_PACKAGES = "most_edited_packages"
+
+
+@dataclasses.dataclass
+class LeaderboardEntry:
+    object_id: str
+    object_type: typing.Optional[str]
+    name: str
+    title: str
+    value: int
+
+
+@dataclasses.dataclass
+class WeeklyPackageStats:
+    week: str
+    created: int
+    deleted: int
+    revisions: int
+    total: int
+
+
+@dataclasses.dataclass
+class RefreshResult:
+    weeks_updated: int
+    activity_watermark: typing.Optional[dt.datetime]
+
+
+def refresh_stats(rebuild: bool = False) -> RefreshResult:
+    """Update the stored statistics
+
+    Weekly aggregates are updated with the activities that were created since the
+    previous refresh. Pass `rebuild=True` in order to discard the stored aggregates
+    and compute them again from the whole activity history.
+
+    """
+
+    session = model.Session
+    state_table = stats_model.stats_refresh_state_table
+    weekly_table = stats_model.stats_weekly_package_activity_table
+    session.execute(
+        postgresql.insert(state_table)
+        .values(name=_REFRESH_STATE_NAME)
+        .on_conflict_do_nothing(index_elements=[state_table.c.name])
+    )
+    # lock the state row, so that concurrent refreshes do not aggregate the same
+    # activities twice
+    state = session.execute(
+        select([state_table.c.activity_watermark])
+        .where(state_table.c.name == _REFRESH_STATE_NAME)
+        .with_for_update()
+    ).first()
+    if rebuild:
+        session.execute(weekly_table.delete())
+        low_watermark = None
+    else:
+        low_watermark = state.activity_watermark
+    high_watermark = dt.datetime.utcnow() - _WATERMARK_SAFETY_MARGIN
+    if low_watermark is not None and low_watermark >= high_watermark:
+        weekly_deltas = []
+    else:
+        weekly_deltas = _get_weekly_package_activity_deltas(
+            session, low_watermark, high_watermark
+        )
+    if len(weekly_deltas) > 0:
+        insert_statement = postgresql.insert(weekly_table).values(weekly_deltas)
+        session.execute(
+            insert_statement.on_conflict_do_update(
+                index_elements=[weekly_table.c.week],
+                set_={
+                    column: weekly_table.c[column] + insert_statement.excluded[column]
+                    for column in ("created", "deleted", "revisions")
+                },
+            )
+        )
+    new_watermark = max(high_watermark, low_watermark or high_watermark)
+    _refresh_leaderboards(session)
+    session.execute(
+        state_table.update()
+        .where(state_table.c.name == _REFRESH_STATE_NAME)
+        .values(activity_watermark=new_watermark, refreshed_at=dt.datetime.utcnow())
+    )
+    session.commit()
+    return RefreshResult(
+        weeks_updated=len(weekly_deltas), activity_watermark=new_watermark
+    )
+
+
+def get_weekly_package_stats() -> typing.List[WeeklyPackageStats]:
+    """Return the stored weekly package statistics, up until the current week
+
+    Weeks without any activity are filled in by the DB and the running total of
+    packages is computed with a window function, so that only the final rows are
+    loaded.
+
+    """
+
+    rows = model.Session.execute(_WEEKLY_PACKAGE_STATS_QUERY).fetchall()
+    return [
+        WeeklyPackageStats(
+            week=row.week.strftime(DATE_FORMAT),
+            created=row.created,
+            deleted=row.deleted,
+            revisions=row.revisions,
+            total=row.total,
+        )
+        for row in rows
+    ]
+
+
+def get_leaderboard(widget: LeaderboardWidget) -> typing.List[LeaderboardEntry]:
+    leaderboard_table = stats_model.stats_leaderboard_table
+    rows = model.Session.execute(
+        select([leaderboard_table])
+        .where(leaderboard_table.c.widget == widget.value)
+        .order_by(leaderboard_table.c.position)
+    ).fetchall()
+    return [
+        LeaderboardEntry(
+            object_id=row.object_id,
+            object_type=row.object_type,
+            name=row.name,
+            title=row.title,
+            value=row.value,
+        )
+        for row in rows
+    ]
+
+
+def get_last_refreshed() -> typing.Optional[dt.datetime]:
+    state_table = stats_model.stats_refresh_state_table
+    return model.Session.execute(
+        select([state_table.c.refreshed_at]).where(
+            state_table.c.name == _REFRESH_STATE_NAME
+        )
+    ).scalar()
+
+
+def get_date_week_started(date_: typing.Union[dt.datetime, dt.date]) -> dt.date:
+    if isinstance(date_, dt.datetime):
+        date_ = date_.date()
+    return date_ - dt.timedelta(days=date_.weekday())
+
+
+def _get_weekly_package_activity_deltas(
+    session,
+    low_watermark: typing.Optional[dt.datetime],
+    high_watermark: dt.datetime,
+) -> typing.List[typing.Dict]:
+    """Aggregate package activities by week
+
+    Only activities whose timestamp is in the `]low_watermark, high_watermark]`
+    interval are aggregated:
+
+    - a package is counted as created in the week of its first activity;
+    - a package is counted as deleted in the week of its first `deleted package`
+      activity;
+    - all package activities count as revisions.
+
+    """
+
+    activity = model.Activity
+    in_interval = activity.timestamp <= high_watermark
+    if low_watermark is not None:
+        in_interval = and_(activity.timestamp > low_watermark, in_interval)
+    package_activity = session.query(activity.timestamp).join(
+        model.Package, activity.object_id == model.Package.id
+    )
+    # packages that have activities in the interval are the only candidates for
+    # having been created or deleted in it
+    candidate_ids = session.query(activity.object_id).filter(in_interval)
+    first_activity = (
+        session.query(func.min(activity.timestamp).label("timestamp"))
+        .select_from(activity)
+        .filter(activity.object_id.in_(candidate_ids.subquery()))
+        .group_by(activity.object_id)
+    )
+    first_deletion = first_activity.filter(activity.activity_type == "deleted package")
+    first_interval_filter = func.min(activity.timestamp) <= high_watermark
+    if low_watermark is not None:
+        first_interval_filter = and_(
+            func.min(activity.timestamp) > low_watermark, first_interval_filter
+        )
+    counts = {
+        "created": _count_by_week(
+            session,
+            first_activity.join(
+                model.Package, activity.object_id == model.Package.id
+            ).having(first_interval_filter),
+        ),
+        "deleted": _count_by_week(
+            session,
+            first_deletion.join(
+                model.Package, activity.object_id == model.Package.id
+            ).having(first_interval_filter),
+        ),
+        "revisions": _count_by_week(session, package_activity.filter(in_interval)),
+    }
+    weeks: typing.Set[dt.date] = set()
+    for weekly_counts in counts.values():
+        weeks.update(weekly_counts.keys())
+    result = []
+    for week in sorted(weeks):
+        row: typing.Dict[str, typing.Any] = {"week": week}
+        for name, weekly_counts in counts.items():
+            row[name] = weekly_counts.get(week, 0)
+        result.append(row)
+    return result
+
+
+def _count_by_week(session, timestamps_query) -> typing.Dict[dt.date, int]:
+    """Count the rows of the input query by week, in the DB
+
+    The input query must have a `timestamp` column.
+
+    """
+
+    timestamps = timestamps_query.subquery()
+    week = sqlalchemy.cast(
+        func.date_trunc("week", timestamps.c.timestamp), sqlalchemy.types.Date
+    )
+    return dict(session.query(week, func.count()).group_by(week).all())
+
+
+def _refresh_leaderboards(session) -> None:
+    leaderboard_table = stats_model.stats_leaderboard_table
+    entries = {
+        LeaderboardWidget.LARGEST_GROUPS: largest_groups(LEADERBOARD_LIMIT),
+        LeaderboardWidget.TOP_TAGS: top_tags(LEADERBOARD_LIMIT),
+        LeaderboardWidget.TOP_PACKAGE_CREATORS: top_package_creators(LEADERBOARD_LIMIT),
+        LeaderboardWidget.MOST_EDITED_PACKAGES: most_edited_packages(LEADERBOARD_LIMIT),
+    }
+    session.execute(leaderboard_table.delete())
+    rows = []
+    for widget, widget_entries in entries.items():
+        for position, entry in enumerate(widget_entries):
+            rows.append(
+                {
+                    "widget": widget.value,
+                    "position": position,
+                    **dataclasses.asdict(entry),
+                }
+            )
+    if len(rows) > 0:
+        session.execute(leaderboard_table.insert(), rows)
+
+
+@functools.lru_cache(maxsize=None)
+def table(name: str) -> Table:
+    """Return the table with the input name
+
+    Tables are reflected from the DB only once per process.
+
+    """
+
+    return Table(name, model.meta.metadata, autoload=True)
+
+
+def largest_groups(limit: int = 10) -> typing.List[LeaderboardEntry]:
+    package = table("package")
+    activity = table("activity")
+    group = table("group")
+    num_packages = func.count(package.c["id"])
+    s = (
+        select(
+            [
+                group.c["id"].label("object_id"),
+                group.c["type"].label("object_type"),
+                group.c["name"],
+                _title_or_name(group.c["title"], group.c["name"]).label("title"),
+                num_packages.label("value"),
+            ]
+        )
+        .select_from(
+            activity.join(package, activity.c["object_id"] == package.c["id"]).join(
+                group, group.c["id"] == package.c["owner_org"]
+            )
+        )
+        .where(
+            and_(
+                activity.c["activity_type"] == "new package",
+                package.c["private"] == False,
+                package.c["state"] == "active",
+            )
+        )
+        .group_by(group.c["id"], group.c["type"], group.c["name"], group.c["title"])
+        .order_by(num_packages.desc())
+        .limit(limit)
+    )
+    return _get_leaderboard_entries(s)
+
+
+def top_tags(limit: int = 10) -> typing.List[LeaderboardEntry]:  # by package
+    tag = table("tag")
+    package_tag = table("package_tag")
+    package = table("package")
+    num_packages = func.count(package_tag.c["package_id"])
+    s = (
+        select(
+            [
+                tag.c["id"].label("object_id"),
+                sqlalchemy.null().label("object_type"),
+                tag.c["name"],
+                tag.c["name"].label("title"),
+                num_packages.label("value"),
+            ]
+        )
+        .select_from(
+            package_tag.join(tag, package_tag.c["tag_id"] == tag.c["id"]).join(
+                package, package_tag.c["package_id"] == package.c["id"]
+            )
+        )
+        .where(
+            and_(
+                package_tag.c["state"] == "active",
+                package.c["private"] == False,
+                package.c["state"] == "active",
+            )
+        )
+        .group_by(tag.c["id"], tag.c["name"])
+        .order_by(num_packages.desc())
+        .limit(limit)
+    )
+    return _get_leaderboard_entries(s)
+
+
+def top_package_creators(limit: int = 10) -> typing.List[LeaderboardEntry]:
+    package = table("package")
+    user = table("user")
+    num_packages = func.count(package.c["id"])
+    # mimics `model.User.display_name`
+    display_name = sqlalchemy.case(
+        [(func.trim(user.c["fullname"]) != "", user.c["fullname"])],
+        else_=user.c["name"],
+    )
+    s = (
+        select(
+            [
+                user.c["id"].label("object_id"),
+                sqlalchemy.null().label("object_type"),
+                user.c["name"],
+                display_name.label("title"),
+                num_packages.label("value"),
+            ]
+        )
+        .select_from(package.join(user, package.c["creator_user_id"] == user.c["id"]))
+        .where(
+            and_(
+                package.c["private"] == False,
+                package.c["state"] == "active",
+            )
+        )
+        .group_by(user.c["id"], user.c["name"], user.c["fullname"])
+        .order_by(num_packages.desc())
+        .limit(limit)
+    )
+    return _get_leaderboard_entries(s)
+
+
+def most_edited_packages(limit: int = 10) -> typing.List[LeaderboardEntry]:
+    package = table("package")
+    activity = table("activity")
+    num_edits = func.count(activity.c["id"])
+    s = (
+        select(
+            [
+                package.c["id"].label("object_id"),
+                package.c["type"].label("object_type"),
+                package.c["name"],
+                _title_or_name(package.c["title"], package.c["name"]).label("title"),
+                num_edits.label("value"),
+            ]
+        )
+        .select_from(activity.join(package, activity.c["object_id"] == package.c["id"]))
+        .where(
+            and_(
+                package.c["private"] == False,
+                activity.c["activity_type"] == "changed package",
+                package.c["state"] == "active",
+            )
+        )
+        .group_by(
+            package.c["id"], package.c["type"], package.c["name"], package.c["title"]
+        )
+        .order_by(num_edits.desc())
+        .limit(limit)
+    )
+    return _get_leaderboard_entries(s)
+
+
+def _title_or_name(title_column, name_column):
+    return func.coalesce(func.nullif(func.trim(title_column), ""), name_column)
+
+
+def _get_leaderboard_entries(statement) -> typing.List[LeaderboardEntry]:
+    return [
+        LeaderboardEntry(
+            object_id=row.object_id,
+            object_type=row.object_type,
+            name=row.name,
+            title=row.title,
+            value=row.value,
+        )
+        for row in model.Session.execute(statement).fetchall()
+    ]
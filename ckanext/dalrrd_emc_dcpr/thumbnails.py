@@ -0,0 +1,190 @@
+"""Thumbnails of datasets, as shown in the search results
+
+The thumbnail of a dataset is the first of:
+
+- its `metadata_thumbnail`;
+- a prerendered copy of the map of its first WMS resource, if one has been stored by
+  the `prerender_wms_thumbnail` background job and the dataset still has a WMS
+  resource;
+- the map of its first WMS resource, loaded from the remote server;
+- the image of its organization;
+- a default image.
+
+Thumbnail URLs are resolved when a dataset is indexed and are stored in the search
+index, so that rendering the search results only needs to read them. Stored copies
+are deleted together with their dataset.
+
+"""
+
+import io
+import json
+import logging
+import typing
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from ckan.lib import munge
+from ckan.plugins import toolkit
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FIELD: typing.Final[str] = "emc_thumbnail_url"
+PRERENDER_WMS_THUMBNAILS_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.prerender_wms_thumbnails"
+THUMBNAIL_SIZE_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.thumbnail_size"
+_DEFAULT_THUMBNAIL_SIZE = 256
+_DEFAULT_THUMBNAIL = "/images/org.png"
+_WMS_REQUEST_TIMEOUT_SECONDS = 20
+
+
+def get_thumbnail_url(pkg_dict: typing.Dict) -> str:
+    """Resolve the URL of the thumbnail of the input dataset"""
+    wms_url = get_wms_thumbnail_url(pkg_dict)
+    if pkg_dict.get("metadata_thumbnail"):
+        result = pkg_dict["metadata_thumbnail"]
+    elif wms_url is None:
+        result = _get_organization_image_url(pkg_dict)
+    elif pkg_dict.get("id") and get_stored_thumbnail_path(pkg_dict["id"]) is not None:
+        # indexing may run outside of a request (e.g. `ckan search-index rebuild`), so
+        # `url_for()` cannot be used here
+        site_url = toolkit.config.get("ckan.site_url", "").rstrip("/")
+        result = f"{site_url}/emc/thumbnails/{pkg_dict['id']}.png"
+    else:
+        result = wms_url
+    return result
+
+
+def get_wms_thumbnail_url(pkg_dict: typing.Dict) -> typing.Optional[str]:
+    """Return a URL for the map of the first WMS resource of the input dataset"""
+    for resource in pkg_dict.get("resources") or []:
+        if (resource.get("format") or "").lower() == "wms":
+            wms_url = resource["url"]
+            query = dict(parse_qsl(urlparse(wms_url).query))
+            query["format"] = "image/png; mode=8bit"
+            result = f"{wms_url.split('?')[0]}?{urlencode(query)}"
+            break
+    else:
+        result = None
+    return result
+
+
+def index_thumbnail(pkg_dict: typing.Dict) -> typing.Dict:
+    """Add the thumbnail URL to a dataset that is about to be indexed
+
+    The URL is stored both in its own search index field and in the validated data
+    dict, which is what the search results are built from.
+
+    """
+
+    validated = pkg_dict.get("validated_data_dict")
+    source = json.loads(validated) if validated else pkg_dict
+    thumbnail_url = get_thumbnail_url(source)
+    pkg_dict[THUMBNAIL_FIELD] = thumbnail_url
+    if validated:
+        source[THUMBNAIL_FIELD] = thumbnail_url
+        pkg_dict["validated_data_dict"] = json.dumps(source)
+    return pkg_dict
+
+
+def should_prerender(pkg_dict: typing.Dict) -> bool:
+    enabled = toolkit.asbool(
+        toolkit.config.get(PRERENDER_WMS_THUMBNAILS_CONFIG_KEY, False)
+    )
+    return (
+        enabled
+        and _get_storage_dir() is not None
+        and not pkg_dict.get("metadata_thumbnail")
+        and get_wms_thumbnail_url(pkg_dict) is not None
+    )
+
+
+def prerender_wms_thumbnail(dataset_id: str) -> typing.Optional[Path]:
+    """Fetch the WMS map of the input dataset, downscale it and store it locally
+
+    The dataset is reindexed afterwards, so that search results use the stored
+    copy. Downscaling requires Pillow. If it is not installed the image is stored
+    as it was returned by the WMS server.
+
+    """
+
+    from ckan.lib import search
+
+    pkg_dict = toolkit.get_action("package_show")(
+        context={"ignore_auth": True}, data_dict={"id": dataset_id}
+    )
+    wms_url = get_wms_thumbnail_url(pkg_dict)
+    storage_dir = _get_storage_dir()
+    if wms_url is None or storage_dir is None:
+        result = None
+    else:
+        try:
+            response = requests.get(wms_url, timeout=_WMS_REQUEST_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        except requests.RequestException:
+            logger.exception(f"Could not retrieve WMS thumbnail from {wms_url!r}")
+            result = None
+        else:
+            if response.headers.get("content-type", "").startswith("image/"):
+                storage_dir.mkdir(parents=True, exist_ok=True)
+                result = storage_dir / f"{dataset_id}.png"
+                result.write_bytes(_downscale(response.content))
+                search.rebuild(dataset_id)
+            else:
+                logger.warning(
+                    f"WMS server did not return an image for dataset "
+                    f"{dataset_id!r}: {response.text[:200]!r}"
+                )
+                result = None
+    return result
+
+
+def get_stored_thumbnail_path(dataset_id: str) -> typing.Optional[Path]:
+    storage_dir = _get_storage_dir()
+    path = storage_dir / f"{dataset_id}.png" if storage_dir is not None else None
+    return path if path is not None and path.is_file() else None
+
+
+def delete_stored_thumbnail(dataset_id: str) -> None:
+    path = get_stored_thumbnail_path(dataset_id)
+    if path is not None:
+        try:
+            path.unlink()
+        except OSError:
+            logger.exception(f"Could not delete stored thumbnail {str(path)!r}")
+
+
+def _downscale(image_bytes: bytes) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        result = image_bytes
+    else:
+        size = toolkit.asint(
+            toolkit.config.get(THUMBNAIL_SIZE_CONFIG_KEY, _DEFAULT_THUMBNAIL_SIZE)
+        )
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.thumbnail((size, size))
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+        result = buffer.getvalue()
+    return result
+
+
+def _get_storage_dir() -> typing.Optional[Path]:
+    storage_path = toolkit.config.get("ckan.storage_path")
+    return Path(storage_path) / "emc_thumbnails" if storage_path else None
+
+
+def _get_organization_image_url(pkg_dict: typing.Dict) -> str:
+    image_url = (pkg_dict.get("organization") or {}).get("image_url")
+    if image_url and not image_url.startswith("http"):
+        # munge here should not have an effect, only doing it in case of a potential
+        # vulnerability of dodgy api input
+        site_url = toolkit.config.get("ckan.site_url", "").rstrip("/")
+        image_name = munge.munge_filename_legacy(image_url)
+        result = f"{site_url}/uploads/group/{image_name}"
+    else:
+        result = _DEFAULT_THUMBNAIL
+    return result
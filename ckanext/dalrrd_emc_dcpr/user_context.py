@@ -0,0 +1,154 @@
+"""Facts about the current user that are needed throughout a request
+
+The page header, the template helpers and the auth functions all need to know which
+organizations the current user belongs to, with which role, and whether the user
+is a member of the portal staff. These facts are loaded once per request, by
+`load_user_context()`, which the plugin registers as a `before_request` hook, and
+are then read from `toolkit.g`. Requests for static files and assets skip the hook.
+
+Whether the portal staff organization exists is kept in a short-lived process-level
+cache, which the organization actions invalidate.
+
+"""
+
+import dataclasses
+import logging
+import typing
+
+import sqlalchemy
+from ckan import model
+from ckan.plugins import toolkit
+
+from . import memberships
+from .caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PORTAL_STAFF_ORG_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.portal_staff_organization_name"
+_DEFAULT_PORTAL_STAFF_ORG = "sasdi emc staff"
+_STAFF_ORG_CACHE_TTL_SECONDS = 60
+# flask serves static files and CKAN serves webassets through these endpoints
+_STATIC_ENDPOINTS = ("static", "webassets.index")
+
+
+@dataclasses.dataclass(frozen=True)
+class UserContext:
+    user_id: typing.Optional[str]
+    is_sysadmin: bool
+    is_staff_member: bool
+    memberships: typing.List[memberships.Membership]
+
+    def get_role(self, org_id_or_name: str) -> typing.Optional[str]:
+        for membership in self.memberships:
+            if org_id_or_name in (membership.org_id, membership.org_name):
+                result = membership.role
+                break
+        else:
+            result = None
+        return result
+
+
+_ANONYMOUS_USER_CONTEXT = UserContext(
+    user_id=None, is_sysadmin=False, is_staff_member=False, memberships=[]
+)
+
+_staff_org_cache = TTLCache(ttl=_STAFF_ORG_CACHE_TTL_SECONDS, max_entries=100)
+
+
+def load_user_context_for_request() -> None:
+    """Load the context of the current user, unless a static file is requested"""
+    endpoint = toolkit.request.endpoint
+    is_static = endpoint is None or (
+        endpoint in _STATIC_ENDPOINTS or endpoint.endswith(".static")
+    )
+    if not is_static:
+        load_user_context()
+
+
+def load_user_context() -> None:
+    """Load the context of the current user into `toolkit.g`"""
+    toolkit.g._emc_user_context = build_user_context(
+        getattr(toolkit.g, "userobj", None)
+    )
+
+
+def get_user_context() -> UserContext:
+    """Return the context of the current user
+
+    The context is loaded now if the `before_request` hook has not run (e.g. in CLI
+    commands or background jobs that use a test request context).
+
+    """
+
+    try:
+        result = getattr(toolkit.g, "_emc_user_context", None)
+        if result is None:
+            load_user_context()
+            result = toolkit.g._emc_user_context
+    except (RuntimeError, TypeError):
+        result = _ANONYMOUS_USER_CONTEXT
+    return result
+
+
+def build_user_context(user_obj) -> UserContext:
+    if user_obj is None:
+        result = _ANONYMOUS_USER_CONTEXT
+    else:
+        user_memberships = memberships.get_user_memberships(user_obj.id)
+        result = UserContext(
+            user_id=user_obj.id,
+            is_sysadmin=bool(user_obj.sysadmin),
+            is_staff_member=is_staff_member(user_obj.sysadmin, user_memberships),
+            memberships=user_memberships,
+        )
+    return result
+
+
+def is_staff_member(
+    is_sysadmin: bool, user_memberships: typing.List[memberships.Membership]
+) -> bool:
+    """Check whether the user is staff, based on the user's memberships
+
+    Mimics the previous implementation, which relied on the
+    `organization_list_for_user` action with its default `manage_group` permission.
+    As such, admins of the portal staff organization are staff. Sysadmins are staff
+    only if the portal staff organization exists, since that action returns all
+    organizations for them.
+
+    """
+
+    portal_staff = toolkit.config.get(
+        PORTAL_STAFF_ORG_CONFIG_KEY, _DEFAULT_PORTAL_STAFF_ORG
+    ).lower()
+    if is_sysadmin:
+        result = _portal_staff_org_exists(portal_staff)
+    else:
+        result = False
+        for membership in user_memberships:
+            is_portal_staff = (membership.org_title or "").lower() == portal_staff
+            if is_portal_staff and membership.role == "admin":
+                result = True
+                break
+    return result
+
+
+def invalidate_portal_staff_org() -> None:
+    """Forget whether the portal staff organization exists"""
+    _staff_org_cache.clear()
+
+
+def _portal_staff_org_exists(portal_staff: str) -> bool:
+    return _staff_org_cache.get_or_set(
+        portal_staff, lambda: _query_portal_staff_org_exists(portal_staff)
+    )
+
+
+def _query_portal_staff_org_exists(portal_staff: str) -> bool:
+    query = model.Session.query(model.Group.id).filter(
+        sqlalchemy.func.lower(model.Group.title) == portal_staff,
+        model.Group.state == "active",
+        model.Group.is_organization == True,
+    )
+    return query.first() is not None
@@ -0,0 +1,521 @@
+"""Bulk creation of datasets from uploaded XML metadata files
+
+An upload goes through these stages:
+
+1. `accept_upload()` runs in the HTTP request. It spools the uploaded files to
+   storage, records them and enqueues the `process_xml_upload` job;
+2. `process_upload()` parses and validates the spooled files in a pool of worker
+   processes. Each worker holds a single document in memory at a time. Valid
+   datasets are then split into batches, each of which is enqueued as a
+   `create_xml_upload_datasets` job;
+3. `create_datasets()` creates the datasets of a batch. When the last batch of an
+   upload finishes, the uploader is emailed with the outcome of each file.
+
+The progress of each file is stored in the DB and is available through
+`get_upload_status()`. Within each stage, the uploader, the results of each file and
+the time spent in each step are carried by an `XmlUploadContext`, which is passed
+explicitly to the functions of the `xml_parser` blueprint.
+
+"""
+
+import collections
+import contextlib
+import dataclasses
+import datetime as dt
+import enum
+import json
+import logging
+import shutil
+import tempfile
+import time
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import sqlalchemy
+from ckan import model
+from ckan.plugins import toolkit
+
+from .blueprints import xml_parser
+from .model.xml_upload import xml_upload_file_table, xml_upload_table
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS_CONFIG_KEY: typing.Final[
+    str
+] = "ckan.dalrrd_emc_dcpr.xml_upload_max_workers"
+BATCH_SIZE_CONFIG_KEY: typing.Final[str] = "ckan.dalrrd_emc_dcpr.xml_upload_batch_size"
+_DEFAULT_MAX_WORKERS = 4
+_DEFAULT_BATCH_SIZE = 20
+_XML_CONTENT_TYPES = ("text/xml", "application/xml")
+
+
+class XmlUploadFileState(enum.Enum):
+    REJECTED = "rejected"
+    PENDING = "pending"
+    INVALID = "invalid"
+    PARSED = "parsed"
+    CREATED = "created"
+    FAILED = "failed"
+
+
+_FINAL_STATES = (
+    XmlUploadFileState.REJECTED.value,
+    XmlUploadFileState.INVALID.value,
+    XmlUploadFileState.CREATED.value,
+    XmlUploadFileState.FAILED.value,
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class XmlUploadFileResult:
+    position: int
+    filename: typing.Optional[str]
+    state: XmlUploadFileState
+    message: typing.Optional[str] = None
+    package_name: typing.Optional[str] = None
+
+    @property
+    def display_message(self) -> str:
+        """Message shown to the uploader, even when none has been recorded"""
+        return self.message or f"{self.filename}: {self.state.value}"
+
+
+@dataclasses.dataclass
+class XmlUploadContext:
+    """State of a single upload, as seen by the current stage of its processing"""
+
+    upload_id: str
+    user_id: str
+    user_name: str
+    user_display_name: str
+    user_email: typing.Optional[str]
+    results: typing.Dict[int, XmlUploadFileResult] = dataclasses.field(
+        default_factory=dict
+    )
+    timings: typing.DefaultDict[str, float] = dataclasses.field(
+        default_factory=lambda: collections.defaultdict(float)
+    )
+
+    @classmethod
+    def for_user(cls, upload_id: str, user_obj: model.User) -> "XmlUploadContext":
+        return cls(
+            upload_id=upload_id,
+            user_id=user_obj.id,
+            user_name=user_obj.name,
+            user_display_name=user_obj.display_name,
+            user_email=user_obj.email,
+        )
+
+    @classmethod
+    def load(cls, upload_id: str) -> "XmlUploadContext":
+        """Load the context of an existing upload, with the results of its files"""
+        row = model.Session.execute(
+            sqlalchemy.select(
+                [
+                    xml_upload_table.c.user_id,
+                    model.User.name,
+                    model.User.fullname,
+                    model.User.email,
+                ]
+            )
+            .select_from(
+                xml_upload_table.join(
+                    model.User.__table__,
+                    model.User.id == xml_upload_table.c.user_id,
+                )
+            )
+            .where(xml_upload_table.c.upload_id == upload_id)
+        ).first()
+        if row is None:
+            raise toolkit.ObjectNotFound(f"XML upload {upload_id!r} does not exist")
+        upload_context = cls(
+            upload_id=upload_id,
+            user_id=row.user_id,
+            user_name=row.name,
+            user_display_name=row.fullname or row.name,
+            user_email=row.email,
+        )
+        file_rows = model.Session.execute(
+            sqlalchemy.select(
+                [
+                    xml_upload_file_table.c.position,
+                    xml_upload_file_table.c.filename,
+                    xml_upload_file_table.c.state,
+                    xml_upload_file_table.c.message,
+                    xml_upload_file_table.c.package_name,
+                ]
+            ).where(xml_upload_file_table.c.upload_id == upload_id)
+        ).fetchall()
+        for file_row in file_rows:
+            upload_context.results[file_row.position] = XmlUploadFileResult(
+                position=file_row.position,
+                filename=file_row.filename,
+                state=XmlUploadFileState(file_row.state),
+                message=file_row.message,
+                package_name=file_row.package_name,
+            )
+        return upload_context
+
+    @property
+    def ckan_context(self) -> typing.Dict:
+        """Context for the CKAN actions that run on behalf of the uploader"""
+        return {"user": self.user_name}
+
+    @property
+    def info_msgs(self) -> typing.List[str]:
+        return [
+            r.display_message
+            for r in self.sorted_results
+            if r.state == XmlUploadFileState.CREATED
+        ]
+
+    @property
+    def err_msgs(self) -> typing.List[str]:
+        return [
+            r.display_message
+            for r in self.sorted_results
+            if r.state != XmlUploadFileState.CREATED
+        ]
+
+    @property
+    def sorted_results(self) -> typing.List[XmlUploadFileResult]:
+        return [self.results[position] for position in sorted(self.results)]
+
+    def record(self, result: XmlUploadFileResult) -> None:
+        self.results[result.position] = result
+
+    @contextlib.contextmanager
+    def timed(self, step: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[step] += time.perf_counter() - start
+
+
+def accept_upload(user_obj: model.User, xml_files: typing.List) -> str:
+    """Spool the uploaded files to storage and enqueue their processing
+
+    :param user_obj: the uploader, who becomes the creator of the datasets
+    :param xml_files: the uploaded files, as werkzeug `FileStorage` instances
+    :returns: the id of the upload
+
+    """
+
+    from . import jobs
+
+    upload_id = model.types.make_uuid()
+    upload_context = XmlUploadContext.for_user(upload_id, user_obj)
+    upload_dir = _get_upload_dir(upload_id)
+    upload_dir.mkdir(parents=True)
+    with upload_context.timed("spool"):
+        for position, xml_file in enumerate(xml_files):
+            if xml_file.content_type in _XML_CONTENT_TYPES:
+                # FileStorage.save() copies the file in chunks
+                xml_file.save(str(_get_spooled_path(upload_dir, position)))
+                result = XmlUploadFileResult(
+                    position, xml_file.filename, XmlUploadFileState.PENDING
+                )
+            else:
+                result = XmlUploadFileResult(
+                    position,
+                    xml_file.filename,
+                    XmlUploadFileState.REJECTED,
+                    f"{xml_file.filename}: Only xml files are allowed",
+                )
+            upload_context.record(result)
+    now = dt.datetime.utcnow()
+    model.Session.execute(
+        xml_upload_table.insert().values(
+            upload_id=upload_id, user_id=upload_context.user_id, created_at=now
+        )
+    )
+    if len(upload_context.results) > 0:
+        model.Session.execute(
+            xml_upload_file_table.insert(),
+            [
+                {
+                    "upload_id": upload_id,
+                    "position": r.position,
+                    "filename": r.filename,
+                    "state": r.state.value,
+                    "message": r.message,
+                    "updated_at": now,
+                }
+                for r in upload_context.sorted_results
+            ],
+        )
+    model.Session.commit()
+    toolkit.enqueue_job(
+        jobs.process_xml_upload,
+        args=[upload_id],
+        title=f"Process XML upload {upload_id}",
+    )
+    _log_timings(upload_context, "accept")
+    return upload_id
+
+
+def process_upload(upload_id: str) -> None:
+    """Parse and validate the spooled files of an upload and enqueue their creation"""
+    from . import jobs
+
+    upload_context = XmlUploadContext.load(upload_id)
+    upload_dir = _get_upload_dir(upload_id)
+    pending = [
+        r
+        for r in upload_context.sorted_results
+        if r.state == XmlUploadFileState.PENDING
+    ]
+    max_workers = toolkit.asint(
+        toolkit.config.get(MAX_WORKERS_CONFIG_KEY, _DEFAULT_MAX_WORKERS)
+    )
+    parsed_positions = []
+    # forked workers must not share the DB connections of this process
+    model.Session.remove()
+    model.meta.engine.dispose()
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        to_do = {
+            executor.submit(
+                parse_spooled_file,
+                str(_get_spooled_path(upload_dir, pending_file.position)),
+                pending_file.filename,
+            ): pending_file
+            for pending_file in pending
+        }
+        for future in futures.as_completed(to_do):
+            pending_file = to_do[future]
+            try:
+                parse_result, elapsed = future.result()
+            except Exception as exc:
+                logger.exception(
+                    f"Could not parse file {pending_file.position} of {upload_id!r}"
+                )
+                parse_result = {"state": False, "msg": f"could not parse file: {exc}"}
+                elapsed = 0
+            upload_context.timings["parse"] += elapsed
+            if parse_result["state"]:
+                result = dataclasses.replace(
+                    pending_file, state=XmlUploadFileState.PARSED
+                )
+                _store_result(
+                    upload_context,
+                    result,
+                    data_dict=json.dumps(parse_result["data_dict"]),
+                )
+                parsed_positions.append(pending_file.position)
+            else:
+                result = dataclasses.replace(
+                    pending_file,
+                    state=XmlUploadFileState.INVALID,
+                    message=parse_result["msg"],
+                )
+                _store_result(upload_context, result)
+    model.Session.commit()
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    batch_size = toolkit.asint(
+        toolkit.config.get(BATCH_SIZE_CONFIG_KEY, _DEFAULT_BATCH_SIZE)
+    )
+    parsed_positions.sort()
+    for index in range(0, len(parsed_positions), batch_size):
+        toolkit.enqueue_job(
+            jobs.create_xml_upload_datasets,
+            args=[upload_id, parsed_positions[index : index + batch_size]],
+            title=f"Create datasets of XML upload {upload_id}",
+        )
+    if len(parsed_positions) == 0:
+        notify_uploader_if_complete(upload_context)
+    _log_timings(upload_context, "parse")
+
+
+def parse_spooled_file(path: str, filename: str) -> typing.Tuple[typing.Dict, float]:
+    """Extract a dataset from a spooled XML file
+
+    This runs in a worker process and thus must not access the DB. Returns the
+    result of the extraction, together with how long it took.
+
+    """
+
+    start = time.perf_counter()
+    result = xml_parser.check_file_fields(path, filename)
+    return result, time.perf_counter() - start
+
+
+def create_datasets(upload_id: str, positions: typing.List[int]) -> None:
+    """Create the datasets of a batch of files that have already been parsed"""
+    upload_context = XmlUploadContext.load(upload_id)
+    rows = model.Session.execute(
+        sqlalchemy.select(
+            [xml_upload_file_table.c.position, xml_upload_file_table.c.data_dict]
+        )
+        .where(
+            sqlalchemy.and_(
+                xml_upload_file_table.c.upload_id == upload_id,
+                xml_upload_file_table.c.position.in_(positions),
+                xml_upload_file_table.c.state == XmlUploadFileState.PARSED.value,
+            )
+        )
+        .order_by(xml_upload_file_table.c.position)
+    ).fetchall()
+    for position, raw_data_dict in rows:
+        data_dict = json.loads(raw_data_dict)
+        pending_file = upload_context.results[position]
+        try:
+            with upload_context.timed("create"):
+                creation = xml_parser.create_ckan_dataset(data_dict, upload_context)
+        except Exception as exc:
+            # a single failing file must not leave the rest of its batch, and thus
+            # the whole upload, unfinished
+            logger.exception(f"Could not create dataset {position} of {upload_id!r}")
+            model.Session.rollback()
+            reason = str(exc) or type(exc).__name__
+            creation = {
+                "state": False,
+                "msg": f"{pending_file.filename}: could not create dataset: {reason}",
+            }
+        result = dataclasses.replace(
+            pending_file,
+            state=(
+                XmlUploadFileState.CREATED
+                if creation["state"]
+                else XmlUploadFileState.FAILED
+            ),
+            message=creation["msg"],
+            package_name=data_dict.get("name"),
+        )
+        _store_result(upload_context, result, data_dict=None)
+        # commit each file, so that progress is visible in the status endpoint
+        model.Session.commit()
+    notify_uploader_if_complete(upload_context)
+    _log_timings(upload_context, "create")
+
+
+def notify_uploader_if_complete(upload_context: XmlUploadContext) -> bool:
+    """Email the uploader, if all files of the upload have been processed
+
+    Several batches may finish at the same time, the update on `notified_at` ensures
+    that only one of them sends the email. The notifying batch reloads the upload's
+    results, as the other batches have stored theirs in the meantime.
+
+    """
+
+    num_unfinished = model.Session.execute(
+        sqlalchemy.select([sqlalchemy.func.count()]).where(
+            sqlalchemy.and_(
+                xml_upload_file_table.c.upload_id == upload_context.upload_id,
+                xml_upload_file_table.c.state.notin_(_FINAL_STATES),
+            )
+        )
+    ).scalar()
+    should_notify = False
+    if num_unfinished == 0:
+        claimed = model.Session.execute(
+            xml_upload_table.update()
+            .where(
+                sqlalchemy.and_(
+                    xml_upload_table.c.upload_id == upload_context.upload_id,
+                    xml_upload_table.c.notified_at.is_(None),
+                )
+            )
+            .values(notified_at=dt.datetime.utcnow())
+        )
+        model.Session.commit()
+        should_notify = claimed.rowcount == 1
+    if should_notify:
+        complete_context = XmlUploadContext.load(upload_context.upload_id)
+        with upload_context.timed("notify"):
+            xml_parser.send_email_to_creator(complete_context)
+    return should_notify
+
+
+def get_upload_status(upload_id: str) -> typing.Dict:
+    upload = _get_upload(upload_id)
+    files = model.Session.execute(
+        sqlalchemy.select(
+            [
+                xml_upload_file_table.c.position,
+                xml_upload_file_table.c.filename,
+                xml_upload_file_table.c.state,
+                xml_upload_file_table.c.message,
+                xml_upload_file_table.c.package_name,
+                xml_upload_file_table.c.updated_at,
+            ]
+        )
+        .where(xml_upload_file_table.c.upload_id == upload_id)
+        .order_by(xml_upload_file_table.c.position)
+    ).fetchall()
+    file_statuses = [
+        {
+            "position": row.position,
+            "filename": row.filename,
+            "state": row.state,
+            "message": row.message,
+            "package_name": row.package_name,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        }
+        for row in files
+    ]
+    return {
+        "upload_id": upload.upload_id,
+        "user_id": upload.user_id,
+        "created_at": upload.created_at.isoformat() if upload.created_at else None,
+        "finished": all(f["state"] in _FINAL_STATES for f in file_statuses),
+        "files": file_statuses,
+    }
+
+
+def _get_upload(upload_id: str):
+    upload = model.Session.execute(
+        sqlalchemy.select([xml_upload_table]).where(
+            xml_upload_table.c.upload_id == upload_id
+        )
+    ).first()
+    if upload is None:
+        raise toolkit.ObjectNotFound(f"XML upload {upload_id!r} does not exist")
+    return upload
+
+
+def _store_result(
+    upload_context: XmlUploadContext, result: XmlUploadFileResult, **values
+) -> None:
+    upload_context.record(result)
+    model.Session.execute(
+        xml_upload_file_table.update()
+        .where(
+            sqlalchemy.and_(
+                xml_upload_file_table.c.upload_id == upload_context.upload_id,
+                xml_upload_file_table.c.position == result.position,
+            )
+        )
+        .values(
+            state=result.state.value,
+            message=result.message,
+            package_name=result.package_name,
+            updated_at=dt.datetime.utcnow(),
+            **values,
+        )
+    )
+
+
+def _log_timings(upload_context: XmlUploadContext, stage: str) -> None:
+    timings = ", ".join(
+        f"{step}: {seconds:.2f}s" for step, seconds in upload_context.timings.items()
+    )
+    logger.info(f"XML upload {upload_context.upload_id!r} {stage} stage - {timings}")
+
+
+def _get_upload_dir(upload_id: str) -> Path:
+    storage_path = toolkit.config.get("ckan.storage_path")
+    if storage_path:
+        base_dir = Path(storage_path)
+    else:
+        logger.warning(
+            "ckan.storage_path is not set, spooling XML uploads to a temporary "
+            "directory, which background workers on other hosts will not see"
+        )
+        base_dir = Path(tempfile.gettempdir())
+    return base_dir / "emc_xml_uploads" / upload_id
+
+
+def _get_spooled_path(upload_dir: Path, position: int) -> Path:
+    return upload_dir / f"{position:04d}.xml"
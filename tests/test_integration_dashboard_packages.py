@@ -0,0 +1,29 @@
+import pytest
+
+from ckan.tests import factories
+
+from ckanext.dalrrd_emc_dcpr import helpers
+
+pytestmark = pytest.mark.integration
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins", "with_request_context")
+def test_get_user_dashboard_packages_is_paginated():
+    user = factories.User()
+    other_user = factories.User()
+    organization = factories.Organization()
+    created = [
+        factories.Dataset(owner_org=organization["id"], user=user) for _ in range(3)
+    ]
+    factories.Dataset(owner_org=organization["id"], user=other_user)
+
+    first_page = helpers.get_user_dashboard_packages(user["id"], limit=2, offset=0)
+    second_page = helpers.get_user_dashboard_packages(user["id"], limit=2, offset=2)
+
+    assert helpers.get_user_dashboard_packages_count(user["id"]) == 3
+    assert len(first_page) == 2
+    assert len(second_page) == 1
+    assert {p["id"] for p in first_page + second_page} == {d["id"] for d in created}
+    assert first_page[0]["organization"]["id"] == organization["id"]
+    assert "extras" in first_page[0]
+    assert "resources" in first_page[0]
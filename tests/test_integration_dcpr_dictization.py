@@ -0,0 +1,78 @@
+import contextlib
+import typing
+
+import pytest
+import sqlalchemy
+
+from ckan import model
+from ckan.tests import factories
+
+from ckanext.dalrrd_emc_dcpr import dcpr_dictization
+from ckanext.dalrrd_emc_dcpr.constants import DCPRRequestStatus
+from ckanext.dalrrd_emc_dcpr.model import dcpr_request
+
+pytestmark = pytest.mark.integration
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+@pytest.mark.parametrize("dictize_for_ui", [False, True])
+def test_dcpr_request_list_dictize_query_count_is_constant(dictize_for_ui):
+    query_counts = {}
+    for num_requests in (1, 10, 50):
+        request_ids = _create_dcpr_requests(num_requests)
+        model.Session.expunge_all()
+        dcpr_requests = (
+            model.Session.query(dcpr_request.DCPRRequest)
+            .filter(dcpr_request.DCPRRequest.csi_reference_id.in_(request_ids))
+            .all()
+        )
+        context = {"model": model, "dictize_for_ui": dictize_for_ui}
+        with _count_queries() as counter:
+            result = dcpr_dictization.dcpr_request_list_dictize(dcpr_requests, context)
+        assert len(result) == num_requests
+        assert all(len(r["datasets"]) == 2 for r in result)
+        query_counts[num_requests] = counter["queries"]
+    assert len(set(query_counts.values())) == 1, query_counts
+
+
+def _create_dcpr_requests(num_requests: int) -> typing.List[str]:
+    user = factories.User()
+    organization = factories.Organization()
+    request_ids = []
+    for index in range(num_requests):
+        request_obj = dcpr_request.DCPRRequest(
+            owner_user=user["id"],
+            organization_id=organization["id"],
+            status=DCPRRequestStatus.UNDER_PREPARATION.value,
+            proposed_project_name=f"project {index}",
+            capture_start_date="2022-01-01",
+            capture_end_date="2022-01-02",
+        )
+        model.Session.add(request_obj)
+        model.Session.flush()
+        for dataset_index in range(2):
+            model.Session.add(
+                dcpr_request.DCPRRequestDataset(
+                    dcpr_request_id=request_obj.csi_reference_id,
+                    proposed_dataset_title=f"dataset {dataset_index}",
+                    dataset_purpose="testing",
+                )
+            )
+        request_ids.append(request_obj.csi_reference_id)
+    model.Session.commit()
+    return request_ids
+
+
+@contextlib.contextmanager
+def _count_queries():
+    counter = {"queries": 0}
+
+    def before_cursor_execute(*args, **kwargs):
+        counter["queries"] += 1
+
+    engine = model.meta.engine
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,68 @@
+import pytest
+
+from ckan.tests import factories
+
+from ckanext.dalrrd_emc_dcpr import recipients
+from ckanext.dalrrd_emc_dcpr.constants import (
+    CSI_ORG_NAME,
+    NSIF_ORG_NAME,
+)
+
+pytestmark = pytest.mark.integration
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_resolve_dcpr_recipients():
+    owner = factories.User(fullname="Request Owner")
+    nsif_reviewer = factories.User()
+    nsif_member = factories.User()
+    csi_member = factories.User()
+    factories.Organization(
+        name=NSIF_ORG_NAME,
+        users=[
+            {"name": nsif_reviewer["name"], "capacity": "editor"},
+            {"name": nsif_member["name"], "capacity": "member"},
+        ],
+    )
+    factories.Organization(
+        name=CSI_ORG_NAME,
+        users=[{"name": csi_member["name"], "capacity": "member"}],
+    )
+
+    result = recipients.resolve_dcpr_recipients(
+        {
+            "owner_user": owner["id"],
+            "nsif_reviewer": nsif_reviewer["id"],
+            "csi_moderator": None,
+        }
+    )
+
+    assert result.owner == recipients.Recipient(
+        id=owner["id"],
+        name=owner["name"],
+        display_name="Request Owner",
+        email=owner["email"],
+    )
+    assert result.nsif_reviewer.id == nsif_reviewer["id"]
+    assert result.csi_moderator is None
+    assert {r.id for r in result.nsif_members} == {
+        nsif_reviewer["id"],
+        nsif_member["id"],
+    }
+    assert [r.id for r in result.csi_members] == [csi_member["id"]]
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_get_org_admins():
+    admin = factories.User()
+    editor = factories.User()
+    organization = factories.Organization(
+        users=[
+            {"name": admin["name"], "capacity": "admin"},
+            {"name": editor["name"], "capacity": "editor"},
+        ]
+    )
+    result = recipients.get_org_admins(organization["id"])
+    # the creator of the organization is also one of its admins
+    assert admin["id"] in {r.id for r in result}
+    assert editor["id"] not in {r.id for r in result}
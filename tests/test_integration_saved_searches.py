@@ -0,0 +1,48 @@
+import pytest
+
+from ckan import model
+from ckan.tests import factories
+
+from ckanext.dalrrd_emc_dcpr import saved_searches
+
+pytestmark = pytest.mark.integration
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_list_saved_searches_uses_keyset_pagination():
+    user = factories.User(fullname="Saved Searcher")
+    other_user = factories.User()
+    created = [
+        saved_searches.create_saved_search(user["id"], f"q=query{i}", f"query{i}")
+        for i in range(5)
+    ]
+    saved_searches.create_saved_search(other_user["id"], "q=other", "other")
+
+    first_page = saved_searches.list_saved_searches(user["id"], limit=3)
+    second_page = saved_searches.list_saved_searches(
+        user["id"], limit=3, cursor=first_page.next_cursor
+    )
+
+    assert len(first_page.items) == 3
+    assert len(second_page.items) == 2
+    assert second_page.next_cursor is None
+    listed = first_page.items + second_page.items
+    assert [s.id for s in listed] == [s.saved_search_id for s in reversed(created)]
+    assert listed[0].owner_name == user["name"]
+    assert listed[0].owner_display_name == "Saved Searcher"
+    all_searches = saved_searches.list_saved_searches(None, limit=10)
+    assert len(all_searches.items) == 6
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_delete_saved_search_requires_ownership():
+    owner = factories.User()
+    other_user = factories.User()
+    saved_search = saved_searches.create_saved_search(owner["id"], "q=a", "a")
+    other_user_obj = model.User.get(other_user["id"])
+    owner_obj = model.User.get(owner["id"])
+
+    assert not saved_searches.delete_saved_search(
+        saved_search.saved_search_id, other_user_obj
+    )
+    assert saved_searches.delete_saved_search(saved_search.saved_search_id, owner_obj)
@@ -0,0 +1,175 @@
+import datetime as dt
+
+import pytest
+from sqlalchemy import func
+
+from ckan import model
+from ckan.tests import factories, helpers
+
+from ckanext.dalrrd_emc_dcpr import stats
+
+pytestmark = pytest.mark.integration
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_refresh_stats_is_incremental(monkeypatch):
+    monkeypatch.setattr(stats, "_WATERMARK_SAFETY_MARGIN", dt.timedelta(0))
+    organization = factories.Organization()
+    factories.Dataset(owner_org=organization["id"])
+    stats.refresh_stats(rebuild=True)
+    assert _get_current_week_stats().created == 1
+
+    factories.Dataset(owner_org=organization["id"])
+    stats.refresh_stats()
+    assert _get_current_week_stats().created == 2
+    # no new activities, refreshing again must not count anything twice
+    stats.refresh_stats()
+    current_week_stats = _get_current_week_stats()
+    assert current_week_stats.created == 2
+    assert current_week_stats.total == 2
+    assert stats.get_last_refreshed() is not None
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_refresh_stats_stores_leaderboards(monkeypatch):
+    monkeypatch.setattr(stats, "_WATERMARK_SAFETY_MARGIN", dt.timedelta(0))
+    organization = factories.Organization(title="Some organization")
+    user = factories.User(fullname="Some user")
+    factories.Dataset(
+        owner_org=organization["id"],
+        tags=[{"name": "water"}],
+        user=user,
+    )
+    stats.refresh_stats(rebuild=True)
+    top_tags = stats.get_leaderboard(stats.LeaderboardWidget.TOP_TAGS)
+    assert [(t.name, t.value) for t in top_tags] == [("water", 1)]
+    creators = stats.get_leaderboard(stats.LeaderboardWidget.TOP_PACKAGE_CREATORS)
+    assert [(u.name, u.title, u.value) for u in creators] == [
+        (user["name"], "Some user", 1)
+    ]
+    largest_groups = stats.get_leaderboard(stats.LeaderboardWidget.LARGEST_GROUPS)
+    assert [(g.name, g.title, g.value) for g in largest_groups] == [
+        (organization["name"], "Some organization", 1)
+    ]
+
+
+@pytest.mark.usefixtures("emc_clean_db", "with_plugins")
+def test_weekly_package_stats_match_legacy_implementation(monkeypatch):
+    monkeypatch.setattr(stats, "_WATERMARK_SAFETY_MARGIN", dt.timedelta(0))
+    organization = factories.Organization()
+    datasets = [factories.Dataset(owner_org=organization["id"]) for _ in range(4)]
+    helpers.call_action(
+        "package_patch", id=datasets[0]["id"], notes="changed description"
+    )
+    helpers.call_action("package_delete", id=datasets[1]["id"])
+    _shift_activities(datasets[0]["id"], dt.timedelta(days=-14))
+    _shift_activities(datasets[1]["id"], dt.timedelta(days=-7))
+    _shift_activities(datasets[2]["id"], dt.timedelta(days=-7))
+    stats.refresh_stats(rebuild=True)
+
+    weekly_stats = stats.get_weekly_package_stats()
+
+    assert [(s.week, s.created - s.deleted, s.total) for s in weekly_stats] == (
+        _legacy_num_packages_by_week()
+    )
+    assert [(s.week, s.revisions) for s in weekly_stats] == [
+        (week, num) for week, _, num, _ in _legacy_by_week(_legacy_revisions())
+    ]
+
+
+def _shift_activities(package_id: str, delta: dt.timedelta):
+    for activity in model.Session.query(model.Activity).filter(
+        model.Activity.object_id == package_id
+    ):
+        activity.timestamp = activity.timestamp + delta
+    model.Session.commit()
+
+
+def _legacy_first_activities(activity_type=None):
+    query = (
+        model.Session.query(model.Package.id, func.min(model.Activity.timestamp))
+        .join(model.Activity, model.Activity.object_id == model.Package.id)
+        .group_by(model.Package.id)
+        .order_by(func.min(model.Activity.timestamp))
+    )
+    if activity_type is not None:
+        query = query.filter(model.Activity.activity_type == activity_type)
+    return [(pkg_id, timestamp.date()) for pkg_id, timestamp in query.all()]
+
+
+def _legacy_revisions():
+    query = (
+        model.Session.query(model.Package.id, model.Activity.timestamp)
+        .join(model.Activity, model.Activity.object_id == model.Package.id)
+        .order_by(model.Activity.timestamp)
+    )
+    return [(pkg_id, timestamp.date()) for pkg_id, timestamp in query.all()]
+
+
+def _legacy_by_week(objects):
+    """Port of the previous `sys_stats.get_by_week()` python implementation"""
+    first_date = objects[0][1] if objects else dt.date.today()
+    week_commences = stats.get_date_week_started(first_date)
+    week_ends = week_commences + dt.timedelta(days=7)
+    weekly_pkg_ids = []
+    pkg_id_stack = []
+    cumulative_num_pkgs = 0
+
+    def build_weekly_stats(week_commences, pkg_ids):
+        nonlocal cumulative_num_pkgs
+        cumulative_num_pkgs += len(pkg_ids)
+        return (
+            week_commences.strftime(stats.DATE_FORMAT),
+            pkg_ids,
+            len(pkg_ids),
+            cumulative_num_pkgs,
+        )
+
+    for pkg_id, date_ in objects:
+        if date_ >= week_ends:
+            weekly_pkg_ids.append(build_weekly_stats(week_commences, pkg_id_stack))
+            pkg_id_stack = []
+            week_commences = week_ends
+            week_ends = week_commences + dt.timedelta(days=7)
+        pkg_id_stack.append(pkg_id)
+    weekly_pkg_ids.append(build_weekly_stats(week_commences, pkg_id_stack))
+    today = dt.date.today()
+    while week_ends <= today:
+        week_commences = week_ends
+        week_ends = week_commences + dt.timedelta(days=7)
+        weekly_pkg_ids.append(build_weekly_stats(week_commences, []))
+    return weekly_pkg_ids
+
+
+def _legacy_num_packages_by_week():
+    """Port of the previous `sys_stats.get_num_packages_by_week()` implementation"""
+    new_by_week = {
+        week: len(ids)
+        for week, ids, _, _ in _legacy_by_week(_legacy_first_activities())
+    }
+    deleted_by_week = {
+        week: len(ids)
+        for week, ids, _, _ in _legacy_by_week(
+            _legacy_first_activities("deleted package")
+        )
+    }
+    week_ends = dt.datetime.strptime(
+        min(min(new_by_week), min(deleted_by_week)), stats.DATE_FORMAT
+    ).date()
+    today = dt.date.today()
+    cumulative_num_pkgs = 0
+    weekly_numbers = []
+    while week_ends <= today:
+        week = week_ends.strftime(stats.DATE_FORMAT)
+        week_ends += dt.timedelta(days=7)
+        num_pkgs = new_by_week.get(week, 0) - deleted_by_week.get(week, 0)
+        cumulative_num_pkgs += num_pkgs
+        weekly_numbers.append((week, num_pkgs, cumulative_num_pkgs))
+    return weekly_numbers
+
+
+def _get_current_week_stats() -> stats.WeeklyPackageStats:
+    weekly_stats = stats.get_weekly_package_stats()
+    current_week = stats.get_date_week_started(dt.date.today())
+    assert weekly_stats[-1].week == current_week.strftime(stats.DATE_FORMAT)
+    return weekly_stats[-1]
@@ -0,0 +1,57 @@
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import caching
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.mark.parametrize(
+    "first_user, second_user, expected_hit",
+    [
+        pytest.param(None, mock.MagicMock(sysadmin=True), False, id="anon-sysadmin"),
+        pytest.param(None, None, True, id="anon-anon"),
+        pytest.param(
+            mock.MagicMock(sysadmin=True),
+            mock.MagicMock(sysadmin=True),
+            True,
+            id="sysadmin-sysadmin",
+        ),
+    ],
+)
+def test_search_cache_is_keyed_by_permission_labels(
+    first_user, second_user, expected_hit
+):
+    cache = caching.SearchCache()
+    data_dict = {"q": "*:*", "include_private": True}
+    with mock.patch.object(
+        caching.toolkit,
+        "config",
+        {caching.SEARCH_CACHE_BACKEND_CONFIG_KEY: "memory"},
+    ), mock.patch.object(caching.toolkit, "get_action") as mock_get_action, (
+        mock.patch.object(caching.lib_plugins, "get_permission_labels")
+    ) as mock_labels:
+        mock_labels.return_value.get_user_dataset_labels.return_value = ["public"]
+        mock_get_action.return_value.return_value = {"count": 1}
+        cache.package_search(data_dict, first_user)
+        result = cache.package_search(data_dict, second_user)
+    assert result == {"count": 1}
+    assert cache.metrics.as_dict() == {
+        "hits": 1 if expected_hit else 0,
+        "misses": 1 if expected_hit else 2,
+    }
+
+
+def test_search_cache_invalidate():
+    cache = caching.SearchCache()
+    data_dict = {"q": "featured:true", "rows": 5}
+    with mock.patch.object(caching.toolkit, "config", {}), mock.patch.object(
+        caching.toolkit, "get_action"
+    ) as mock_get_action:
+        cache.package_search(data_dict)
+        cache.package_search(data_dict)
+        cache.invalidate()
+        cache.package_search(data_dict)
+    assert mock_get_action.return_value.call_count == 2
+    assert cache.metrics.as_dict() == {"hits": 1, "misses": 2}
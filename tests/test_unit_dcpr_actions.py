@@ -0,0 +1,77 @@
+import datetime as dt
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr.logic.action.dcpr import get as dcpr_get_actions
+
+pytestmark = pytest.mark.unit
+
+
+def test_dcpr_request_status_counts():
+    user_obj = mock.MagicMock(id="user1", sysadmin=False)
+    context = {"model": mock.MagicMock(), "auth_user_obj": user_obj}
+    grouped_counts = {
+        ("ACCEPTED", "user1"): 2,
+        ("REJECTED", "user2"): 1,
+        ("UNDER_PREPARATION", "user1"): 4,
+        ("AWAITING_NSIF_REVIEW", "user2"): 3,
+    }
+
+    def fake_check_access(auth_function, context, data_dict):
+        if auth_function == "dcpr_request_list_under_preparation_auth":
+            raise dcpr_get_actions.toolkit.NotAuthorized
+
+    dcpr_get_actions.invalidate_dcpr_request_status_counts()
+    with mock.patch.object(
+        dcpr_get_actions, "_get_status_owner_counts", return_value=grouped_counts
+    ) as mock_get_counts, mock.patch.object(
+        dcpr_get_actions.toolkit, "check_access", side_effect=fake_check_access
+    ):
+        result = dcpr_get_actions.dcpr_request_status_counts(context, {})
+        dcpr_get_actions.dcpr_request_status_counts(context, {})
+    dcpr_get_actions.invalidate_dcpr_request_status_counts()
+    assert mock_get_counts.call_count == 1
+    assert result == {
+        "public": 3,
+        "under_preparation": None,
+        "awaiting_nsif_moderation": 3,
+        "awaiting_csi_moderation": 0,
+        "mine": 6,
+        "by_status": None,
+    }
+
+
+def test_dcpr_request_list_cursor_roundtrip():
+    request_obj = mock.MagicMock(
+        submission_date=dt.datetime(2022, 3, 1, 10, 30),
+        nsif_review_date=None,
+        csi_moderation_date=None,
+        proposed_project_name="A project",
+        csi_reference_id="some-id",
+    )
+    cursor = dcpr_get_actions._encode_cursor(request_obj)
+    assert dcpr_get_actions._decode_cursor(cursor) == [
+        dt.datetime(2022, 3, 1, 10, 30),
+        None,
+        None,
+        "A project",
+        "some-id",
+    ]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        pytest.param("not-a-cursor", id="not-base64"),
+        pytest.param("WzEsIDJd", id="wrong-length"),
+        pytest.param("WzEsIDIsIDMsIDQsIDVd", id="non-string-date"),
+        pytest.param(
+            "WyJub3QtYS1kYXRlIiwgbnVsbCwgbnVsbCwgImEiLCAiYiJd",
+            id="invalid-date",
+        ),
+    ],
+)
+def test_dcpr_request_list_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        dcpr_get_actions._decode_cursor(cursor)
@@ -0,0 +1,163 @@
+import datetime as dt
+from concurrent import futures
+from unittest import mock
+
+import jinja2
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import email_notifications
+from ckanext.dalrrd_emc_dcpr.cli import utils as cli_utils
+
+pytestmark = pytest.mark.unit
+
+
+def _digest(name, num_activities):
+    return email_notifications.PendingDigest(
+        user_id=f"{name}-id",
+        name=name,
+        display_name=name,
+        email=f"{name}@fake.com",
+        num_activities=num_activities,
+    )
+
+
+def test_send_activity_digests_commits_once_per_chunk():
+    digests = [_digest(f"user{i}", i + 1) for i in range(5)]
+    config = {
+        email_notifications.DIGEST_CHUNK_SIZE_CONFIG_KEY: "2",
+        email_notifications.DIGEST_MAX_WORKERS_CONFIG_KEY: "1",
+    }
+    with mock.patch.object(
+        email_notifications, "get_pending_digests", return_value=digests
+    ), mock.patch.object(
+        email_notifications, "_render_digest", return_value={}
+    ), mock.patch.object(
+        email_notifications, "send_notification"
+    ) as mock_send, mock.patch.object(
+        email_notifications, "_mark_digests_sent"
+    ) as mock_mark_sent, mock.patch.object(
+        email_notifications, "get_jinja_env"
+    ), mock.patch.object(
+        email_notifications.mail_delivery, "mail_session"
+    ), mock.patch.object(
+        email_notifications.toolkit, "config", config
+    ):
+        result = email_notifications.send_activity_digests()
+    assert mock_send.call_count == 5
+    assert [c[0][0] for c in mock_mark_sent.call_args_list] == [
+        ["user0-id", "user1-id"],
+        ["user2-id", "user3-id"],
+        ["user4-id"],
+    ]
+    assert result.num_users == 5
+    assert result.num_activities == 15
+    assert result.num_sent == 5
+    assert result.num_failed == 0
+
+
+def test_send_activity_digests_dry_run_does_not_send():
+    with mock.patch.object(
+        email_notifications,
+        "get_pending_digests",
+        return_value=[_digest("user1", 3), _digest("user2", 4)],
+    ), mock.patch.object(
+        email_notifications, "send_digest_chunk"
+    ) as mock_send_chunk, mock.patch.object(
+        email_notifications, "_mark_digests_sent"
+    ) as mock_mark_sent, mock.patch.object(
+        email_notifications.toolkit, "config", {}
+    ):
+        result = email_notifications.send_activity_digests(dry_run=True)
+    mock_send_chunk.assert_not_called()
+    mock_mark_sent.assert_not_called()
+    assert result.dry_run
+    assert result.num_users == 2
+    assert result.num_activities == 7
+    assert result.num_sent == 0
+
+
+def test_send_digest_chunk_skips_failed_digests():
+    digests = [_digest("user1", 2), _digest("user2", 2), _digest("user3", 5)]
+
+    def send(user, notification):
+        if user["name"] == "user2":
+            raise email_notifications.mail_delivery.MailerException("refused")
+
+    with mock.patch.object(
+        email_notifications, "_render_digest", return_value={}
+    ) as mock_render, mock.patch.object(
+        email_notifications, "send_notification", side_effect=send
+    ), mock.patch.object(
+        email_notifications, "get_jinja_env"
+    ), mock.patch.object(
+        email_notifications.mail_delivery, "mail_session"
+    ):
+        sent_user_ids, num_failed = email_notifications.send_digest_chunk(digests)
+    assert sent_user_ids == ["user1-id", "user3-id"]
+    assert num_failed == 1
+    # digests with the same number of activities share their rendered content
+    assert mock_render.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        pytest.param("2 days", dt.timedelta(days=2), id="days"),
+        pytest.param("4:35:00", dt.timedelta(hours=4, minutes=35), id="hms"),
+        pytest.param(
+            "7 days, 3:23:34",
+            dt.timedelta(days=7, hours=3, minutes=23, seconds=34),
+            id="days-and-hms",
+        ),
+    ],
+)
+def test_string_to_timedelta(value, expected):
+    assert email_notifications.string_to_timedelta(value) == expected
+
+
+def test_render_notifications_renders_shared_templates_once():
+    num_renders = {"subject": 0, "body": 0}
+
+    def count(value, template_kind):
+        num_renders[template_kind] += 1
+        return value
+
+    jinja_env = jinja2.Environment(
+        loader=jinja2.DictLoader(
+            {
+                "subject.txt": "{{ title|count('subject') }}",
+                "body.txt": "Hi {{ recipient.name|count('body') }}, see {{ title }}",
+            }
+        )
+    )
+    jinja_env.filters["count"] = count
+    email_notifications.get_template_variables.cache_clear()
+    with mock.patch.object(
+        email_notifications, "get_jinja_env", return_value=jinja_env
+    ):
+        result = email_notifications.render_notifications(
+            "subject.txt",
+            "body.txt",
+            context={"title": "A request"},
+            recipients=[{"name": "user1"}, {"name": "user2"}, {"name": "user3"}],
+            recipient_variable="recipient",
+        )
+    email_notifications.get_template_variables.cache_clear()
+    assert [(subject, body) for _, subject, body in result] == [
+        ("A request", "Hi user1, see A request"),
+        ("A request", "Hi user2, see A request"),
+        ("A request", "Hi user3, see A request"),
+    ]
+    assert num_renders == {"subject": 1, "body": 3}
+
+
+def test_jinja_env_is_built_once_per_process():
+    with mock.patch.object(cli_utils, "_jinja_env", None), mock.patch.object(
+        cli_utils, "_build_jinja_env", side_effect=lambda: object()
+    ) as mock_build:
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            environments = list(
+                executor.map(lambda _: cli_utils.get_jinja_env(), range(50))
+            )
+    assert mock_build.call_count == 1
+    assert len({id(env) for env in environments}) == 1
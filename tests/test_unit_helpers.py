@@ -1,4 +1,7 @@
+from unittest import mock
+
 import pytest
+from werkzeug.datastructures import MultiDict
 
 from ckanext.dalrrd_emc_dcpr import helpers
 
@@ -22,3 +25,28 @@ pytestmark = pytest.mark.unit
 )
 def test_convert_geojson_to_bbox(value, expected):
     assert helpers.convert_geojson_to_bbox(value) == expected
+
+
+def test_dashboard_packages_pager_url_keeps_query_args():
+    request = mock.MagicMock(
+        args=MultiDict(
+            [("id", "from-query"), ("tags", "a"), ("tags", "b"), ("page", "3")]
+        ),
+        endpoint="dashboard.datasets",
+        view_args={"id": "user1"},
+    )
+    with mock.patch.object(helpers.toolkit, "request", request), mock.patch.object(
+        helpers.h, "get_page_number", return_value=3
+    ), mock.patch.object(helpers.h, "url_for") as mock_url_for, mock.patch.object(
+        helpers.h, "Page"
+    ) as mock_page, mock.patch.object(
+        helpers, "get_user_dashboard_packages", return_value=[]
+    ), mock.patch.object(
+        helpers, "get_user_dashboard_packages_count", return_value=0
+    ):
+        helpers.get_user_dashboard_packages_page("user1")
+        pager_url = mock_page.call_args.kwargs["url"]
+        pager_url(page=4)
+    mock_url_for.assert_called_once_with(
+        "dashboard.datasets", id="user1", tags=["a", "b"], page=4
+    )
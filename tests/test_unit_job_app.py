@@ -0,0 +1,57 @@
+from unittest import mock
+
+import click
+import pytest
+
+import ckanext.dalrrd_emc_dcpr as dalrrd_emc_dcpr
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def reset_job_app():
+    dalrrd_emc_dcpr._job_app = None
+    yield
+    dalrrd_emc_dcpr._job_app = None
+
+
+def test_provide_request_context_builds_app_once(reset_job_app):
+    @dalrrd_emc_dcpr.provide_request_context
+    def job(context, value):
+        return context, value
+
+    with mock.patch.object(
+        dalrrd_emc_dcpr, "make_app"
+    ) as mock_make_app, mock.patch.object(
+        dalrrd_emc_dcpr.job_metrics, "record_job"
+    ) as mock_record_job:
+        first_context, first_value = job(1)
+        _, second_value = job(2)
+    assert mock_make_app.call_count == 1
+    request_context = mock_make_app.return_value._wsgi_app.test_request_context
+    assert request_context.call_count == 2
+    assert first_context == request_context.return_value.__enter__.return_value
+    assert (first_value, second_value) == (1, 2)
+    assert [c.args[0] for c in mock_record_job.call_args_list] == ["job", "job"]
+
+
+def test_get_job_app_reuses_cli_app(reset_job_app):
+    cli_app = mock.MagicMock()
+    with mock.patch.object(dalrrd_emc_dcpr, "make_app") as mock_make_app:
+        with click.Context(click.Command("worker"), obj=mock.MagicMock(app=cli_app)):
+            result = dalrrd_emc_dcpr.get_job_app()
+    assert result is cli_app
+    mock_make_app.assert_not_called()
+
+
+def test_provide_request_context_records_failed_jobs(reset_job_app):
+    @dalrrd_emc_dcpr.provide_request_context
+    def job(context):
+        raise RuntimeError("boom")
+
+    with mock.patch.object(dalrrd_emc_dcpr, "make_app"), mock.patch.object(
+        dalrrd_emc_dcpr.job_metrics, "record_job"
+    ) as mock_record_job:
+        with pytest.raises(RuntimeError):
+            job()
+    mock_record_job.assert_called_once()
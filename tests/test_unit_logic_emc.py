@@ -1,21 +1,45 @@
-import pkg_resources
 import pytest
 from unittest import mock
 
+from ckanext.dalrrd_emc_dcpr import build_info
 from ckanext.dalrrd_emc_dcpr.logic.action import emc
 
 pytestmark = pytest.mark.unit
 
 
-@mock.patch("ckanext.dalrrd_emc_dcpr.logic.action.emc.os", autospec=True)
-@mock.patch("ckanext.dalrrd_emc_dcpr.logic.action.emc.pkg_resources", autospec=True)
-def test_show_version(mock_pkg_resources, mock_os):
+@mock.patch("ckanext.dalrrd_emc_dcpr.build_info.os", autospec=True)
+@mock.patch("ckanext.dalrrd_emc_dcpr.build_info.metadata", autospec=True)
+def test_show_version(mock_metadata, mock_os):
     fake_git_sha = "phony git sha"
     fake_version = "phony version"
     mock_os.getenv.return_value = fake_git_sha
-    mock_pkg_resources_working_set = mock.MagicMock(pkg_resources.WorkingSet)
-    mock_pkg_resources_working_set.version = fake_version
-    mock_pkg_resources.require.return_value = [mock_pkg_resources_working_set]
+    mock_metadata.version.return_value = fake_version
+    build_info.load_build_info({})
     result = emc.show_version()
     assert result["git_sha"] == fake_git_sha
     assert result["version"] == fake_version
+
+
+@pytest.mark.parametrize(
+    "release_channel, expected",
+    [
+        pytest.param("development", "v1.0.0-rc", id="development"),
+        pytest.param("main", "v0.9.0", id="main"),
+        pytest.param("other", "", id="unknown"),
+    ],
+)
+def test_load_build_info_release(tmp_path, release_channel, expected):
+    releases_path = tmp_path / "releases.txt"
+    releases_path.write_text(
+        '{"latest_release": "v0.9.0", "latest_release_candidate": "v1.0.0-rc"}'
+    )
+    with mock.patch.object(build_info, "_RELEASES_FILE_PATH", releases_path):
+        info = build_info.load_build_info(
+            {
+                build_info.RELEASE_CHANNEL_CONFIG_KEY: release_channel,
+                "ckan.site_author": "someone",
+            }
+        )
+    assert info.release == expected
+    assert info.seo_metatags["site_author"] == "someone"
+    assert build_info.get_build_info() is info
@@ -0,0 +1,104 @@
+import mailbox
+import smtplib
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import mail_delivery
+
+pytestmark = pytest.mark.unit
+
+_SMTP_CONFIG = {
+    "smtp.server": "smtp.example.com:587",
+    "smtp.mail_from": "emc@example.com",
+    "ckan.site_title": "SASDI EMC",
+    mail_delivery.RETRY_BACKOFF_CONFIG_KEY: "1",
+}
+
+
+def test_mail_session_reuses_connection():
+    with mock.patch.object(
+        mail_delivery.toolkit, "config", _SMTP_CONFIG
+    ), mock.patch.object(mail_delivery.smtplib, "SMTP") as mock_smtp:
+        with mail_delivery.mail_session() as session:
+            for index in range(500):
+                mail_delivery.send_email(_build_email(index))
+    assert mock_smtp.call_count == 1
+    assert mock_smtp.return_value.sendmail.call_count == 500
+    assert session.num_sent == 500
+    mock_smtp.return_value.quit.assert_called_once()
+
+
+def test_mail_session_recycles_connection_after_batch():
+    config = {**_SMTP_CONFIG, mail_delivery.MESSAGES_PER_CONNECTION_CONFIG_KEY: "2"}
+    with mock.patch.object(mail_delivery.toolkit, "config", config), mock.patch.object(
+        mail_delivery.smtplib, "SMTP"
+    ) as mock_smtp:
+        with mail_delivery.mail_session():
+            for index in range(5):
+                mail_delivery.send_email(_build_email(index))
+    assert mock_smtp.call_count == 3
+    assert mock_smtp.return_value.sendmail.call_count == 5
+
+
+def test_send_email_retries_temporary_failures():
+    with mock.patch.object(
+        mail_delivery.toolkit, "config", _SMTP_CONFIG
+    ), mock.patch.object(mail_delivery.smtplib, "SMTP") as mock_smtp, mock.patch.object(
+        mail_delivery.time, "sleep"
+    ) as mock_sleep:
+        mock_smtp.return_value.sendmail.side_effect = [
+            smtplib.SMTPServerDisconnected("gone"),
+            smtplib.SMTPResponseException(451, b"try again later"),
+            {},
+        ]
+        mail_delivery.send_email(_build_email(0))
+    assert mock_smtp.call_count == 3
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [1.0, 2.0]
+
+
+def test_send_email_does_not_retry_permanent_failures():
+    with mock.patch.object(
+        mail_delivery.toolkit, "config", _SMTP_CONFIG
+    ), mock.patch.object(mail_delivery.smtplib, "SMTP") as mock_smtp, mock.patch.object(
+        mail_delivery.time, "sleep"
+    ) as mock_sleep:
+        mock_smtp.return_value.sendmail.side_effect = smtplib.SMTPRecipientsRefused(
+            {"user-0@example.com": (550, b"no such user")}
+        )
+        with pytest.raises(mail_delivery.MailerException):
+            mail_delivery.send_email(_build_email(0))
+    assert mock_smtp.return_value.sendmail.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_maildir_backend_stores_messages(tmp_path):
+    config = {
+        **_SMTP_CONFIG,
+        mail_delivery.MAIL_BACKEND_CONFIG_KEY: "maildir",
+        mail_delivery.MAILDIR_PATH_CONFIG_KEY: str(tmp_path / "maildir"),
+    }
+    with mock.patch.object(mail_delivery.toolkit, "config", config), mock.patch.object(
+        mail_delivery.smtplib, "SMTP"
+    ) as mock_smtp:
+        with mail_delivery.mail_session():
+            mail_delivery.send_email(_build_email(0))
+            mail_delivery.send_email(_build_email(1))
+    mock_smtp.assert_not_called()
+    messages = sorted(
+        mailbox.Maildir(str(tmp_path / "maildir")), key=lambda m: str(m["To"])
+    )
+    assert [str(m["To"]) for m in messages] == [
+        "User 0 <user-0@example.com>",
+        "User 1 <user-1@example.com>",
+    ]
+    assert messages[0]["From"] == "SASDI EMC <emc@example.com>"
+
+
+def _build_email(index: int) -> mail_delivery.OutgoingEmail:
+    return mail_delivery.OutgoingEmail(
+        recipient_name=f"User {index}",
+        recipient_email=f"user-{index}@example.com",
+        subject="New activity",
+        body="Some body",
+    )
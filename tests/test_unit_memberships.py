@@ -0,0 +1,117 @@
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import helpers, memberships, user_context
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def mock_memberships_query():
+    memberships.invalidate()
+    with mock.patch.object(memberships.toolkit, "config", {}), mock.patch.object(
+        memberships.toolkit, "g", mock.MagicMock(spec=[])
+    ), mock.patch.object(memberships.model, "Session") as mock_session:
+        query = mock_session.query.return_value.join.return_value.filter.return_value
+        query.order_by.return_value.all.return_value = [
+            ("org1-id", "org1", "Org 1", "Admin"),
+            ("org2-id", "org2", "Org 2", "editor"),
+        ]
+        yield mock_session
+    memberships.invalidate()
+
+
+@pytest.mark.parametrize(
+    "org_id, role, expected",
+    [
+        pytest.param("org1", None, True),
+        pytest.param("org1-id", "admin", True),
+        pytest.param("org2", "admin", False),
+        pytest.param("org2-id", "Editor", True),
+        pytest.param("org3", None, False),
+    ],
+)
+def test_user_is_org_member(mock_memberships_query, org_id, role, expected):
+    user = mock.MagicMock(id="user1")
+    assert helpers.user_is_org_member(org_id, user, role=role) == expected
+
+
+def test_memberships_are_loaded_once(mock_memberships_query):
+    user = mock.MagicMock(id="user1")
+    for org_id in ("org1", "org2", "org3", "org4"):
+        helpers.user_is_org_member(org_id, user)
+    assert mock_memberships_query.query.call_count == 1
+    memberships.invalidate()
+    helpers.user_is_org_member("org1", user)
+    assert mock_memberships_query.query.call_count == 2
+
+
+def test_configure_sets_the_membership_cache_ttl():
+    try:
+        memberships.configure({memberships.MEMBERSHIP_CACHE_TTL_CONFIG_KEY: "5"})
+        assert memberships._membership_cache.ttl == 5
+    finally:
+        memberships.configure({})
+    assert (
+        memberships._membership_cache.ttl
+        == memberships._DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS
+    )
+
+
+@pytest.mark.parametrize(
+    "is_sysadmin, staff_org_exists, staff_org_title, expected",
+    [
+        pytest.param(True, True, "Some other org", True, id="sysadmin"),
+        pytest.param(True, False, "Missing org", False, id="sysadmin-no-staff-org"),
+        pytest.param(False, True, "Org 1", True, id="staff-org-admin"),
+        pytest.param(False, True, "Org 2", False, id="staff-org-editor"),
+        pytest.param(False, True, "Some other org", False, id="not-staff"),
+    ],
+)
+def test_user_context_is_staff_member(
+    mock_memberships_query, is_sysadmin, staff_org_exists, staff_org_title, expected
+):
+    staff_org_query = mock_memberships_query.query.return_value.filter.return_value
+    staff_org_query.first.return_value = ("staff-org-id",) if staff_org_exists else None
+    user = mock.MagicMock(id="user1", sysadmin=is_sysadmin)
+    user_context.invalidate_portal_staff_org()
+    with mock.patch.object(
+        user_context.toolkit,
+        "config",
+        {user_context.PORTAL_STAFF_ORG_CONFIG_KEY: staff_org_title},
+    ):
+        context = user_context.build_user_context(user)
+    assert context.is_staff_member == expected
+    assert context.get_role("org2-id") == "editor"
+
+
+def test_staff_org_existence_is_queried_once(mock_memberships_query):
+    staff_org_query = mock_memberships_query.query.return_value.filter.return_value
+    staff_org_query.first.return_value = ("staff-org-id",)
+    user = mock.MagicMock(id="user1", sysadmin=True)
+    user_context.invalidate_portal_staff_org()
+    for _ in range(3):
+        assert user_context.build_user_context(user).is_staff_member
+    assert staff_org_query.first.call_count == 1
+    user_context.invalidate_portal_staff_org()
+    user_context.build_user_context(user)
+    assert staff_org_query.first.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "endpoint, expected_loaded",
+    [
+        pytest.param("dataset.search", True, id="page"),
+        pytest.param("static", False, id="static"),
+        pytest.param("webassets.index", False, id="webassets"),
+        pytest.param("emc.static", False, id="blueprint-static"),
+        pytest.param(None, False, id="unmatched"),
+    ],
+)
+def test_user_context_is_not_loaded_for_static_files(endpoint, expected_loaded):
+    with mock.patch.object(
+        user_context.toolkit, "request", mock.MagicMock(endpoint=endpoint)
+    ), mock.patch.object(user_context, "load_user_context") as mock_load:
+        user_context.load_user_context_for_request()
+    assert mock_load.called == expected_loaded
@@ -1,6 +1,8 @@
+from unittest import mock
+
 import pytest
 
-from ckanext.dalrrd_emc_dcpr.plugins import emc_dcpr_plugin
+from ckanext.dalrrd_emc_dcpr.plugins import emc_dcpr_plugin, facets
 
 pytestmark = pytest.mark.unit
 
@@ -16,3 +18,52 @@ pytestmark = pytest.mark.unit
 def test_parse_date(raw_date, expected):
     result = emc_dcpr_plugin._parse_date(raw_date)
     assert result == expected
+
+
+@pytest.mark.parametrize(
+    "mode, requested, expected",
+    [
+        pytest.param("passthrough", ["tags"], ["tags", "organization"]),
+        pytest.param("passthrough", [], []),
+        pytest.param("requery", ["tags"], ["tags"]),
+    ],
+)
+def test_prepare_search_params(mode, requested, expected):
+    with mock.patch.object(
+        facets.toolkit, "config", {facets.SEARCH_FACETS_MODE_CONFIG_KEY: mode}
+    ), mock.patch.object(
+        facets, "get_facet_fields", return_value=["tags", "organization"]
+    ):
+        result = facets.prepare_search_params({"facet.field": requested})
+    assert result["facet.field"] == expected
+
+
+def test_build_search_facets_passthrough_does_not_requery():
+    raw_facets = {"tags": {"water": 3}}
+    with mock.patch.object(facets.toolkit, "config", {}), mock.patch.object(
+        facets, "_run_facets_query"
+    ) as mock_run_query:
+        avoided_before = facets.stats.as_dict()["secondary_queries_avoided"]
+        result = facets.build_search_facets({"facets": raw_facets})
+    mock_run_query.assert_not_called()
+    assert facets.stats.as_dict()["secondary_queries_avoided"] == avoided_before + 1
+    assert result == {
+        "tags": {
+            "title": "tags",
+            "items": [{"name": "water", "display_name": "water", "count": 3}],
+        }
+    }
+
+
+def test_group_title_index_only_queries_db_when_expired():
+    index = facets.GroupTitleIndex()
+    with mock.patch.object(facets.toolkit, "config", {}), mock.patch.object(
+        facets.model, "Session"
+    ) as mock_session:
+        mock_session.query.return_value.all.return_value = [("org1", "Org 1")]
+        first = index.get_titles(["org1"])
+        index.set_title("org2", "Org 2")
+        second = index.get_titles(["org1", "org2"])
+    assert first == {"org1": "Org 1"}
+    assert second == {"org1": "Org 1", "org2": "Org 2"}
+    assert mock_session.query.call_count == 1
@@ -0,0 +1,78 @@
+import datetime as dt
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import saved_search_notifications as notifications
+
+pytestmark = pytest.mark.unit
+
+
+def test_build_search_data_dict():
+    result = notifications.build_search_data_dict(
+        "q=water&organization=org1&page=2&ext_bbox=1,2,3,4",
+        dt.datetime(2022, 5, 1, 10, 30),
+    )
+    assert result["q"] == "water"
+    assert result["fq"] == 'organization:"org1"'
+    assert result["extras"] == {"ext_bbox": "1,2,3,4"}
+    assert result["fq_list"] == ["metadata_modified:{2022-05-01T10:30:00.000Z TO *]"]
+
+
+def test_build_search_data_dict_escapes_filter_values():
+    result = notifications.build_search_data_dict(
+        "tags=a%22b%5Cc", dt.datetime(2022, 5, 1, 10, 30)
+    )
+    assert result["fq"] == 'tags:"a\\"b\\\\c"'
+
+
+def _saved_search(id_, query, watermark, owner):
+    return notifications._SavedSearchToCheck(
+        id=id_,
+        title=id_,
+        search_query=query,
+        watermark=watermark,
+        owner_user=owner,
+        owner_name=owner,
+        owner_display_name=owner,
+        owner_email=f"{owner}@fake.com",
+    )
+
+
+def test_identical_queries_run_once():
+    old = dt.datetime(2022, 1, 1)
+    recent = dt.datetime(2022, 3, 1)
+    saved_searches = [
+        _saved_search("s1", "q=water", old, "user1"),
+        _saved_search("s2", "q=water", recent, "user2"),
+        _saved_search("s3", "q=soil", None, "user1"),
+    ]
+    search_response = {
+        "count": 2,
+        "results": [
+            {"name": "d1", "title": "d1", "metadata_modified": "2022-04-01T00:00:00"},
+            {"name": "d2", "title": "d2", "metadata_modified": "2022-02-01T00:00:00"},
+        ],
+    }
+    with mock.patch.object(
+        notifications, "_get_saved_searches_to_check", return_value=saved_searches
+    ), mock.patch.object(
+        notifications, "_run_search", return_value=search_response
+    ) as mock_run_search, mock.patch.object(
+        notifications, "_render_notification", return_value={}
+    ), mock.patch.object(
+        notifications, "_update_watermarks"
+    ) as mock_update_watermarks, mock.patch.object(
+        notifications.email_notifications, "send_notification"
+    ) as mock_send, mock.patch.object(
+        notifications.toolkit, "config", {}
+    ):
+        result = notifications.notify_new_saved_search_results()
+    assert mock_run_search.call_count == 1
+    assert result.num_distinct_queries == 1
+    assert result.num_notifications == 2
+    assert mock_send.call_count == 2
+    watermarks = mock_update_watermarks.call_args[0][0]
+    assert watermarks["s1"] == dt.datetime(2022, 4, 1)
+    assert watermarks["s2"] == dt.datetime(2022, 4, 1)
+    assert "s3" in watermarks
@@ -237,3 +237,18 @@ def test_get_default_spatial_search_extent(
 #     }
 
 #     return data_dict
+
+
+def test_get_org_public_records_count_uses_one_query_per_request():
+    fake_g = mock.MagicMock(spec=[])
+    with mock.patch.object(h.toolkit, "g", fake_g), mock.patch.object(
+        h.model, "Session"
+    ) as mock_session:
+        query = mock_session.query.return_value.filter.return_value.group_by
+        query.return_value.all.return_value = [("org1", 2), ("org2", 5)]
+        counts = [
+            h.get_org_public_records_count(org_id)
+            for org_id in ("org1", "org2", "org3")
+        ]
+    assert counts == [2, 5, 0]
+    assert mock_session.query.call_count == 1
@@ -0,0 +1,90 @@
+import json
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import thumbnails
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.mark.parametrize(
+    "pkg_dict, expected",
+    [
+        pytest.param(
+            {"metadata_thumbnail": "http://fake/thumb.png", "resources": []},
+            "http://fake/thumb.png",
+            id="metadata-thumbnail",
+        ),
+        pytest.param(
+            {
+                "resources": [
+                    {"format": "CSV", "url": "http://fake/data.csv"},
+                    {"format": "WMS", "url": "http://fake/wms?layers=l1&format=x"},
+                ]
+            },
+            "http://fake/wms?layers=l1&format=image%2Fpng%3B+mode%3D8bit",
+            id="wms",
+        ),
+        pytest.param(
+            {"resources": [], "organization": {"image_url": "logo.png"}},
+            "http://localhost:5000/uploads/group/logo.png",
+            id="uploaded-org-image",
+        ),
+        pytest.param(
+            {"resources": [], "organization": {"image_url": None}},
+            "/images/org.png",
+            id="default",
+        ),
+    ],
+)
+def test_get_thumbnail_url(pkg_dict, expected):
+    with mock.patch.object(
+        thumbnails.toolkit, "config", {"ckan.site_url": "http://localhost:5000"}
+    ):
+        assert thumbnails.get_thumbnail_url(pkg_dict) == expected
+
+
+def test_index_thumbnail_stores_url_in_validated_data_dict():
+    validated = {"id": "pkg1", "metadata_thumbnail": "http://fake/thumb.png"}
+    pkg_dict = {"id": "pkg1", "validated_data_dict": json.dumps(validated)}
+    with mock.patch.object(thumbnails.toolkit, "config", {}):
+        result = thumbnails.index_thumbnail(pkg_dict)
+    assert result[thumbnails.THUMBNAIL_FIELD] == "http://fake/thumb.png"
+    assert (
+        json.loads(result["validated_data_dict"])[thumbnails.THUMBNAIL_FIELD]
+        == "http://fake/thumb.png"
+    )
+
+
+def test_stored_thumbnail_takes_precedence_over_wms(tmp_path):
+    (tmp_path / "emc_thumbnails").mkdir()
+    (tmp_path / "emc_thumbnails" / "pkg1.png").write_bytes(b"fake")
+    pkg_dict = {"id": "pkg1", "resources": [{"format": "wms", "url": "http://f/w"}]}
+    config = {"ckan.storage_path": str(tmp_path), "ckan.site_url": "http://site"}
+    with mock.patch.object(thumbnails.toolkit, "config", config):
+        assert (
+            thumbnails.get_thumbnail_url(pkg_dict)
+            == "http://site/emc/thumbnails/pkg1.png"
+        )
+
+
+def test_stored_thumbnail_is_ignored_without_wms_resource(tmp_path):
+    (tmp_path / "emc_thumbnails").mkdir()
+    (tmp_path / "emc_thumbnails" / "pkg1.png").write_bytes(b"fake")
+    pkg_dict = {"id": "pkg1", "resources": [], "organization": {"image_url": None}}
+    config = {"ckan.storage_path": str(tmp_path), "ckan.site_url": "http://site"}
+    with mock.patch.object(thumbnails.toolkit, "config", config):
+        assert thumbnails.get_thumbnail_url(pkg_dict) == "/images/org.png"
+
+
+def test_delete_stored_thumbnail(tmp_path):
+    (tmp_path / "emc_thumbnails").mkdir()
+    stored = tmp_path / "emc_thumbnails" / "pkg1.png"
+    stored.write_bytes(b"fake")
+    with mock.patch.object(
+        thumbnails.toolkit, "config", {"ckan.storage_path": str(tmp_path)}
+    ):
+        thumbnails.delete_stored_thumbnail("pkg1")
+        thumbnails.delete_stored_thumbnail("pkg2")
+    assert not stored.exists()
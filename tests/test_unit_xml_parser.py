@@ -0,0 +1,79 @@
+import pytest
+
+from ckanext.dalrrd_emc_dcpr.blueprints import xml_parser
+
+pytestmark = pytest.mark.unit
+
+_ESRI_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata>
+  <Esri><ArcGISFormat>1.0</ArcGISFormat></Esri>
+  <dataIdInfo>
+    <idCitation><citId><identCode>Land cover</identCode></citId></idCitation>
+    <idAbs>Land cover of the Eastern Cape</idAbs>
+    <idPoC>
+      <rpIndName>Jane Doe</rpIndName>
+      <rpOrgName>sasdi-emc</rpOrgName>
+      <role><RoleCd value="004"/></role>
+    </idPoC>
+    <dataChar><CharSetCd value="025"/></dataChar>
+    <tpCat><TopicCatCd value="002"/></tpCat>
+    <spatRpType><SpatRepTypCd value="001"/></spatRpType>
+    <GeoBndBox>
+      <westBL>16.4</westBL><eastBL>32.9</eastBL>
+      <northBL>-22.1</northBL><southBL>-34.8</southBL>
+    </GeoBndBox>
+  </dataIdInfo>
+  <refSysInfo><idVersion>8.6.2 (10.8.1)</idVersion></refSysInfo>
+</metadata>
+"""
+
+
+def test_extract_xml_fields_reads_every_element_below_the_root(tmp_path):
+    path = tmp_path / "sans.xml"
+    path.write_text(
+        "<dataset><title>first</title><notes>notes</notes>"
+        "<title>second</title></dataset>"
+    )
+    result = xml_parser.extract_xml_fields(str(path), "sans.xml")
+    assert result == {"state": True, "fields": {"title": "second", "notes": "notes"}}
+
+
+@pytest.mark.parametrize("content", ["", "<dataset/>", "<dataset>"])
+def test_extract_xml_fields_rejects_empty_file(tmp_path, content):
+    path = tmp_path / "empty.xml"
+    path.write_text(content)
+    result = xml_parser.extract_xml_fields(str(path), "empty.xml")
+    assert result == {"state": False, "msg": "file empty.xml is empty!"}
+
+
+def test_extract_xml_fields_maps_esri_export(tmp_path):
+    path = tmp_path / "esri.xml"
+    path.write_text(_ESRI_DOCUMENT)
+    fields = xml_parser.extract_xml_fields(str(path), "esri.xml")["fields"]
+    assert fields["title"] == "Land cover"
+    assert fields["notes"] == "Land cover of the Eastern Cape"
+    assert fields["owner_org"] == "sasdi-emc"
+    assert fields["responsible_party-0-individual_name"] == "Jane Doe"
+    assert fields["contact-0-individual_name"] == "Jane Doe"
+    assert fields["responsible_party-0-role"] == "point_of_contact"
+    assert fields["topic_and_sasdi_theme-0-iso_topic_category"] == "boundaries"
+    assert (
+        fields["metadata_language_and_character_set-0-dataset_character_set"] == "UTF-8"
+    )
+    assert fields["spatial_parameters-0-spatial_representation_type"] == "001"
+    assert fields["spatial_parameters-0-spatial_reference_system"] == "8.6.2(10.8.1)"
+    assert fields["spatial"] == "-22.1,16.4,-34.8,32.9"
+    assert fields["private"] == "false"
+
+
+def test_map_xml_fields_renames_known_fields():
+    result = xml_parser.map_xml_fields(
+        {"OwnerOrg": "sasdi-emc", "owner_org": "other", "unknown": "value"}
+    )
+    assert result == {"owner_org": "sasdi-emc", "unknown": "value"}
+
+
+def test_check_fields_mapping_uses_xml_names():
+    result = xml_parser.check_fields_mapping()
+    assert "OwnerOrg" in result
+    assert "owner_org" not in result
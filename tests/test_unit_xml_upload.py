@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent import futures
+from unittest import mock
+
+import pytest
+
+from ckanext.dalrrd_emc_dcpr import xml_upload
+from ckanext.dalrrd_emc_dcpr.blueprints import xml_parser
+
+pytestmark = pytest.mark.unit
+
+
+def test_parse_spooled_file_rejects_empty_file(tmp_path):
+    spooled = tmp_path / "0000.xml"
+    spooled.write_text("")
+    result, elapsed = xml_upload.parse_spooled_file(str(spooled), "empty.xml")
+    assert result == {"state": False, "msg": "file empty.xml is empty!"}
+    assert elapsed >= 0
+
+
+def test_parse_spooled_file_reports_missing_required_fields(tmp_path):
+    spooled = tmp_path / "0000.xml"
+    spooled.write_text("<dataset><title>A dataset</title></dataset>")
+    result, _ = xml_upload.parse_spooled_file(str(spooled), "incomplete.xml")
+    assert not result["state"]
+    assert "incomplete.xml" in result["msg"]
+
+
+def test_upload_context_splits_messages_by_state():
+    upload_context = _build_upload_context(0)
+    upload_context.record(
+        xml_upload.XmlUploadFileResult(
+            1, "b.xml", xml_upload.XmlUploadFileState.INVALID, "b.xml is invalid"
+        )
+    )
+    upload_context.record(
+        xml_upload.XmlUploadFileResult(
+            0, "a.xml", xml_upload.XmlUploadFileState.CREATED, "a was created"
+        )
+    )
+    upload_context.record(
+        xml_upload.XmlUploadFileResult(
+            2, "c.txt", xml_upload.XmlUploadFileState.REJECTED, "c.txt is rejected"
+        )
+    )
+    assert upload_context.info_msgs == ["a was created"]
+    assert upload_context.err_msgs == ["b.xml is invalid", "c.txt is rejected"]
+
+
+def test_upload_context_messages_fall_back_to_the_file_state():
+    upload_context = _build_upload_context(0)
+    upload_context.record(
+        xml_upload.XmlUploadFileResult(0, "a.xml", xml_upload.XmlUploadFileState.FAILED)
+    )
+    assert upload_context.err_msgs == ["a.xml: failed"]
+
+
+def test_upload_context_accumulates_timings():
+    upload_context = _build_upload_context(0)
+    with upload_context.timed("create"):
+        pass
+    with upload_context.timed("create"):
+        pass
+    assert set(upload_context.timings) == {"create"}
+    assert upload_context.timings["create"] >= 0
+
+
+def test_concurrent_uploads_notify_each_uploader_of_their_own_results():
+    num_uploads = 50
+    num_files = 3
+    created_by = {}
+    created_by_lock = threading.Lock()
+
+    def fake_package_create(context, data_dict):
+        # give other uploads a chance to interleave
+        time.sleep(0.001)
+        with created_by_lock:
+            created_by[data_dict["title"]] = context["user"]
+        return data_dict
+
+    def process(index):
+        upload_context = _build_upload_context(index)
+        for position in range(num_files):
+            title = f"dataset {index} {position}"
+            creation = xml_parser.create_ckan_dataset({"title": title}, upload_context)
+            upload_context.record(
+                xml_upload.XmlUploadFileResult(
+                    position,
+                    f"{position}.xml",
+                    xml_upload.XmlUploadFileState.CREATED,
+                    creation["msg"],
+                )
+            )
+        xml_parser.send_email_to_creator(upload_context)
+
+    with mock.patch.object(
+        xml_parser.toolkit, "get_action", return_value=fake_package_create
+    ), mock.patch.object(
+        xml_parser.email_notifications, "send_notification"
+    ) as mock_send_notification:
+        with futures.ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(process, range(num_uploads)))
+
+    assert mock_send_notification.call_count == num_uploads
+    for title, user_name in created_by.items():
+        assert title.split()[1] == user_name.split("-")[1]
+    for call in mock_send_notification.call_args_list:
+        user, email_dict = call.args
+        index = user["display_name"].split()[-1]
+        assert user["email"] == f"user-{index}@example.com"
+        body = email_dict["body"]
+        for position in range(num_files):
+            assert f'"dataset {index} {position}"' in body
+        assert body.count("were created") == num_files
+
+
+def _build_upload_context(index: int) -> xml_upload.XmlUploadContext:
+    return xml_upload.XmlUploadContext(
+        upload_id=f"upload-{index}",
+        user_id=f"user-id-{index}",
+        user_name=f"user-{index}",
+        user_display_name=f"User {index}",
+        user_email=f"user-{index}@example.com",
+    )
+
+
+def test_create_datasets_fails_a_file_that_cannot_be_created_and_finishes():
+    upload_context = _build_upload_context(0)
+    for position in range(2):
+        upload_context.record(
+            xml_upload.XmlUploadFileResult(
+                position, f"{position}.xml", xml_upload.XmlUploadFileState.PARSED
+            )
+        )
+    created = []
+
+    def fake_package_create(context, data_dict):
+        if data_dict["title"] == "forbidden":
+            raise xml_parser.toolkit.NotAuthorized("not allowed in this organization")
+        created.append(data_dict["title"])
+        return data_dict
+
+    mock_session = mock.MagicMock()
+    execution_result = mock_session.execute.return_value
+    execution_result.fetchall.return_value = [
+        (0, '{"title": "forbidden", "name": "forbidden"}'),
+        (1, '{"title": "allowed", "name": "allowed"}'),
+    ]
+    execution_result.scalar.return_value = 0
+    execution_result.rowcount = 1
+    with mock.patch.object(
+        xml_upload.XmlUploadContext, "load", return_value=upload_context
+    ), mock.patch.object(xml_upload.model, "Session", mock_session), mock.patch.object(
+        xml_parser.toolkit, "get_action", return_value=fake_package_create
+    ), mock.patch.object(
+        xml_parser, "send_email_to_creator"
+    ) as mock_send_email:
+        xml_upload.create_datasets(upload_context.upload_id, [0, 1])
+
+    assert created == ["allowed"]
+    mock_session.rollback.assert_called_once()
+    failed = upload_context.results[0]
+    assert failed.state == xml_upload.XmlUploadFileState.FAILED
+    assert "not allowed in this organization" in failed.message
+    assert upload_context.results[1].state == xml_upload.XmlUploadFileState.CREATED
+    mock_send_email.assert_called_once_with(upload_context)
+    assert upload_context.err_msgs == [failed.message]